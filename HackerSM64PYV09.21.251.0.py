@@ -4,6 +4,9 @@ from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
 import random
 import math
+import levelgen
+from scenediff import SceneDiff
+from stacksampler import StackSampler
 
 app = Ursina()
 window.title = "ULTRA MARIO 3D BROS - Peach's Castle (HackerSM64 Edition)"
@@ -35,6 +38,10 @@ HACKER_SM64_CONFIG = {
     "fall_damage": False,
     "nonstop_stars": False
 }
+DECORATION_SEED = 1  # Layout seed for the decorative trees
+
+# Debug sampler: F5 records where the main thread spends its time for a few seconds
+sampler = StackSampler()
 
 # Create main menu with HackerSM64 options
 def create_main_menu():
@@ -89,6 +96,7 @@ def toggle_setting(setting_name, button):
     color_val = color.green if HACKER_SM64_CONFIG[setting_name] else color.red
     button.text = f'{setting_name.replace("_", " ").title()}: {status}'
     button.color = color_val
+    apply_config()
 
 def toggle_options_menu():
     global options_menu_visible
@@ -114,22 +122,24 @@ def start_game():
     message_text.enabled = True
     camera_mode_text.enabled = True
 
-# Create Peach's Castle environment with extended bounds if enabled
-def create_castle():
+# Describe Peach's Castle for the current config as {(group, index): entity kwargs}
+def describe_castle():
+    specs = {}
+    
     # Ground
     ground_size = 100 if HACKER_SM64_CONFIG["extended_bounds"] else 50
-    ground = Entity(model='plane', scale=(ground_size, 1, ground_size), texture='white_cube', 
-                   texture_scale=(10, 10), color=color.rgb(200, 200, 200))
+    specs['ground', 0] = dict(model='plane', scale=(ground_size, 1, ground_size), texture='white_cube', 
+                              texture_scale=(10, 10), color=color.rgb(200, 200, 200))
     
     # Castle walls
     wall_distance = 40 if HACKER_SM64_CONFIG["extended_bounds"] else 20
     wall_positions = [
         (wall_distance, 2.5, 0), (-wall_distance, 2.5, 0), (0, 2.5, wall_distance), (0, 2.5, -wall_distance)
     ]
-    for pos in wall_positions:
+    for i, pos in enumerate(wall_positions):
         wall_scale = (1, 5, wall_distance*2) if abs(pos[0]) > 0 else (wall_distance*2, 5, 1)
-        wall = Entity(model='cube', scale=wall_scale, 
-                     position=pos, texture='brick', texture_scale=(2, 2), collider='box')
+        specs['wall', i] = dict(model='cube', scale=wall_scale, 
+                                position=pos, texture='brick', texture_scale=(2, 2), collider='box')
     
     # Castle towers - using cubes instead of cylinders
     tower_distance = 36 if HACKER_SM64_CONFIG["extended_bounds"] else 18
@@ -137,21 +147,20 @@ def create_castle():
         (tower_distance, 5, tower_distance), (-tower_distance, 5, tower_distance), 
         (tower_distance, 5, -tower_distance), (-tower_distance, 5, -tower_distance)
     ]
-    for pos in tower_positions:
-        tower = Entity(model='cube', scale=(3, 10, 3), position=pos, color=color.pink, collider='box')
+    for i, pos in enumerate(tower_positions):
+        specs['tower', i] = dict(model='cube', scale=(3, 10, 3), position=pos, color=color.pink, collider='box')
     
     # Main castle structure
-    castle = Entity(model='cube', scale=(15, 8, 15), position=(0, 4, 0), 
-                   texture='brick', texture_scale=(2, 2), collider='box')
+    specs['castle', 0] = dict(model='cube', scale=(15, 8, 15), position=(0, 4, 0), 
+                              texture='brick', texture_scale=(2, 2), collider='box')
     
     # Castle roof - using pyramid instead of cone
-    castle_roof = Entity(model='cube', scale=(16, 10, 16), position=(0, 10, 0), color=color.red)
+    specs['castle_roof', 0] = dict(model='cube', scale=(16, 10, 16), position=(0, 10, 0), color=color.red)
     
     # Entrance
-    entrance = Entity(model='cube', scale=(5, 5, 1), position=(0, 2.5, -wall_distance), color=color.brown)
+    specs['entrance', 0] = dict(model='cube', scale=(5, 5, 1), position=(0, 2.5, -wall_distance), color=color.brown)
     
     # Platforms for platforming
-    platforms = []
     platform_positions = [
         (5, 3, 5), (-5, 3, 5), (5, 3, -5), (-5, 3, -5),
         (0, 6, 0), (10, 6, 10), (-10, 6, 10), (10, 6, -10), (-10, 6, -10),
@@ -162,12 +171,51 @@ def create_castle():
         (0, 9, 0)
     ]
     
-    for pos in platform_positions:
-        platform = Entity(model='cube', scale=(4, 0.5, 4), position=pos, 
-                         color=color.rgb(200, 150, 150), collider='box')
-        platforms.append(platform)
+    for i, pos in enumerate(platform_positions):
+        specs['platform', i] = dict(model='cube', scale=(4, 0.5, 4), position=pos, 
+                                    color=color.rgb(200, 150, 150), collider='box')
     
-    return ground, platforms
+    # The goal (crown)
+    crown_y = 18 if HACKER_SM64_CONFIG["extended_bounds"] else 12
+    specs['crown', 0] = dict(model='cube', scale=(2, 0.5, 2), position=(0, crown_y, 0),
+                             color=color.yellow, collider='box')
+    
+    # Decorative elements - using cubes instead of cylinders
+    # Tree positions are stored in [-1, 1] and scaled by the decoration range, so toggling
+    # extended bounds moves the same trees instead of replacing them
+    trees = levelgen.generate('hacker_decorations', DECORATION_SEED)['trees']
+    deco_range = 36 if HACKER_SM64_CONFIG["extended_bounds"] else 18
+    tree_count = 25 if HACKER_SM64_CONFIG["extended_bounds"] else 15
+    for i, (pos, height) in enumerate(zip(trees['position'].tolist()[:tree_count], trees['height'].tolist())):
+        specs['tree', i] = dict(model='cube', scale=(0.5, height, 0.5), 
+                                position=(pos[0] * deco_range, 0, pos[2] * deco_range), color=color.green)
+    
+    return specs
+
+castle_scene = SceneDiff()
+
+# Create Peach's Castle environment with extended bounds if enabled
+def create_castle():
+    castle_scene.apply(describe_castle())
+    return castle_scene['ground', 0], castle_scene.group('platform')
+
+# Apply a HackerSM64 config change by updating only the entities it affects
+def apply_config():
+    global ground, platforms, crown, decorations, coins_range
+    ground, platforms = create_castle()
+    crown = castle_scene['crown', 0]
+    decorations = castle_scene.group('tree')
+    
+    # Coins aren't part of the castle scene: move them into the new bounds so they stay inside the walls
+    spread = coin_range() / coins_range
+    for coin in coins:
+        coin.x *= spread
+        coin.z *= spread
+    coins_range = coin_range()
+    
+    coin_color = color.black if HACKER_SM64_CONFIG["silhouette_effect"] else color.yellow
+    for coin in coins:
+        coin.color = coin_color
 
 # Enhanced Player class with HackerSM64 features
 class Player(Entity):
@@ -287,14 +335,18 @@ class Player(Entity):
                 
             self.y += self.velocity_y * time.dt
 
+# How far out coins are scattered for the current bounds
+def coin_range():
+    return 30 if HACKER_SM64_CONFIG["extended_bounds"] else 15
+
 # Create coins with HackerSM64 silhouette effect option
 def create_coins():
+    global coins_range
+    coins_range = coin_range()
     coins = []
     for i in range(total_coins):
-        x_range = 30 if HACKER_SM64_CONFIG["extended_bounds"] else 15
-        z_range = 30 if HACKER_SM64_CONFIG["extended_bounds"] else 15
-        x = random.uniform(-x_range, x_range)
-        z = random.uniform(-z_range, z_range)
+        x = random.uniform(-coins_range, coins_range)
+        z = random.uniform(-coins_range, coins_range)
         y = random.uniform(2, 15)
         
         coin_color = color.black if HACKER_SM64_CONFIG["silhouette_effect"] else color.yellow
@@ -309,35 +361,16 @@ def create_coins():
     
     return coins
 
-# Create the goal (crown)
+# Get the goal (crown), built as part of the castle scene
 def create_goal():
-    crown_y = 18 if HACKER_SM64_CONFIG["extended_bounds"] else 12
-    crown = Entity(
-        model='cube', 
-        scale=(2, 0.5, 2), 
-        position=(0, crown_y, 0),
-        color=color.yellow,
-        collider='box'
-    )
-    return crown
+    return castle_scene['crown', 0]
 
 # Setup the scene
 ground, platforms = create_castle()
 player = Player()
 coins = create_coins()
 crown = create_goal()
-
-# Add some decorative elements - using cubes instead of cylinders
-decorations = []
-deco_range = 36 if HACKER_SM64_CONFIG["extended_bounds"] else 18
-for i in range(25 if HACKER_SM64_CONFIG["extended_bounds"] else 15):
-    tree = Entity(
-        model='cube', 
-        scale=(0.5, random.uniform(2, 4), 0.5), 
-        position=(random.uniform(-deco_range, deco_range), 0, random.uniform(-deco_range, deco_range)),
-        color=color.green
-    )
-    decorations.append(tree)
+decorations = castle_scene.group('tree')
 
 # UI Elements
 coins_text = Text(text=f"Coins: {coins_collected}/{total_coins}", position=(-0.8, 0.45), scale=2, enabled=False)
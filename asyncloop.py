@@ -0,0 +1,251 @@
+# ULTRA MARIO 3D BROS - Asyncio Game Loop
+# Runs a port script with an asyncio event loop in charge instead of
+# app.run(): the loop steps Panda3D's task manager (input, update, render)
+# once a frame and spends the rest of each frame on coroutines and I/O, so
+# networking, asset loading and autosave can run alongside the game without
+# threads.
+#
+#   python asyncloop.py sm64pyv0hub.py
+#   python asyncloop.py "cat'ssm64.py" --target-fps 60 --telemetry frames.jsonl
+#
+# Coroutines are started with a frame-time budget. They are cooperative, so
+# they call `await budget.checkpoint()` between pieces of work; once a
+# coroutine has used its budget for the current frame, the checkpoint holds
+# it until the next one. Everything between two checkpoints counts, so other
+# waits go through budget.wait() (or budget.sleep()), which doesn't count the
+# time waited. Blocking calls (file writes, compression) belong in
+# asyncio.to_thread() so they don't stall the frame either.
+#
+#   async def autosave(budget):
+#       while True:
+#           await budget.sleep(30)
+#           await budget.wait(asyncio.to_thread(write_save, collect_save()))
+#
+#   loop = AsyncGameLoop(app, target_fps=60)
+#   loop.spawn(autosave, budget_ms=1)
+#   asyncio.run(loop.run())
+#
+# From a tool, run_async(script, setup) does the same for any script through
+# gamerunner, calling setup(loop) to spawn the coroutines.
+import argparse
+import asyncio
+import json
+import sys
+from collections import deque
+from time import perf_counter
+from gamerunner import run_game
+
+TARGET_FPS = 60
+BUDGET_MS = 2  # Default time a coroutine may take in one frame
+WINDOW = 120  # Frames kept for the statistics
+
+
+class FrameBudget:
+    """A coroutine's share of each frame; awaited at the coroutine's checkpoints"""
+
+    def __init__(self, loop, name, seconds):
+        self.loop = loop
+        self.name = name
+        self.seconds = seconds
+        self.frame = -1
+        self.used = 0.0  # Seconds used in self.frame
+        self.resumed = perf_counter()
+        self.total = 0.0
+        self.overruns = 0  # Frames where one piece of work took more than the whole budget
+
+    @property
+    def remaining(self):
+        """Seconds left in this frame, counting the work since the last checkpoint"""
+        if self.frame != self.loop.frame:
+            return self.seconds - (perf_counter() - self.resumed)
+        return self.seconds - self.used - (perf_counter() - self.resumed)
+
+    def _account(self):
+        elapsed = perf_counter() - self.resumed
+        if self.frame != self.loop.frame:
+            self.frame = self.loop.frame
+            self.used = 0.0
+        self.used += elapsed
+        self.total += elapsed
+        if elapsed > self.seconds:
+            self.overruns += 1
+
+    async def checkpoint(self):
+        """Yield to the game and other coroutines; waits for the next frame once the budget is used"""
+        self._account()
+        if self.used >= self.seconds:
+            await self.loop.next_frame()
+        else:
+            await asyncio.sleep(0)
+        self.resumed = perf_counter()
+
+    async def next_frame(self):
+        """Wait for the next frame whatever is left of the budget"""
+        self._account()
+        await self.loop.next_frame()
+        self.resumed = perf_counter()
+
+    async def wait(self, awaitable):
+        """Await something (I/O, a thread) without counting the wait against the budget"""
+        self._account()
+        try:
+            return await awaitable
+        finally:
+            self.resumed = perf_counter()
+
+    async def sleep(self, seconds):
+        await self.wait(asyncio.sleep(seconds))
+
+
+class AsyncGameLoop:
+    def __init__(self, app, target_fps=TARGET_FPS, window=WINDOW):
+        self.app = app
+        self.interval = 1 / target_fps if target_fps else 0
+        self.frame = 0
+        self.tasks = {}  # Name -> (asyncio task, FrameBudget)
+        self.pending = []  # (name, coroutine function, seconds), started with the loop
+        self.frame_started = None  # Future the frame's waiting coroutines await
+        self.frame_ms = deque(maxlen=window)  # Whole frames
+        self.step_ms = deque(maxlen=window)  # The task manager's part of them
+        self.late_frames = 0
+        self.running = False
+
+    def spawn(self, coroutine_function, budget_ms=BUDGET_MS, name=None):
+        """Run coroutine_function(budget) alongside the game, budget_ms of each frame at most"""
+        name = name or getattr(coroutine_function, '__name__', 'coroutine')
+        if name in self.tasks or any(name == pending[0] for pending in self.pending):
+            raise ValueError(f'a coroutine called {name} is already running')
+        if self.running:
+            self._start(name, coroutine_function, budget_ms / 1000)
+        else:
+            self.pending.append((name, coroutine_function, budget_ms / 1000))
+
+    def _start(self, name, coroutine_function, seconds):
+        budget = FrameBudget(self, name, seconds)
+        task = asyncio.get_running_loop().create_task(self._run(coroutine_function, budget), name=name)
+        task.add_done_callback(lambda task, name=name: self._finished(name, task))
+        self.tasks[name] = (task, budget)
+
+    @staticmethod
+    async def _run(coroutine_function, budget):
+        budget.resumed = perf_counter()  # The budget starts counting when the coroutine does
+        return await coroutine_function(budget)
+
+    def _finished(self, name, task):
+        if not task.cancelled() and task.exception():
+            print(f'{name} failed: {task.exception()!r}', file=sys.stderr)
+
+    def next_frame(self):
+        """A future done when the next frame has been stepped"""
+        if self.frame_started is None:
+            self.frame_started = asyncio.get_running_loop().create_future()
+        return asyncio.shield(self.frame_started)
+
+    async def run(self, frames=None):
+        """Step the game every frame until it quits (or for a number of frames)"""
+        from ursina import application
+        # What app.run() would do before handing over to Panda3D
+        if application.show_ursina_splash:
+            from ursina.prefabs.splash_screen import SplashScreen
+            application.ursina_splash = SplashScreen()
+        application.load_settings()
+
+        self.running = True
+        for name, coroutine_function, seconds in self.pending:
+            self._start(name, coroutine_function, seconds)
+        self.pending = []
+        deadline = perf_counter()
+        try:
+            while frames is None or self.frame < frames:
+                began = perf_counter()
+                self.app.step()
+                self.step_ms.append((perf_counter() - began) * 1000)
+                self.frame += 1
+                if self.frame_started is not None:
+                    waiting, self.frame_started = self.frame_started, None
+                    waiting.set_result(self.frame)
+
+                # The rest of the frame goes to coroutines and I/O
+                deadline += self.interval
+                delay = deadline - perf_counter()
+                # With no target frame rate every frame runs at once, and none of them is late
+                if delay < 0 and self.interval:
+                    self.late_frames += 1
+                    if delay < -self.interval * 5:
+                        deadline = perf_counter()  # Far behind: stop trying to catch up
+                await asyncio.sleep(max(delay, 0))
+                self.frame_ms.append((perf_counter() - began) * 1000)
+        finally:
+            self.running = False
+            for task, _ in self.tasks.values():
+                task.cancel()
+            await asyncio.gather(*(task for task, _ in self.tasks.values()), return_exceptions=True)
+
+    def stats(self):
+        frame_ms = sorted(self.frame_ms) or [0]
+        return {
+            'frame': self.frame,
+            'frame_ms': {'mean': sum(frame_ms) / len(frame_ms), 'max': frame_ms[-1]},
+            'step_ms': sum(self.step_ms) / max(len(self.step_ms), 1),
+            'late_frames': self.late_frames,
+            'coroutines': {name: {'budget_ms': budget.seconds * 1000, 'total_ms': budget.total * 1000,
+                                  'overruns': budget.overruns, 'done': task.done()}
+                           for name, (task, budget) in self.tasks.items()},
+        }
+
+
+def frame_telemetry(loop, path, every=1.0):
+    """A coroutine that appends the loop's statistics to a JSON lines file, written off the game's thread"""
+
+    def append(line):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+    async def telemetry(budget):
+        while True:
+            await budget.sleep(every)
+            await budget.wait(asyncio.to_thread(append, json.dumps(loop.stats())))
+
+    return telemetry
+
+
+def run_async(script, setup=None, target_fps=TARGET_FPS, frames=None, offscreen=False, argv=()):
+    """Run script under an AsyncGameLoop, calling setup(loop) first to spawn coroutines.
+    Returns the loop's statistics when the game stops"""
+
+    def play(app, game):
+        loop = AsyncGameLoop(app, target_fps)
+        if setup:
+            setup(loop)
+        try:
+            asyncio.run(loop.run(frames))
+        except SystemExit:
+            pass  # The window was closed
+        return loop.stats()
+
+    return run_game(script, play, offscreen=offscreen, argv=argv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a port script from an asyncio event loop')
+    parser.add_argument('script')
+    parser.add_argument('--target-fps', type=float, default=TARGET_FPS, help='0 runs frames back to back')
+    parser.add_argument('--frames', type=int, help='stop after this many frames')
+    parser.add_argument('--offscreen', action='store_true', help='software rendered, no window')
+    parser.add_argument('--telemetry', help='append frame statistics to this JSON lines file every second')
+    args, script_argv = parser.parse_known_args()
+
+    def setup(loop):
+        if args.telemetry:
+            loop.spawn(frame_telemetry(loop, args.telemetry), budget_ms=1)
+
+    # Uncapped (0) leaves the script's frame pacer at its own target
+    pacing = ('--target-fps', str(args.target_fps)) if args.target_fps else ()
+    stats = run_async(args.script, setup, args.target_fps, args.frames, args.offscreen,
+                      argv=(*pacing, *script_argv))
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# ULTRA MARIO 3D BROS - Headless Benchmark
+# Runs every port script in an offscreen, software-rendered Panda3D window
+# (no GPU needed), drives it with the same scripted input for a fixed number
+# of frames and reports build time, frame times, entity and draw-call counts
+# and peak memory as JSON. Each script runs in its own process so memory
+# figures and global state don't leak between them.
+#
+#   python benchmark.py                            # every script, report to stdout
+#   python benchmark.py "cat'ssm64.py" --frames 600 --output bench.json
+#   python benchmark.py --save-baseline            # store the current numbers
+#   python benchmark.py --baseline                 # flag regressions, exit 1 if any
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter
+from gamerunner import REPO_DIR, run_game
+
+BASELINE_PATH = os.path.join(REPO_DIR, 'benchmark_baseline.json')
+DEFAULT_FRAMES = 300
+WARMUP_FRAMES = 30
+FIXED_DT = 1 / 60
+TIMEOUT = 600  # Seconds per script
+RESULT_MARKER = 'BENCHMARK_RESULT '
+# Tools that mention app.run() without being games
+TOOLS = {'benchmark.py', 'gamerunner.py', 'asyncloop.py'}
+
+# Code run in a script's namespace to get from its menu into gameplay
+START = {
+    'HackerSM64PYV09.21.251.0.py': 'start_game()',
+    'hackersm64py.py': 'start_game()',
+    "cat'ssm64.py": 'start_game()',
+    'samsoft1.0peach.py': 'start_game()',
+    'debuglevel4k.py': 'start_game()',
+    'sm64seekv0.py': 'start_game()',
+    'ultramariov0.py': 'start_game()',
+    'ultramario3dbrosv09.21.25.py': 'start_game()',
+    'deepseekpcportsm64.py': 'enter_hub()',
+}
+
+# Lower is better for all of these. A metric is a regression when it is above
+# the baseline by more than both the relative and the absolute tolerance, so
+# timing noise on cheap scripts doesn't trip it.
+TOLERANCES = {
+    'build_time_ms': (0.25, 100.0),
+    'frame_ms.mean': (0.15, 0.5),
+    'frame_ms.p99': (0.25, 2.0),
+    'entities': (0.0, 0),
+    'draw_calls': (0.0, 0),
+    'peak_memory_mb': (0.10, 10.0),
+}
+
+# One input cycle: (frames, keys held, mouse x velocity). Walks, turns, jumps
+# and runs back, which touches movement, collision and the camera in every port.
+INPUT_CYCLE = [
+    (60, ('w',), 0.0),
+    (20, ('w', 'space'), 0.0),
+    (40, ('d',), 0.01),
+    (40, ('a', 'space'), -0.01),
+    (60, ('s',), 0.0),
+    (20, (), 0.0),
+]
+
+
+def find_scripts():
+    """Every game script in the repo (the ones that start an Ursina app)"""
+    scripts = []
+    for path in sorted(glob.glob(os.path.join(REPO_DIR, '*.py'))):
+        if os.path.basename(path) in TOOLS:
+            continue
+        with open(path, encoding='utf-8', errors='replace') as f:
+            if 'app.run()' in f.read():
+                scripts.append(os.path.basename(path))
+    return scripts
+
+
+def scripted_input(frames, dt=FIXED_DT):
+    """A Recording that repeats INPUT_CYCLE for the given number of frames"""
+    from inputreplay import Recording
+    recording = Recording(seed=0, script='benchmark')
+    held = ()
+    while len(recording.frames) < frames:
+        for length, keys, turn in INPUT_CYCLE:
+            for i in range(length):
+                events = ()
+                if i == 0:
+                    events = tuple(f'{key} up' for key in held if key not in keys) + \
+                             tuple(key for key in keys if key not in held)
+                    held = keys
+                recording.frames.append((dt, (0.0, 0.0), (turn, 0.0), events))
+    del recording.frames[frames:]
+    return recording
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def draw_calls():
+    """Geoms in visible nodes under the 3D and 2D scene roots, one draw call each before batching"""
+    from ursina import application
+    count = 0
+    for root in (application.base.render, application.base.render2d):
+        for node_path in root.find_all_matches('**/+GeomNode'):
+            if not node_path.is_hidden():
+                count += node_path.node().get_num_geoms()
+    return count
+
+
+def _peak_memory_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(script, frames, warmup):
+    """Run one script in this process and return its measurements"""
+    result = {}
+
+    def benchmark_run(app, game):
+        result['build_time_ms'] = (perf_counter() - started) * 1000
+        from ursina import scene
+        from inputreplay import InputPlayer
+
+        start = START.get(script)
+        if start:
+            began = perf_counter()
+            exec(start, game.__dict__)
+            result['start_time_ms'] = (perf_counter() - began) * 1000
+
+        player = InputPlayer(scripted_input(warmup + frames), dt_mode='fixed', fixed_dt=FIXED_DT)
+        player.play()
+        frame_times = []
+        for _ in range(warmup + frames):
+            began = perf_counter()
+            app.taskMgr.step()
+            frame_times.append((perf_counter() - began) * 1000)
+        player.stop()
+
+        ordered = sorted(frame_times[warmup:])
+        result['frames'] = len(ordered)
+        result['frame_ms'] = {
+            'mean': sum(ordered) / len(ordered),
+            'p50': percentile(ordered, 50),
+            'p99': percentile(ordered, 99),
+            'max': ordered[-1],
+        }
+        result['entities'] = len(scene.entities)
+        result['draw_calls'] = draw_calls()
+
+    import ursina  # Imported first so the build time only covers the script itself
+    started = perf_counter()
+    # Fixed quality, so frame times stay comparable between runs
+    run_game(script, benchmark_run, offscreen=True, argv=('--no-pacing',))
+    result['peak_memory_mb'] = _peak_memory_mb()
+    return result
+
+
+def run_script(script, frames, warmup):
+    """Benchmark one script in a child process"""
+    command = [sys.executable, os.path.abspath(__file__), '--child', script,
+               '--frames', str(frames), '--warmup', str(warmup)]
+    try:
+        process = subprocess.run(command, capture_output=True, text=True, timeout=TIMEOUT, cwd=REPO_DIR)
+    except subprocess.TimeoutExpired:
+        return {'error': f'timed out after {TIMEOUT}s'}
+
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    error = (process.stderr.strip().splitlines() or [f'exit code {process.returncode}'])[-1]
+    return {'error': error}
+
+
+def _metric(result, name):
+    value = result
+    for part in name.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(report, baseline):
+    """Regressions as (script, metric, baseline value, new value)"""
+    regressions = []
+    for script, result in report['scripts'].items():
+        old = baseline.get('scripts', {}).get(script)
+        if old is None or 'error' in old:
+            continue
+        if 'error' in result:
+            regressions.append((script, 'error', None, result['error']))
+            continue
+        for name, (relative, absolute) in TOLERANCES.items():
+            before, after = _metric(old, name), _metric(result, name)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + relative) and after - before > absolute:
+                regressions.append((script, name, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the port scripts headlessly')
+    parser.add_argument('scripts', nargs='*', help='scripts to run (default: all of them)')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES)
+    parser.add_argument('--warmup', type=int, default=WARMUP_FRAMES)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE_PATH,
+                        help='compare against a stored baseline and exit 1 on regressions')
+    parser.add_argument('--save-baseline', nargs='?', const=BASELINE_PATH,
+                        help='store this run as the baseline')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(RESULT_MARKER + json.dumps(run_child(args.child, args.frames, args.warmup)))
+        return 0
+
+    report = {'frames': args.frames, 'warmup': args.warmup, 'fixed_dt': FIXED_DT, 'scripts': {}}
+    for script in args.scripts or find_scripts():
+        print(f'Benchmarking {script}...', file=sys.stderr)
+        report['scripts'][script] = run_script(script, args.frames, args.warmup)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f))
+        for script, name, before, after in regressions:
+            print(f'REGRESSION {script}: {name} {before} -> {after}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
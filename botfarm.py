@@ -0,0 +1,230 @@
+# ULTRA MARIO 3D BROS - Playtesting Bot Farm
+# Checks that every star can actually be reached. Each level is built once
+# offscreen to collect its box colliders and star positions. Then a search
+# agent plays it through the batched movement model in mariosim.py: starting
+# at the spawn, it tries every short input (eight directions, with and
+# without jump, held for a few frames) from every place it has reached so
+# far, a few thousand Marios per simulated frame. It reports which stars it
+# touched and the shortest input sequence it found for each.
+# Levels and seeds are spread over a multiprocessing pool.
+#
+#   python botfarm.py                                  # every level, the seeds the game plays
+#   python botfarm.py --seeds 0 1 2 3 --workers 8
+#   python botfarm.py --levels grassland "Sky High Tower" --output reach.json
+#
+# Covers the stars in deepseekpcportsm64.py's LEVEL_CONFIGS (all of them, not
+# just the three a level spawns) and the star lists of sm64pyv0hub.py's
+# levels, whose layouts depend on the seed. The hub's levels are searched
+# with its own player's speed and single jump (hub_rules()) rather than
+# MarioPlayer's air moves; the jump arc is still mariosim's, an approximation
+# of FirstPersonController's. Moving platforms are searched where they
+# start, and hazards like lava are treated as ordinary floor.
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from time import perf_counter
+import numpy as np
+from gamerunner import REPO_DIR, run_game
+import mariosim
+
+DT = 1 / 60
+SEGMENT_FRAMES = 8  # Frames each input is held for
+MAX_SEGMENTS = 60  # Search depth: 60 segments of 8 frames is 8 seconds of play
+BEAM = 2000  # Most places kept per depth, nearest an unreached star first
+CELL = 0.5  # Places closer than this count as the same place (under one segment's walk)
+FALL_LIMIT = -10  # Below this the games respawn the player, so the search gives up on it
+
+DIRECTIONS = ((), ('w',), ('s',), ('a',), ('d',), ('w', 'a'), ('w', 'd'), ('s', 'a'), ('s', 'd'))
+ACTIONS = tuple(keys + jump for keys in DIRECTIONS for jump in ((), ('space',)))
+ACTION_MASKS = np.array([mariosim.keys_from_held(keys) for keys in ACTIONS], dtype=np.uint8)
+
+
+def _deepseek_levels(game, seeds):
+    """Levels of deepseekpcportsm64.py; they don't use seeds"""
+    levels = []
+    for level_id, config in game.LEVEL_CONFIGS.items():
+        game.create_level(level_id)
+        solids = [entity for entity in game.scene.entities if entity is not game.player]
+        levels.append({
+            'script': 'deepseekpcportsm64.py', 'level': config['name'], 'seed': None,
+            'spawn': tuple(game.player.position), 'pickup_radius': 2,
+            'stars': [list(pos) for pos in config['star_positions']],
+            'spawned': min(3, len(config['star_positions'])),  # create_level() only spawns the first three
+            'colliders': mariosim.Colliders.from_entities(solids).to_lists(),
+        })
+        game.clear_level()
+    return levels
+
+
+def hub_rules(player):
+    """mariosim rules for sm64pyv0hub.py's FirstPersonController: its speed and a single jump of its
+    jump_height; improved_collision=False leaves out the double, triple and wall jumps it doesn't have"""
+    return {'speed': player.speed, 'jump_height': float(np.sqrt(2 * mariosim.GRAVITY * player.jump_height)),
+            'improved_collision': False, 'triple_jump': False}
+
+
+def _hub_levels(game, seeds):
+    """Levels of sm64pyv0hub.py, once per layout seed (by default the one LEVEL_SEEDS gives it)"""
+    levels = []
+    for name, level in game.game_manager.levels.items():
+        for seed in seeds or (game.LEVEL_SEEDS[name],):
+            level.seed = seed
+            level.create()
+            levels.append({
+                'script': 'sm64pyv0hub.py', 'level': name, 'seed': seed,
+                'spawn': (0, 2, 0), 'pickup_radius': 2,  # load_level() puts the player at (0, 2, 0)
+                'stars': [list(star.position) for star in level.stars],
+                'spawned': len(level.stars),
+                'colliders': mariosim.Colliders.from_entities(level.entities).to_lists(),
+                'rules': hub_rules(game.game_manager.player),
+            })
+            level.destroy()
+    return levels
+
+
+LEVEL_SOURCES = {
+    'deepseekpcportsm64.py': _deepseek_levels,
+    'sm64pyv0hub.py': _hub_levels,
+}
+
+
+def collect_levels(script, seeds):
+    """Build every level of a script offscreen and return their colliders and stars"""
+    return run_game(script, lambda app, game: LEVEL_SOURCES[script](game, seeds), offscreen=True,
+                    argv=('--no-pacing',))
+
+
+def place_keys(sim, grounded):
+    """One integer per Mario for its cell, whether it stands, rises or falls, and whether it can double jump"""
+    cells = np.floor(sim.position / CELL).astype(np.int64) + 2048
+    motion = np.where(grounded, 0, np.where(sim.velocity_y > 0, 1, 2))
+    return (((cells[:, 0] * 4096 + cells[:, 1]) * 4096 + cells[:, 2]) * 3 + motion) * 2 + sim.double_jump_available
+
+
+def search(level, max_segments=MAX_SEGMENTS, beam=BEAM, segment_frames=SEGMENT_FRAMES):
+    """Breadth-first search over inputs; returns {star index: (frames, [(keys, frames), ...])}"""
+    colliders = mariosim.Colliders(level['colliders']['centers'], level['colliders']['sizes'])
+    stars = np.array(level['stars'], dtype=np.float64).reshape(-1, 3)
+    radius = level['pickup_radius']
+    sim = mariosim.MarioSim(colliders, count=1, start=level['spawn'], **level.get('rules', {}))
+    frontier = sim.state()
+    history = []  # Per depth: (parent index, action index) of every place in that depth's frontier
+    visited = set()
+    found = {}
+
+    def sequence(depth, node, action, frames):
+        inputs = [(ACTIONS[action], frames)]
+        for parents, actions in reversed(history[:depth]):
+            inputs.append((ACTIONS[actions[node]], segment_frames))
+            node = parents[node]
+        return [(list(keys), frames) for keys, frames in reversed(inputs)]
+
+    for depth in range(max_segments):
+        count = len(frontier['position'])
+        if not count or len(found) == len(stars):
+            break
+        # Every place in the frontier tries every action
+        parents = np.repeat(np.arange(count), len(ACTIONS))
+        actions = np.tile(np.arange(len(ACTIONS)), count)
+        sim.restore(frontier, parents)
+        keys = ACTION_MASKS[actions]
+
+        for frame in range(segment_frames):
+            grounded = sim.step(keys, DT)
+            unreached = [index for index in range(len(stars)) if index not in found]
+            if unreached:
+                distances = np.linalg.norm(sim.position[:, None, :] - stars[unreached], axis=2)
+                for column, index in enumerate(unreached):
+                    touching = np.flatnonzero(distances[:, column] < radius)
+                    if len(touching):
+                        row = touching[0]
+                        found[index] = (depth * segment_frames + frame + 1,
+                                        sequence(depth, parents[row], actions[row], frame + 1))
+
+        alive = sim.position[:, 1] > FALL_LIMIT
+        cell_keys = place_keys(sim, grounded)
+        _, first = np.unique(cell_keys, return_index=True)
+        first = np.sort(first)
+        fresh = [row for row in first if alive[row] and cell_keys[row] not in visited]
+        visited.update(cell_keys[fresh].tolist())
+        fresh = np.array(fresh, dtype=np.int64)
+
+        unreached = [index for index in range(len(stars)) if index not in found]
+        if len(fresh) > beam and unreached:
+            distances = np.linalg.norm(sim.position[fresh, None, :] - stars[unreached], axis=2).min(axis=1)
+            fresh = fresh[np.sort(np.argsort(distances, kind='stable')[:beam])]
+        elif len(fresh) > beam:
+            fresh = fresh[:beam]
+
+        state = sim.state()
+        frontier = {name: values[fresh] for name, values in state.items()}
+        history.append((parents[fresh], actions[fresh]))
+    return found
+
+
+def check_level(level, max_segments=MAX_SEGMENTS, beam=BEAM):
+    """Search one level and report on each of its stars"""
+    began = perf_counter()
+    found = search(level, max_segments, beam)
+    stars = []
+    for index, position in enumerate(level['stars']):
+        entry = {'position': [round(value, 3) for value in position], 'spawned': index < level['spawned'],
+                 'reachable': index in found}
+        if index in found:
+            frames, inputs = found[index]
+            entry['frames'] = frames
+            entry['seconds'] = round(frames * DT, 3)
+            entry['inputs'] = inputs
+        stars.append(entry)
+    return {'script': level['script'], 'level': level['level'], 'seed': level['seed'],
+            'search_seconds': round(perf_counter() - began, 2), 'stars': stars}
+
+
+def _check(args):
+    return check_level(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that every star can be reached')
+    parser.add_argument('--levels', nargs='*', help='only these levels (by name)')
+    parser.add_argument('--seeds', nargs='*', type=int, help="layout seeds for the sm64pyv0hub levels (default: the game's LEVEL_SEEDS)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--depth', type=int, default=MAX_SEGMENTS, help=f'input segments of {SEGMENT_FRAMES} frames')
+    parser.add_argument('--beam', type=int, default=BEAM)
+    parser.add_argument('--output', default=os.path.join(REPO_DIR, 'reachability.json'))
+    args = parser.parse_args()
+
+    # Spawned processes rather than forked ones: each builds its own Panda3D app
+    context = multiprocessing.get_context('spawn')
+    # A process can only ever run one game, so each script gets a fresh one
+    with context.Pool(min(args.workers, len(LEVEL_SOURCES)), maxtasksperchild=1) as pool:
+        collected = pool.starmap(collect_levels, [(script, args.seeds) for script in LEVEL_SOURCES])
+    levels = [level for script_levels in collected for level in script_levels
+              if not args.levels or level['level'] in args.levels]
+
+    print(f'Searching {len(levels)} levels on {args.workers} workers...', file=sys.stderr)
+    with context.Pool(args.workers) as pool:
+        results = pool.map(_check, [(level, args.depth, args.beam) for level in levels])
+
+    with open(args.output, 'w') as f:
+        json.dump({'segment_frames': SEGMENT_FRAMES, 'dt': DT, 'levels': results}, f, indent=2)
+
+    unreachable = 0
+    for result in results:
+        seed = '' if result['seed'] is None else f' (seed {result["seed"]})'
+        print(f'{result["script"]} {result["level"]}{seed}: {result["search_seconds"]} s')
+        for star in result['stars']:
+            note = '' if star['spawned'] else '  [not spawned]'
+            if star['reachable']:
+                print(f'  star {star["position"]}: {star["seconds"]} s, {len(star["inputs"])} inputs{note}')
+            else:
+                unreachable += 1
+                print(f'  star {star["position"]}: UNREACHABLE{note}')
+    print(f'Report written to {args.output}')
+    return 1 if unreachable else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,14 @@ from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
 import random
 import math
+import levelgen
+from scenediff import SceneDiff
+from frameprofiler import FrameProfiler
+import inputreplay
+from scenestats import LeakDetector
+from eventtrace import EventTrace
+from enemies import EnemySwarm
+from stacksampler import StackSampler
 
 app = Ursina()
 window.title = "ULTRA MARIO 3D BROS - Peach's Castle Hub (HackerSM64 Edition)"
@@ -12,6 +20,31 @@ window.borderless = False
 window.fullscreen = False
 window.exit_button.visible = True
 
+# F3 toggles the frame-time overlay; run with --profile to record from the start
+profiler = FrameProfiler()
+
+def session_end_state():
+    return {
+        "state": state,
+        "world": current_world,
+        "stars_collected": stars_collected,
+        "lives": lives,
+        "score": player_score,
+        "player_position": [round(value, 4) for value in player.position],
+    }
+
+# Reports entities that survive a hub -> level -> hub round trip
+leak_detector = LeakDetector()
+
+# Gameplay events on a timeline with the frames (--trace or F6)
+tracer = EventTrace()
+
+# Samples the main thread's stacks for --sample-seconds; F5 in input() with the other debug keys
+sampler = StackSampler(key=None)
+
+# --record/--replay a play session (see inputreplay.py)
+input_session = inputreplay.from_argv(end_state=session_end_state)
+
 # Game states
 MENU = "menu"
 PLAYING = "playing"
@@ -27,6 +60,7 @@ lives = 3
 player_score = 0
 camera_mode = "follow"  # HackerSM64-style camera modes: follow, fixed, mario, free
 current_world = "castle_grounds"
+DECORATION_SEED = 1  # Layout seed for the courtyard trees
 
 # HackerSM64 Configuration
 HACKER_SM64_CONFIG = {
@@ -96,6 +130,7 @@ def toggle_setting(setting_name, button):
     color_val = color.green if HACKER_SM64_CONFIG[setting_name] else color.red
     button.text = f'{setting_name.replace("_", " ").title()}: {status}'
     button.color = color_val
+    apply_config()
 
 def toggle_options_menu():
     global options_menu_visible
@@ -122,13 +157,23 @@ def start_game():
     camera_mode_text.enabled = True
     world_text.enabled = True
 
-# Create Peach's Castle hub world with extended bounds
-def create_peach_castle_hub():
+# Level entrances (paintings/doors) around the courtyard, in entrance order
+LEVEL_ENTRANCES = [
+    ("bobomb_battlefield", "BOB-OMB\nBATTLEFIELD", color.green),
+    ("whomps_fortress", "WHOMP'S\nFORTRESS", color.orange),
+    ("jolly_roger_bay", "JOLLY ROGER\nBAY", color.blue),
+    ("cool_cool_mountain", "COOL, COOL\nMOUNTAIN", color.white),
+]
+
+# Describe Peach's Castle hub for the current config as {(group, index): entity kwargs}
+def describe_peach_castle_hub():
+    specs = {}
+    
     # Ground with castle courtyard texture
     ground_size = 80 if HACKER_SM64_CONFIG["extended_bounds"] else 60
-    ground = Entity(model='plane', scale=(ground_size, 1, ground_size), 
-                   texture='white_cube', texture_scale=(20, 20), 
-                   color=color.rgb(150, 200, 255))
+    specs['ground', 0] = dict(model='plane', scale=(ground_size, 1, ground_size), 
+                              texture='white_cube', texture_scale=(20, 20), 
+                              color=color.rgb(150, 200, 255))
     
     # Castle walls with battlements
     wall_distance = 35 if HACKER_SM64_CONFIG["extended_bounds"] else 25
@@ -136,7 +181,7 @@ def create_peach_castle_hub():
     wall_thickness = 2
     
     # Main castle walls
-    walls = []
+    battlement_index = 0
     for i in range(4):
         angle = i * 90
         x = math.cos(math.radians(angle)) * wall_distance
@@ -145,21 +190,20 @@ def create_peach_castle_hub():
         wall_length = wall_distance * 2 if i % 2 == 0 else wall_distance * 2
         wall_scale = (wall_length, wall_height, wall_thickness) if i % 2 == 0 else (wall_thickness, wall_height, wall_length)
         
-        wall = Entity(model='cube', scale=wall_scale, position=(x, wall_height/2, z), 
-                     texture='brick', texture_scale=(4, 2), collider='box')
-        walls.append(wall)
+        specs['wall', i] = dict(model='cube', scale=wall_scale, position=(x, wall_height/2, z), 
+                                texture='brick', texture_scale=(4, 2), collider='box')
         
         # Add battlements on top
         battlement_count = int(wall_length / 4)
         for j in range(battlement_count):
             offset = -wall_length/2 + j * 4 + 2
             if i % 2 == 0:  # North/South walls
-                battlement = Entity(model='cube', scale=(2, 2, 2), 
-                                  position=(x + offset, wall_height + 1, z))
+                position = (x + offset, wall_height + 1, z)
             else:  # East/West walls
-                battlement = Entity(model='cube', scale=(2, 2, 2), 
-                                  position=(x, wall_height + 1, z + offset))
-            battlement.color = color.red
+                position = (x, wall_height + 1, z + offset)
+            specs['battlement', battlement_index] = dict(model='cube', scale=(2, 2, 2), 
+                                                         position=position, color=color.red)
+            battlement_index += 1
     
     # Castle towers
     tower_height = 15
@@ -170,68 +214,45 @@ def create_peach_castle_hub():
         (wall_distance, tower_height/2, wall_distance)
     ]
     
-    for pos in tower_positions:
-        tower = Entity(model='cube', scale=(4, tower_height, 4), position=pos, 
-                      texture='brick', texture_scale=(1, 3), collider='box')
+    for i, pos in enumerate(tower_positions):
+        specs['tower', i] = dict(model='cube', scale=(4, tower_height, 4), position=pos, 
+                                 texture='brick', texture_scale=(1, 3), collider='box')
         # Tower roof
-        roof = Entity(model='cone', scale=(5, 4, 5), position=(pos[0], tower_height, pos[2]), color=color.red)
+        specs['tower_roof', i] = dict(model='cone', scale=(5, 4, 5), position=(pos[0], tower_height, pos[2]), color=color.red)
     
     # Main castle structure
     castle_size = 20
-    castle = Entity(model='cube', scale=(castle_size, 10, castle_size), 
-                   position=(0, 5, 0), texture='brick', texture_scale=(2, 2), collider='box')
+    specs['castle', 0] = dict(model='cube', scale=(castle_size, 10, castle_size), 
+                              position=(0, 5, 0), texture='brick', texture_scale=(2, 2), collider='box')
     
     # Castle roof
-    castle_roof = Entity(model='pyramid', scale=(castle_size+2, 8, castle_size+2), 
-                        position=(0, 10, 0), color=color.red)
+    specs['castle_roof', 0] = dict(model='pyramid', scale=(castle_size+2, 8, castle_size+2), 
+                                   position=(0, 10, 0), color=color.red)
     
     # Castle entrance (facing camera)
-    entrance = Entity(model='cube', scale=(6, 8, 1), position=(0, 4, -wall_distance), 
-                     color=color.brown, collider='box')
+    specs['castle_entrance', 0] = dict(model='cube', scale=(6, 8, 1), position=(0, 4, -wall_distance), 
+                                       color=color.brown, collider='box')
     
     # Water fountain in courtyard
-    fountain_base = Entity(model='cylinder', scale=(3, 0.5, 3), position=(0, 0.5, 0), color=color.blue)
-    fountain_center = Entity(model='cylinder', scale=(1, 2, 1), position=(0, 2, 0), color=color.light_gray)
-    
-    # Level entrances (paintings/doors) around the courtyard
-    level_entrances = []
-    
-    # Bob-omb Battlefield entrance
-    bobomb_entrance = Entity(model='cube', scale=(5, 6, 0.5), position=(-15, 3, -wall_distance + 1), 
-                            color=color.green, collider='box')
-    bobomb_sign = Text(text="BOB-OMB\nBATTLEFIELD", scale=1, position=(-15, 6, -wall_distance + 1), 
-                      background=True, background_color=color.green)
-    level_entrances.append(("bobomb_battlefield", bobomb_entrance))
-    
-    # Whomp's Fortress entrance
-    whomp_entrance = Entity(model='cube', scale=(5, 6, 0.5), position=(15, 3, -wall_distance + 1), 
-                           color=color.orange, collider='box')
-    whomp_sign = Text(text="WHOMP'S\nFORTRESS", scale=1, position=(15, 6, -wall_distance + 1), 
-                     background=True, background_color=color.orange)
-    level_entrances.append(("whomps_fortress", whomp_entrance))
-    
-    # Jolly Roger Bay entrance
-    jolly_entrance = Entity(model='cube', scale=(5, 6, 0.5), position=(-wall_distance + 1, 3, -15), 
-                           color=color.blue, collider='box')
-    jolly_sign = Text(text="JOLLY ROGER\nBAY", scale=1, position=(-wall_distance + 1, 6, -15), 
-                     background=True, background_color=color.blue)
-    level_entrances.append(("jolly_roger_bay", jolly_entrance))
-    
-    # Cool, Cool Mountain entrance
-    cool_entrance = Entity(model='cube', scale=(5, 6, 0.5), position=(-wall_distance + 1, 3, 15), 
-                          color=color.white, collider='box')
-    cool_sign = Text(text="COOL, COOL\nMOUNTAIN", scale=1, position=(-wall_distance + 1, 6, 15), 
-                    background=True, background_color=color.white)
-    level_entrances.append(("cool_cool_mountain", cool_entrance))
+    specs['fountain', 0] = dict(model='cylinder', scale=(3, 0.5, 3), position=(0, 0.5, 0), color=color.blue)
+    specs['fountain', 1] = dict(model='cylinder', scale=(1, 2, 1), position=(0, 2, 0), color=color.light_gray)
     
-    # Platforms and obstacles for platforming
-    platforms = []
+    # Level entrances: Bob-omb Battlefield, Whomp's Fortress, Jolly Roger Bay, Cool, Cool Mountain
+    entrance_positions = [
+        (-15, -wall_distance + 1), (15, -wall_distance + 1),
+        (-wall_distance + 1, -15), (-wall_distance + 1, 15)
+    ]
+    for i, ((level_name, sign_text, entrance_color), (x, z)) in enumerate(zip(LEVEL_ENTRANCES, entrance_positions)):
+        specs['level_entrance', i] = dict(model='cube', scale=(5, 6, 0.5), position=(x, 3, z), 
+                                          color=entrance_color, collider='box')
+        specs['level_sign', i] = dict(cls=Text, text=sign_text, scale=1, position=(x, 6, z), 
+                                      background=True, background_color=entrance_color)
     
+    # Platforms and obstacles for platforming
     # Central platform pyramid
     for i in range(3):
-        platform = Entity(model='cube', scale=(8-i*2, 1, 8-i*2), 
-                         position=(0, 2 + i*3, 0), color=color.rgb(200, 150, 150), collider='box')
-        platforms.append(platform)
+        specs['platform', i] = dict(model='cube', scale=(8-i*2, 1, 8-i*2), 
+                                    position=(0, 2 + i*3, 0), color=color.rgb(200, 150, 150), collider='box')
     
     # Floating platforms around courtyard
     platform_positions = [
@@ -240,12 +261,28 @@ def create_peach_castle_hub():
         (-15, 12, -15), (15, 12, -15), (-15, 12, 15), (15, 12, 15)
     ]
     
-    for pos in platform_positions:
-        platform = Entity(model='cube', scale=(3, 0.5, 3), position=pos, 
-                         color=color.rgb(180, 120, 120), collider='box')
-        platforms.append(platform)
+    for i, pos in enumerate(platform_positions, 3):
+        specs['platform', i] = dict(model='cube', scale=(3, 0.5, 3), position=pos, 
+                                    color=color.rgb(180, 120, 120), collider='box')
     
-    return ground, walls, level_entrances, platforms
+    return specs
+
+hub_scene = SceneDiff()
+
+# Create Peach's Castle hub world with extended bounds
+def create_peach_castle_hub():
+    hub_scene.apply(describe_peach_castle_hub())
+    level_entrances = [(level_name, entrance) for (level_name, _, _), entrance 
+                       in zip(LEVEL_ENTRANCES, hub_scene.group('level_entrance'))]
+    return hub_scene['ground', 0], hub_scene.group('wall'), level_entrances, hub_scene.group('platform')
+
+# Apply a HackerSM64 config change by updating only the entities it affects
+def apply_config():
+    global ground, walls, level_entrances, platforms
+    ground, walls, level_entrances, platforms = create_peach_castle_hub()
+    
+    for star in stars:
+        star.color = color.black if HACKER_SM64_CONFIG["silhouette_effect"] else color.yellow
 
 # Enhanced Player class with HackerSM64 features
 class MarioPlayer(Entity):
@@ -287,6 +324,7 @@ class MarioPlayer(Entity):
         for key, value in kwargs.items():
             setattr(self, key, value)
     
+    @profiler.timed('player')
     def update(self):
         if state != HUB_WORLD and state != PLAYING:
             return
@@ -393,6 +431,7 @@ class MarioPlayer(Entity):
                     self.position += self.wall_jump_direction * 2
                     self.wall_jump_available = False
                     create_wall_jump_effect(self.position)
+                    tracer.instant('wall jump')
                 
                 # Ground pound (HackerSM64 feature)
                 if held_keys['left shift'] and self.velocity_y > -10:
@@ -465,9 +504,13 @@ def create_stars():
     return stars
 
 # Create level content for demonstration
+def random_ground_positions(count, extent=12):
+    return [(random.uniform(-extent, extent), 0, random.uniform(-extent, extent)) for _ in range(count)]
+
 def create_demo_level(level_name):
     # Create a simple themed level based on the name
     ground = Entity(model='plane', scale=(30, 1, 30), texture='white_cube', texture_scale=(5, 5))
+    enemies.clear()
     
     if level_name == "bobomb_battlefield":
         ground.color = color.green
@@ -476,11 +519,16 @@ def create_demo_level(level_name):
             obstacle = Entity(model='cube', scale=(2, 2, 2), 
                             position=(random.uniform(-10, 10), 1, random.uniform(-10, 10)),
                             color=color.gray, collider='box')
+        enemies.spawn('goomba', random_ground_positions(6))
+        enemies.spawn('bobomb', random_ground_positions(4))
     elif level_name == "whomps_fortress":
         ground.color = color.orange
         # Create a fortress-like structure
         fortress = Entity(model='cube', scale=(10, 5, 10), position=(0, 2.5, 0), 
                          color=color.gray, collider='box')
+        # Whomps guard the fortress walls, facing out
+        enemies.spawn('whomp', [(0, 0, 8), (8, 0, 0), (0, 0, -8), (-8, 0, 0)], headings=[0, 90, 180, 270])
+        enemies.spawn('goomba', random_ground_positions(4))
     elif level_name == "jolly_roger_bay":
         ground.color = color.blue
         # Add water effect
@@ -493,6 +541,7 @@ def create_demo_level(level_name):
             snow = Entity(model='sphere', scale=(3, 1, 3), 
                          position=(random.uniform(-10, 10), 0.5, random.uniform(-10, 10)),
                          color=color.white)
+        enemies.spawn('goomba', random_ground_positions(3))
     
     return ground
 
@@ -501,22 +550,35 @@ ground, walls, level_entrances, platforms = create_peach_castle_hub()
 player = MarioPlayer()
 stars = create_stars()
 
+def enemy_hurt(kind, index):
+    global lives, state
+    lives -= 1
+    update_hud()
+    tracer.instant('enemy hit', enemy=kind)
+    if lives <= 0:
+        state = GAME_OVER
+        message_text.text = "GAME OVER! Try again!"
+        message_text.color = color.red
+
+def enemy_stomped(kind, index):
+    global player_score
+    player.velocity_y = player.jump_height * 0.7  # Bounce off
+    player_score += 100
+    update_hud()
+    tracer.instant('enemy stomp', enemy=kind)
+
+# Enemies of the themed levels, all updated together (see enemies.py)
+enemies = EnemySwarm(target=player, on_hurt=enemy_hurt, on_stomp=enemy_stomped)
+
 # Add decorative elements
 decorations = []
-for i in range(20):
-    # Trees and bushes around the courtyard
-    tree_pos = (
-        random.uniform(-30, 30),
-        0,
-        random.uniform(-30, 30)
-    )
-    # Only place trees outside the central area
-    if abs(tree_pos[0]) > 10 or abs(tree_pos[2]) > 10:
-        tree_trunk = Entity(model='cylinder', scale=(0.5, 2, 0.5), 
-                           position=tree_pos, color=color.brown)
-        tree_top = Entity(model='sphere', scale=(2, 2, 2), 
-                         position=(tree_pos[0], 3, tree_pos[2]), color=color.green)
-        decorations.extend([tree_trunk, tree_top])
+# Trees and bushes around the courtyard (the layout keeps them outside the central area)
+for tree_pos in levelgen.generate('courtyard_decorations', DECORATION_SEED)['trees']['position'].tolist():
+    tree_trunk = Entity(model='cylinder', scale=(0.5, 2, 0.5), 
+                       position=tree_pos, color=color.brown)
+    tree_top = Entity(model='sphere', scale=(2, 2, 2), 
+                     position=(tree_pos[0], 3, tree_pos[2]), color=color.green)
+    decorations.extend([tree_trunk, tree_top])
 
 # UI Elements
 stars_text = Text(text=f"Stars: {stars_collected}/{total_stars}", position=(-0.8, 0.45), scale=2, enabled=False)
@@ -537,46 +599,49 @@ for element in options_menu_elements:
 def update():
     global stars_collected, lives, player_score, state, current_world
     
+    enemies.active = state == HUB_WORLD or state == PLAYING
     if state == HUB_WORLD or state == PLAYING:
         # Check for star collisions
-        for star in stars[:]:
-            if player.intersects(star).hit:
-                stars.remove(star)
-                destroy(star)
-                stars_collected += 1
-                player_score += 100
-                stars_text.text = f"Stars: {stars_collected}/{total_stars}"
-                score_text.text = f"Score: {player_score}"
+        with profiler.scope('collectibles'):
+            for star in stars[:]:
+                if player.intersects(star).hit:
+                    stars.remove(star)
+                    destroy(star)
+                    stars_collected += 1
+                    player_score += 100
+                    update_hud()
+                    tracer.instant('star collect', stars=stars_collected)
                 
-                # Play star collection sound effect (visual feedback for now)
-                star_effect = Entity(model='sphere', scale=0.5, position=star.position, color=color.yellow)
-                star_effect.animate_scale(3, duration=0.5)
-                star_effect.animate_color(color.clear, duration=0.5)
-                destroy(star_effect, delay=0.5)
+                    # Play star collection sound effect (visual feedback for now)
+                    star_effect = Entity(model='sphere', scale=0.5, position=star.position, color=color.yellow)
+                    star_effect.animate_scale(3, duration=0.5)
+                    star_effect.animate_color(color.clear, duration=0.5)
+                    destroy(star_effect, delay=0.5)
                 
-                # HackerSM64 nonstop stars feature
-                if HACKER_SM64_CONFIG["nonstop_stars"] and stars_collected % 3 == 0:
-                    message_text.text = f"Collected {stars_collected} stars! Keep going!"
-                    message_text.color = color.yellow
-                    invoke(set_message_default, delay=2)
+                    # HackerSM64 nonstop stars feature
+                    if HACKER_SM64_CONFIG["nonstop_stars"] and stars_collected % 3 == 0:
+                        message_text.text = f"Collected {stars_collected} stars! Keep going!"
+                        message_text.color = color.yellow
+                        invoke(set_message_default, delay=2)
                 
-                # Check for victory condition
-                if stars_collected >= total_stars:
-                    state = VICTORY
-                    message_text.text = "VICTORY! You've collected all the stars!"
-                    message_text.color = color.gold
+                    # Check for victory condition
+                    if stars_collected >= total_stars:
+                        state = VICTORY
+                        message_text.text = "VICTORY! You've collected all the stars!"
+                        message_text.color = color.gold
         
         # Check for level entrance collisions
-        for level_name, entrance in level_entrances:
-            if player.intersects(entrance).hit:
-                if HACKER_SM64_CONFIG["level_unlocks"] and stars_collected >= 1:  # Require at least 1 star to enter levels
-                    enter_level(level_name)
-                elif not HACKER_SM64_CONFIG["level_unlocks"]:
-                    enter_level(level_name)
-                else:
-                    message_text.text = "You need at least 1 star to enter this level!"
-                    message_text.color = color.red
-                    invoke(set_message_default, delay=2)
+        with profiler.scope('triggers'):
+            for level_name, entrance in level_entrances:
+                if player.intersects(entrance).hit:
+                    if HACKER_SM64_CONFIG["level_unlocks"] and stars_collected >= 1:  # Require at least 1 star to enter levels
+                        enter_level(level_name)
+                    elif not HACKER_SM64_CONFIG["level_unlocks"]:
+                        enter_level(level_name)
+                    else:
+                        message_text.text = "You need at least 1 star to enter this level!"
+                        message_text.color = color.red
+                        invoke(set_message_default, delay=2)
         
         # Check for falling off the map
         if player.y < -10:
@@ -585,7 +650,7 @@ def update():
             
             if HACKER_SM64_CONFIG["fall_damage"]:
                 lives -= 1
-                lives_text.text = f"Lives: {lives}"
+                update_hud()
             
             if lives <= 0:
                 state = GAME_OVER
@@ -594,8 +659,11 @@ def update():
 
 def enter_level(level_name):
     global state, current_world
+    if state == PLAYING:
+        return  # Still standing in the entrance; the return to the hub is already scheduled
     state = PLAYING
     current_world = level_name
+    tracer.begin('level visit', level=level_name)
     world_text.text = f"World: {current_world.replace('_', ' ').title()}"
     message_text.text = f"Entering {level_name.replace('_', ' ').title()}!"
     message_text.color = color.green
@@ -608,6 +676,14 @@ def return_to_hub():
     world_text.text = f"World: {current_world.replace('_', ' ').title()}"
     message_text.text = "Welcome back to Peach's Castle!"
     message_text.color = color.white
+    tracer.end('level visit')
+    leak_detector.checkpoint('hub')
+
+@profiler.timed('hud')
+def update_hud():
+    stars_text.text = f"Stars: {stars_collected}/{total_stars}"
+    lives_text.text = f"Lives: {lives}"
+    score_text.text = f"Score: {player_score}"
 
 def set_message_default():
     if state == HUB_WORLD:
@@ -617,6 +693,7 @@ def set_message_default():
     message_text.color = color.white
 
 # Input handling
+@profiler.timed('input')
 def input(key):
     global state, stars_collected, lives, player_score, stars, camera_mode, current_world
     
@@ -635,9 +712,7 @@ def input(key):
         stars = create_stars()
         
         # Update UI
-        stars_text.text = f"Stars: {stars_collected}/{total_stars}"
-        lives_text.text = f"Lives: {lives}"
-        score_text.text = f"Score: {player_score}"
+        update_hud()
         world_text.text = f"World: {current_world.replace('_', ' ').title()}"
         set_message_default()
         
@@ -683,13 +758,14 @@ def input(key):
         if state == HUB_WORLD:
             stars_collected += 1
             player_score += 100
-            stars_text.text = f"Stars: {stars_collected}/{total_stars}"
-            score_text.text = f"Score: {player_score}"
+            update_hud()
     
     if key == 'o':  # Toggle silhouette effect
         HACKER_SM64_CONFIG["silhouette_effect"] = not HACKER_SM64_CONFIG["silhouette_effect"]
-        for star in stars:
-            star.color = color.black if HACKER_SM64_CONFIG["silhouette_effect"] else color.yellow
+        apply_config()
+    
+    if key == 'f5':  # Sample where the main thread spends its time
+        sampler.toggle()
 
 # Run the game
 app.run()
@@ -3,6 +3,8 @@
 from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
 from ursina.shaders import basic_lighting_shader
+from entityregistry import EntityRegistry, PORTAL, STAR, OBSTACLE, PLATFORM, HUD, STATIC
+from scenestats import LeakDetector
 import random
 import math
 
@@ -80,43 +82,26 @@ LEVEL_CONFIGS = {
     }
 }
 
-# Current level entities
+# Current level entities, tagged at creation so they can be queried and torn down by tag
 player = None
-stars = []
-obstacles = []
-platforms = []
-hud_elements = []
+registry = EntityRegistry()
+# Reports entities that survive a hub -> level -> hub round trip
+leak_detector = LeakDetector()
 menu_elements = []
+# One sky and sun for the whole session; the menu, hub and levels only restyle them
+sky = None
+sun = None
 
 def clear_level():
     """Clear all level entities"""
-    global player, stars, obstacles, platforms, hud_elements
+    global player
     
     if player:
         destroy(player)
+        destroy(player.cursor)  # Parented to camera.ui, so destroying the player leaves it behind
         player = None
     
-    for star in stars:
-        destroy(star)
-    stars = []
-    
-    for obstacle in obstacles:
-        destroy(obstacle)
-    obstacles = []
-    
-    for platform in platforms:
-        destroy(platform)
-    platforms = []
-    
-    for hud in hud_elements:
-        destroy(hud)
-    hud_elements = []
-    
-    # Clear other entities except UI
-    for entity in scene.entities[:]:
-        if hasattr(entity, 'model') and entity.model in ['plane', 'cube', 'sphere']:
-            if not hasattr(entity, 'eternal'):
-                destroy(entity)
+    registry.clear()
 
 def clear_menu():
     """Clear menu elements"""
@@ -127,11 +112,21 @@ def clear_menu():
         destroy(element)
     menu_elements = []
 
+def set_environment(texture='sky_default', sky_color=None):
+    """Restyle the sky, creating it and the sun the first time"""
+    global sky, sun
+    if sky is None:
+        sky = Sky()
+        sun = DirectionalLight()
+        sun.look_at(Vec3(1, -1, -1))
+    sky.texture = texture
+    sky.color = sky_color or color.white
+
 def create_menu():
     global title_text, start_btn, exit_btn
     
     clear_menu()
-    Sky(texture="sky_sunset")
+    set_environment(texture="sky_sunset")
     
     title_text = Text(
         text="ULTRA MARIO 3D BROS",
@@ -174,18 +169,18 @@ def create_menu():
 
 def create_hub():
     """Create the hub world with level paintings"""
-    global player, hud_elements
+    global player
     
     clear_level()
     
     # Create hub floor
-    Entity(model='plane', collider='box', scale=100, texture='brick', texture_scale=(10, 10))
+    registry.add(Entity(model='plane', collider='box', scale=100, texture='brick', texture_scale=(10, 10)), STATIC)
     
     # Castle walls
-    Entity(model='cube', collider='box', scale=(50, 20, 1), position=(0, 10, -25), color=color.gray)
-    Entity(model='cube', collider='box', scale=(50, 20, 1), position=(0, 10, 25), color=color.gray)
-    Entity(model='cube', collider='box', scale=(1, 20, 50), position=(-25, 10, 0), color=color.gray)
-    Entity(model='cube', collider='box', scale=(1, 20, 50), position=(25, 10, 0), color=color.gray)
+    registry.add(Entity(model='cube', collider='box', scale=(50, 20, 1), position=(0, 10, -25), color=color.gray), STATIC)
+    registry.add(Entity(model='cube', collider='box', scale=(50, 20, 1), position=(0, 10, 25), color=color.gray), STATIC)
+    registry.add(Entity(model='cube', collider='box', scale=(1, 20, 50), position=(-25, 10, 0), color=color.gray), STATIC)
+    registry.add(Entity(model='cube', collider='box', scale=(1, 20, 50), position=(25, 10, 0), color=color.gray), STATIC)
     
     # Create player in hub
     player = FirstPersonController(
@@ -220,6 +215,7 @@ def create_hub():
             collider='box'
         )
         portal.level_id = i
+        registry.add(portal, PORTAL)
         
         # Level name text
         level_text = Text(
@@ -240,7 +236,7 @@ def create_hub():
         scale=2,
         color=color.yellow
     )
-    hud_elements.append(total_stars_text)
+    registry.add(total_stars_text, HUD)
     
     lives_text = Text(
         text=f"Lives: {lives}",
@@ -249,7 +245,7 @@ def create_hub():
         scale=2,
         color=color.red
     )
-    hud_elements.append(lives_text)
+    registry.add(lives_text, HUD)
     
     instructions = Text(
         text="Walk into a painting to enter level | ESC to return to hub",
@@ -258,15 +254,16 @@ def create_hub():
         scale=1.5,
         color=color.white
     )
-    hud_elements.append(instructions)
+    registry.add(instructions, HUD)
     
     # Lighting
-    DirectionalLight().look_at(Vec3(1, -1, -1))
-    Sky()
+    set_environment()
+    
+    leak_detector.checkpoint('hub')
 
 def create_level(level_id):
     """Create a specific level"""
-    global player, stars, obstacles, platforms, hud_elements, current_level
+    global player, current_level
     
     current_level = level_id
     config = LEVEL_CONFIGS[level_id]
@@ -282,6 +279,7 @@ def create_level(level_id):
         texture_scale=(4, 4),
         color=config["ground_color"]
     )
+    registry.add(ground, STATIC)
     
     # Player
     player = FirstPersonController(
@@ -293,7 +291,6 @@ def create_level(level_id):
     )
     
     # Create stars
-    stars = []
     for pos in config["star_positions"][:3]:  # Limit to 3 stars per level
         star = Entity(
             model='sphere',
@@ -304,20 +301,19 @@ def create_level(level_id):
         )
         # Add rotation animation
         star.rotation_speed = random.uniform(20, 50)
-        stars.append(star)
+        registry.add(star, STAR)
     
     # Create obstacles based on level
-    obstacles = []
     if level_id == 2:  # Desert - Cactuses
         for pos in config["obstacles"]:
             cactus = Entity(
                 model='cube',
-                color=color.dark_green,
+                color=color.rgb32(0, 100, 0),
                 scale=(1, 3, 1),
                 position=pos,
                 collider='box'
             )
-            obstacles.append(cactus)
+            registry.add(cactus, OBSTACLE)
     
     elif level_id == 3:  # Caverns - Crystals
         for pos in config["obstacles"]:
@@ -329,7 +325,7 @@ def create_level(level_id):
                 collider='box'
             )
             crystal.rotation_speed = 15
-            obstacles.append(crystal)
+            registry.add(crystal, OBSTACLE)
     
     elif level_id == 4:  # Sky Tower - Floating platforms
         platform_positions = [
@@ -348,7 +344,7 @@ def create_level(level_id):
                 position=pos,
                 collider='box'
             )
-            platforms.append(platform)
+            registry.add(platform, PLATFORM)
     
     elif level_id == 5:  # Lava - Hazards
         for pos in config["obstacles"]:
@@ -359,7 +355,7 @@ def create_level(level_id):
                 position=pos,
                 collider='box'
             )
-            obstacles.append(lava_pool)
+            registry.add(lava_pool, OBSTACLE)
     
     elif level_id == 6:  # Rainbow Road - Moving platforms
         for i in range(5):
@@ -374,7 +370,7 @@ def create_level(level_id):
             )
             moving_platform.move_amplitude = random.uniform(5, 10)
             moving_platform.move_speed = random.uniform(0.5, 1.5)
-            platforms.append(moving_platform)
+            registry.add(moving_platform, PLATFORM)
     
     # HUD for level
     level_name_text = Text(
@@ -384,16 +380,16 @@ def create_level(level_id):
         scale=2,
         color=color.white
     )
-    hud_elements.append(level_name_text)
+    registry.add(level_name_text, HUD)
     
     stars_collected_text = Text(
-        text=f"Stars: {len(stars)} remaining",
+        text=f"Stars: {registry.count(STAR)} remaining",
         origin=(-0.5, 0.5),
         position=(-0.85, 0.4),
         scale=1.5,
         color=color.yellow
     )
-    hud_elements.append(stars_collected_text)
+    registry.add(stars_collected_text, HUD)
     
     exit_text = Text(
         text="Press ESC to return to castle",
@@ -402,14 +398,10 @@ def create_level(level_id):
         scale=1.2,
         color=color.white
     )
-    hud_elements.append(exit_text)
+    registry.add(exit_text, HUD)
     
     # Sky and lighting
-    sky = Sky()
-    if config["sky_color"]:
-        sky.color = config["sky_color"]
-    
-    DirectionalLight().look_at(Vec3(1, -1, -1))
+    set_environment(sky_color=config["sky_color"])
 
 def enter_hub():
     """Enter the hub world from menu"""
@@ -446,37 +438,33 @@ def collect_star():
     level_stars[current_level] = min(level_stars[current_level] + 1, 3)
     
     # Update HUD
-    for hud in hud_elements:
+    for hud in registry.get(HUD):
         if "Stars:" in hud.text:
-            hud.text = f"Stars: {len(stars)} remaining"
+            hud.text = f"Stars: {registry.count(STAR)} remaining"
     
     # Victory message if all stars collected
-    if len(stars) == 0:
+    if registry.count(STAR) == 0:
         victory_text = Text(
             text="LEVEL COMPLETE!\nPress ESC to return",
             origin=(0, 0),
             scale=3,
             color=color.gold
         )
-        hud_elements.append(victory_text)
+        registry.add(victory_text, HUD)
 
 def update():
-    global stars, platforms
-    
     if state == HUB and player:
         # Check for portal collisions
-        for entity in scene.entities:
-            if hasattr(entity, 'level_id'):
-                if distance(player.position, entity.position) < 3:
-                    enter_level(entity.level_id)
-                    break
+        for portal in registry.get(PORTAL):
+            if distance(player.position, portal.position) < 3:
+                enter_level(portal.level_id)
+                break
     
     elif state == PLAYING and player:
         # Check star collection
-        for star in stars[:]:
+        for star in registry.get(STAR):
             if distance(player.position, star.position) < 2:
-                stars.remove(star)
-                destroy(star)
+                registry.destroy(star)
                 collect_star()
             else:
                 # Rotate stars
@@ -484,12 +472,12 @@ def update():
                     star.rotation_y += star.rotation_speed * time.dt
         
         # Rotate crystals in level 3
-        for obstacle in obstacles:
+        for obstacle in registry.get(OBSTACLE):
             if hasattr(obstacle, 'rotation_speed'):
                 obstacle.rotation_y += obstacle.rotation_speed * time.dt
         
         # Move platforms in level 6
-        for platform in platforms:
+        for platform in registry.get(PLATFORM):
             if hasattr(platform, 'move_amplitude'):
                 platform.z = math.sin(time.time() * platform.move_speed) * platform.move_amplitude
     
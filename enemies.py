@@ -0,0 +1,432 @@
+# ULTRA MARIO 3D BROS - Enemies
+# Goombas, Bob-ombs and Whomps, all of a level's enemies in one entity. Their
+# state (position, heading, behaviour, timers) lives in NumPy arrays and is
+# updated in one batched step per frame instead of an update() per enemy.
+#
+#   enemies = EnemySwarm(target=player, on_hurt=hurt, on_stomp=bounce)
+#   enemies.spawn('goomba', [(4, 0, 6), (-3, 0, 9)])
+#   enemies.clear()                     # on leaving the level
+#
+# sm64pyv0hub.py's levels spawn the enemies their layout places (levelgen.py)
+# and give the swarm the level's navmesh.NavMesh, whose paths chasers follow
+# around the props instead of walking straight at the player.
+#
+# Behaviour has levels of detail by distance to the target: enemies within
+# NEAR get the full AI every frame, those within FAR are updated every
+# COARSE_TICKS frames with the time in between (staggered, so the same few
+# don't all update together), and farther ones are frozen until the player
+# comes back. Only near enemies can touch the player.
+#
+#   Goomba   wanders, chases the player once it sees them; stomp it
+#   Bob-omb  wanders, lights its fuse when it sees the player, chases, explodes
+#   Whomp    patrols, falls flat on the player in front of it, gets back up;
+#            stomp it while it lies flat
+#
+# Each enemy is drawn as an instance of its kind's combined model under one
+# node, moved only on frames it was updated. Running this file times frames
+# (without drawing) of cat'ssm64.py's courtyard with the batched update and
+# with one Entity per enemy:
+#
+#   python enemies.py --enemies 100 300 1000
+import argparse
+import sys
+from time import perf_counter
+import numpy as np
+from ursina import Entity, color, destroy, time
+
+KINDS = ('goomba', 'bobomb', 'whomp')
+GOOMBA, BOBOMB, WHOMP = range(len(KINDS))
+
+# Behaviour states
+WANDER, CHASE, FUSE, TOPPLE, FLAT, RISE, DEAD = range(7)
+
+NEAR = 30  # Full AI every frame within this distance of the target
+FAR = 80  # Coarse updates within this, frozen beyond
+COARSE_TICKS = 6  # Frames between updates at mid range
+MAX_DT = 0.25  # Longest step an enemy takes at once, e.g. when it wakes up from being frozen
+
+SPEED = np.array([2.0, 1.5, 1.0])  # Wandering, per kind
+CHASE_SPEED = np.array([3.5, 3.0, 1.0])
+SIGHT = np.array([10.0, 8.0, 8.0])  # How far they notice the target
+ROAM = 8  # How far they wander from where they spawned
+# Bodies for touching the target, in the enemy's own frame (x right, y up, z forward, from its feet):
+# center and half size per kind, and a whomp lying flat in front of where it stood
+BODY_CENTER = np.array([(0, 0.5, 0), (0, 0.55, 0), (0, 2, -0.5)])
+BODY_HALF_SIZE = np.array([(0.6, 0.5, 0.6), (0.5, 0.55, 0.5), (1.5, 2, 0.5)])
+FLAT_CENTER = np.array([0, 0.5, 2])
+FLAT_HALF_SIZE = np.array([1.5, 0.5, 2])
+TARGET_HALF_SIZE = np.array([0.5, 1.0, 0.5])
+
+FUSE_TIME = 3.0
+BLAST_RADIUS = 3.0
+TOPPLE_TIME = 0.5  # A whomp falling over, and getting back up
+FLAT_TIME = 2.0
+SLAM_LENGTH = 4.0  # Ground a whomp covers when it falls forward
+RESPAWN_TIME = 10.0
+HURT_COOLDOWN = 1.0
+WAYPOINT_RISE = 0.6  # Enemies don't jump: waypoints more than this above or below are ignored
+
+
+def _forward(heading):
+    """Facing direction in the xz plane for rotation_y in degrees (0 faces +z, 90 faces +x)"""
+    radians = np.radians(heading)
+    return np.stack([np.sin(radians), np.cos(radians)], axis=-1)
+
+
+def _local(offset, heading):
+    """World offsets from enemies turned into each enemy's own frame"""
+    forward = _forward(heading)
+    right = np.stack([forward[:, 1], -forward[:, 0]], axis=-1)
+    return np.stack([offset[:, 0] * right[:, 0] + offset[:, 2] * right[:, 1], offset[:, 1],
+                     offset[:, 0] * forward[:, 0] + offset[:, 2] * forward[:, 1]], axis=-1)
+
+
+def _enemy_model(kind):
+    """One combined model per kind with its origin at the feet, so each enemy is a single node"""
+    holder = Entity(eternal=True)
+    if kind == GOOMBA:
+        Entity(parent=holder, model='sphere', scale=(1.2, 0.9, 1.2), y=0.6, color=color.brown)
+        for x in (-0.3, 0.3):
+            Entity(parent=holder, model='cube', scale=(0.35, 0.2, 0.5), position=(x, 0.1, 0.1), color=color.black)
+            Entity(parent=holder, model='sphere', scale=0.2, position=(x, 0.75, 0.5), color=color.white)
+    elif kind == BOBOMB:
+        Entity(parent=holder, model='sphere', scale=1.1, y=0.6, color=color.black)
+        Entity(parent=holder, model='cube', scale=(0.1, 0.4, 0.1), y=1.3, color=color.light_gray)
+        for x in (-0.25, 0.25):
+            Entity(parent=holder, model='cube', scale=(0.3, 0.15, 0.45), position=(x, 0.08, 0), color=color.orange)
+    else:
+        # Pivot at the bottom edge in front, so pitching the node falls it forward
+        Entity(parent=holder, model='cube', scale=(3, 4, 1), position=(0, 2, -0.5), color=color.gray)
+        for x in (-0.6, 0.6):
+            Entity(parent=holder, model='cube', scale=(0.3, 0.4, 0.05), position=(x, 2.8, 0.01), color=color.white)
+    holder.combine()
+    model = holder.model
+    destroy(holder)
+    return model
+
+
+class EnemySwarm(Entity):
+    def __init__(self, target=None, on_hurt=None, on_stomp=None, near=NEAR, far=FAR, coarse_ticks=COARSE_TICKS,
+                 seed=None, navmesh=None, **kwargs):
+        super().__init__(**kwargs)
+        self.target = target
+        self.navmesh = navmesh  # navmesh.NavMesh of the level, if any: chasers follow its paths
+        self.on_hurt = on_hurt  # on_hurt(kind name, enemy index)
+        self.on_stomp = on_stomp  # on_stomp(kind name, enemy index)
+        self.near = near
+        self.far = far
+        self.coarse_ticks = coarse_ticks
+        self.active = True
+        self.rng = np.random.default_rng(seed)
+        self.clock = 0.0
+        self.frame = 0
+        self.hurt_at = -HURT_COOLDOWN
+        self.target_y = None  # Where the target was last frame, for targets without a velocity_y
+        self.target_falling = False
+        self.templates = {}  # Kind -> Entity holding the combined model, instanced per enemy
+        self.bodies = []
+        self.lod_counts = (0, 0, 0)  # Near, mid, far at the last update
+        self.update_ms = 0.0
+        self._resize(0)
+
+    def _resize(self, count):
+        self.kinds = np.zeros(count, dtype=np.int8)
+        self.states = np.zeros(count, dtype=np.int8)
+        self.positions = np.zeros((count, 3))
+        self.homes = np.zeros((count, 3))
+        self.headings = np.zeros(count)
+        self.pitches = np.zeros(count)
+        self.timers = np.zeros(count)
+        self.updated_at = np.zeros(count)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def spawn(self, kind, positions, headings=None):
+        """Add enemies of a kind ('goomba', 'bobomb', 'whomp') at positions (their feet)"""
+        kind_index = KINDS.index(kind)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        count = len(positions)
+        if headings is None:
+            headings = self.rng.uniform(0, 360, count)
+        self.kinds = np.concatenate([self.kinds, np.full(count, kind_index, dtype=np.int8)])
+        self.states = np.concatenate([self.states, np.full(count, WANDER, dtype=np.int8)])
+        self.positions = np.concatenate([self.positions, positions])
+        self.homes = np.concatenate([self.homes, positions])
+        self.headings = np.concatenate([self.headings, np.asarray(headings, dtype=np.float64).reshape(count)])
+        self.pitches = np.concatenate([self.pitches, np.zeros(count)])
+        self.timers = np.concatenate([self.timers, self.rng.uniform(0, 2, count)])
+        self.updated_at = np.concatenate([self.updated_at, np.full(count, self.clock)])
+
+        if kind_index not in self.templates:
+            self.templates[kind_index] = Entity(parent=self, model=_enemy_model(kind_index), enabled=False)
+        template = self.templates[kind_index]
+        for _ in range(count):
+            node = self.attachNewNode(kind)
+            template.model.instance_to(node)
+            self.bodies.append(node)
+        self._draw(np.arange(len(self) - count, len(self)))
+        return np.arange(len(self) - count, len(self))
+
+    def clear(self):
+        """Remove every enemy, and the level's navmesh with them"""
+        for node in self.bodies:
+            node.remove_node()
+        self.bodies = []
+        self.navmesh = None
+        self._resize(0)
+
+    def update(self):
+        if not self.active or not len(self):
+            return
+        began = perf_counter()
+        self.clock += time.dt
+        self.frame += 1
+        target = np.array(self.target.world_position if self.target else (0, -1e6, 0), dtype=np.float64)
+        # Ursina's FirstPersonController has no velocity_y: it is falling when it moved down
+        velocity_y = getattr(self.target, 'velocity_y', None)
+        if velocity_y is not None:
+            self.target_falling = velocity_y < 0
+        else:
+            self.target_falling = self.target_y is not None and target[1] < self.target_y
+        self.target_y = target[1]
+
+        distance = np.linalg.norm(self.positions - target, axis=1)
+        near = distance < self.near
+        mid = ~near & (distance < self.far)
+        self.lod_counts = (int(near.sum()), int(mid.sum()), len(self) - int(near.sum()) - int(mid.sum()))
+        # Mid range enemies take turns, each one every coarse_ticks frames
+        turn = (np.arange(len(self)) + self.frame) % self.coarse_ticks == 0
+        # A dead enemy's respawn timer runs wherever it is
+        due = near | (mid & turn) | ((self.states == DEAD) & turn)
+        rows = np.flatnonzero(due)
+        if len(rows):
+            dt = np.minimum(self.clock - self.updated_at[rows], MAX_DT)
+            self.updated_at[rows] = self.clock
+            self._think(rows, dt, target)
+            self._touch(rows[near[rows]], target)
+            self._draw(rows)
+        # Frozen enemies don't save up time for when they wake; dead ones keep theirs for the respawn timer
+        self.updated_at[~due & ~near & ~mid & (self.states != DEAD)] = self.clock
+        self.update_ms = (perf_counter() - began) * 1000
+
+    def _think(self, rows, dt, target):
+        kind = self.kinds[rows]
+        state = self.states[rows]
+        timer = self.timers[rows] - dt
+        position = self.positions[rows]
+        heading = self.headings[rows]
+        pitch = self.pitches[rows]
+
+        offset = target - position
+        flat_distance = np.hypot(offset[:, 0], offset[:, 2])
+        sees = (flat_distance < SIGHT[kind]) & (np.abs(offset[:, 1]) < 3)
+        toward = np.degrees(np.arctan2(offset[:, 0], offset[:, 2]))
+        # Whether the target is on the ground a whomp would fall on
+        local = _local(offset, heading)
+        under_slam = (local[:, 2] > 0) & (local[:, 2] < SLAM_LENGTH) & (np.abs(local[:, 0]) < FLAT_HALF_SIZE[0])
+
+        # Wandering: a new direction now and then, back towards home when too far out
+        wander = state == WANDER
+        pick = wander & (timer <= 0)
+        heading[pick] = self.rng.uniform(0, 360, int(pick.sum()))
+        timer[pick] = self.rng.uniform(1, 3, int(pick.sum()))
+        away = position - self.homes[rows]
+        straying = wander & (np.hypot(away[:, 0], away[:, 2]) > ROAM)
+        heading[straying] = np.degrees(np.arctan2(-away[straying, 0], -away[straying, 2]))
+
+        # Noticing the target
+        noticed = wander & sees
+        state[noticed & (kind == GOOMBA)] = CHASE
+        lit = noticed & (kind == BOBOMB)
+        state[lit] = FUSE
+        timer[lit] = FUSE_TIME
+        state[noticed & (kind == WHOMP)] = CHASE
+        lost = (state == CHASE) & (flat_distance > SIGHT[kind] * 1.5)
+        state[lost] = WANDER
+        timer[lost] = 0
+
+        chasing = (state == CHASE) | (state == FUSE)
+        heading[chasing] = toward[chasing]
+        if self.navmesh is not None:
+            self._follow_paths(np.flatnonzero(chasing), position, heading, target)
+        falls = (state == CHASE) & (kind == WHOMP) & under_slam
+        state[falls] = TOPPLE
+        timer[falls] = TOPPLE_TIME
+
+        # Walking
+        walking = (state == WANDER) | chasing
+        speed = np.where(chasing, CHASE_SPEED[kind], SPEED[kind]) * dt * walking
+        step = _forward(heading) * speed[:, None]
+        position[:, 0] += step[:, 0]
+        position[:, 2] += step[:, 1]
+
+        # Bob-ombs going off
+        blown = (state == FUSE) & (timer <= 0)
+        if blown.any():
+            caught = blown & (np.linalg.norm(offset, axis=1) < BLAST_RADIUS)
+            for row in rows[caught]:
+                self._hurt(row)
+            state[blown] = DEAD
+            timer[blown] = RESPAWN_TIME
+
+        # Whomps falling, lying and getting up
+        toppling = state == TOPPLE
+        pitch[toppling] = 90 * np.clip(1 - timer[toppling] / TOPPLE_TIME, 0, 1)
+        landed = toppling & (timer <= 0)
+        for row in rows[landed & under_slam]:
+            self._hurt(row)
+        state[landed] = FLAT
+        timer[landed] = FLAT_TIME
+        up = (state == FLAT) & (timer <= 0)
+        state[up] = RISE
+        timer[up] = TOPPLE_TIME
+        rising = state == RISE
+        pitch[rising] = 90 * np.clip(timer[rising] / TOPPLE_TIME, 0, 1)
+        stood = rising & (timer <= 0)
+        state[stood] = WANDER
+        pitch[stood] = 0
+
+        # Respawning at home
+        back = (state == DEAD) & (timer <= 0)
+        state[back] = WANDER
+        position[back] = self.homes[rows[back]]
+        pitch[back] = 0
+
+        self.states[rows] = state
+        self.timers[rows] = timer
+        self.positions[rows] = position
+        self.headings[rows] = heading % 360
+        self.pitches[rows] = pitch
+
+    def _follow_paths(self, indices, position, heading, target):
+        """Head for the next waypoint to the target instead, where it is on the enemy's own level"""
+        for index in indices.tolist():
+            waypoint = self.navmesh.steer(position[index], target)
+            if waypoint is None or abs(waypoint[1] - position[index, 1]) > WAYPOINT_RISE:
+                continue  # Unreachable, or up a jump enemies can't make: straight at the target
+            dx, dz = waypoint[0] - position[index, 0], waypoint[2] - position[index, 2]
+            if dx * dx + dz * dz > 1e-6:
+                heading[index] = np.degrees(np.arctan2(dx, dz))
+
+    def _touch(self, rows, target):
+        """Stomps and hurts for near enemies overlapping the target"""
+        # Whomps on their way down or up can't be touched
+        rows = rows[~np.isin(self.states[rows], (DEAD, TOPPLE, RISE))]
+        if not len(rows):
+            return
+        kind = self.kinds[rows]
+        flat = self.states[rows] == FLAT
+        center = np.where(flat[:, None], FLAT_CENTER, BODY_CENTER[kind])
+        half = np.where(flat[:, None], FLAT_HALF_SIZE, BODY_HALF_SIZE[kind])
+        local = _local(target - self.positions[rows], self.headings[rows])
+        touching = np.all(np.abs(local - center) < half + TARGET_HALF_SIZE, axis=1)
+        if not touching.any():
+            return
+        falling = self.target_falling
+        for row, index in zip(rows[touching], np.flatnonzero(touching)):
+            # Feet over the top half of the body on the way down
+            from_above = falling and local[index, 1] - TARGET_HALF_SIZE[1] > center[index, 1]
+            if from_above and (self.kinds[row] != WHOMP or flat[index]):
+                self.states[row] = DEAD
+                self.timers[row] = RESPAWN_TIME
+                if self.on_stomp:
+                    self.on_stomp(KINDS[self.kinds[row]], row)
+            elif not flat[index]:
+                self._hurt(row)
+
+    def _hurt(self, row):
+        if self.clock - self.hurt_at < HURT_COOLDOWN:
+            return
+        self.hurt_at = self.clock
+        if self.on_hurt:
+            self.on_hurt(KINDS[self.kinds[row]], row)
+
+    def _draw(self, rows):
+        for row, (x, y, z), heading, pitch, dead in zip(
+                rows.tolist(), self.positions[rows].tolist(), self.headings[rows].tolist(),
+                self.pitches[rows].tolist(), (self.states[rows] == DEAD).tolist()):
+            node = self.bodies[row]
+            if dead:
+                node.hide()
+                continue
+            node.show()
+            node.set_pos_hpr(x, y, z, -heading, -pitch, 0)
+
+
+class _EntityGoomba(Entity):
+    """The same wandering as a plain Entity with its own update(), to compare against"""
+
+    def __init__(self, model, **kwargs):
+        super().__init__(**kwargs)
+        model.instance_to(self)  # Drawn the same as the swarm's goombas
+        self.home = self.position
+        self.timer = 0
+
+    def update(self):
+        self.timer -= time.dt
+        if self.timer <= 0:
+            self.rotation_y = np.random.uniform(0, 360)
+            self.timer = np.random.uniform(1, 3)
+        if (self.position - self.home).length() > ROAM:
+            self.look_at_2d(self.home, 'y')
+        self.position += self.forward * SPEED[GOOMBA] * time.dt
+
+
+def benchmark(counts, frames, spread):
+    """Frame times without drawing in cat'ssm64.py's courtyard with enemies scattered around the player, both ways"""
+    from gamerunner import run_game
+
+    def measure(app, game):
+        game.start_game()
+        # The software renderer would swamp the difference: time the game's side of the frame only
+        app.win.set_active(False)
+        model = _enemy_model(GOOMBA)
+        rows = []
+        for count in counts:
+            rng = np.random.default_rng(0)
+            positions = np.column_stack([rng.uniform(-spread, spread, count), np.zeros(count),
+                                         rng.uniform(-spread, spread, count)])
+            for batched in (False, True):
+                if batched:
+                    swarm = EnemySwarm(target=game.player, seed=0)
+                    swarm.spawn('goomba', positions)
+                    extra = [swarm]
+                else:
+                    extra = [_EntityGoomba(model, position=tuple(position)) for position in positions]
+                for _ in range(10):
+                    app.step()
+                began = perf_counter()
+                for _ in range(frames):
+                    app.step()
+                frame_ms = (perf_counter() - began) * 1000 / frames
+                row = {'enemies': count, 'batched': batched, 'frame_ms': round(frame_ms, 3)}
+                if batched:
+                    row['update_ms'] = round(swarm.update_ms, 3)
+                    row['near_mid_far'] = swarm.lod_counts
+                    swarm.clear()
+                rows.append(row)
+                for entity in extra:
+                    destroy(entity)
+                app.step()
+                print(row, file=sys.stderr)
+        return rows
+
+    return run_game("cat'ssm64.py", measure, offscreen=True, argv=('--no-pacing',))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time batched enemies against one Entity per enemy')
+    parser.add_argument('--enemies', nargs='*', type=int, default=[100, 300, 1000])
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--spread', type=float, default=150, help='enemies are scattered this far around the player')
+    args = parser.parse_args()
+    for row in benchmark(args.enemies, args.frames, args.spread):
+        mode = 'batched   ' if row['batched'] else 'per entity'
+        lod = f', near/mid/far {row["near_mid_far"]}, update {row["update_ms"]} ms' if row['batched'] else ''
+        print(f'{row["enemies"]:>5} enemies, {mode}: {row["frame_ms"]:7.2f} ms a frame{lod}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# ULTRA MARIO 3D BROS - Entity Registry
+# Entities are tagged when they are created (portal, star, obstacle, platform,
+# hud, static) so game code can look them up and tear them down by tag
+# instead of scanning scene.entities.
+from ursina import destroy
+
+PORTAL = "portal"
+STAR = "star"
+OBSTACLE = "obstacle"
+PLATFORM = "platform"
+HUD = "hud"
+STATIC = "static"
+
+
+class EntityRegistry:
+    def __init__(self):
+        self.tags = {}      # tag -> {id(entity): entity}, keeps creation order
+        self.entity_tags = {}  # id(entity) -> tag
+
+    def add(self, entity, tag):
+        """Register an entity under a tag and return it"""
+        self.remove(entity)
+        self.tags.setdefault(tag, {})[id(entity)] = entity
+        self.entity_tags[id(entity)] = tag
+        return entity
+
+    def get(self, tag):
+        """Return a list of the entities registered under a tag"""
+        return list(self.tags.get(tag, {}).values())
+
+    def count(self, tag):
+        return len(self.tags.get(tag, {}))
+
+    def tag_of(self, entity):
+        return self.entity_tags.get(id(entity))
+
+    def remove(self, entity):
+        """Stop tracking an entity without destroying it"""
+        tag = self.entity_tags.pop(id(entity), None)
+        if tag is not None:
+            self.tags[tag].pop(id(entity), None)
+
+    def destroy(self, entity):
+        """Stop tracking an entity and destroy it"""
+        self.remove(entity)
+        destroy(entity)
+
+    def clear(self, *tags):
+        """Destroy every entity under the given tags (all tags if none given)"""
+        for tag in tags or list(self.tags):
+            entities = self.tags.pop(tag, {})
+            for key, entity in entities.items():
+                self.entity_tags.pop(key, None)
+                destroy(entity)
+
+    def __len__(self):
+        return len(self.entity_tags)
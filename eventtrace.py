@@ -0,0 +1,120 @@
+# ULTRA MARIO 3D BROS - Gameplay Event Trace
+# Records gameplay events (coin pickups, warps, level loads...) as instant
+# events and begin/end spans, next to a span for every frame, and writes them
+# in Chrome trace format for chrome://tracing or ui.perfetto.dev. With frames
+# and events on one timeline, a frame-time spike can be lined up with
+# whatever the game was doing at the time.
+#
+#   tracer = EventTrace()
+#   tracer.instant('coin pickup', coins=coins_collected)
+#   with tracer.span('level load', level=level_name):
+#       level.create()
+#
+# Tracing is on with --trace on the command line, or from the moment F6 is
+# pressed. Events are buffered in memory and written to trace_<script>.json
+# on exit and whenever F6 is pressed while tracing. Until then every call
+# returns straight away.
+import atexit
+import json
+import os
+import sys
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from ursina import Entity, application
+
+MAX_EVENTS = 200000  # Oldest events are dropped past this (about an hour of frames)
+_FRAME_TID = 1
+_GAMEPLAY_TID = 2
+
+# After Panda3D's render task (sort 50), so a frame span covers the whole frame
+_FRAME_END_SORT = 51
+
+_NULL_SPAN = nullcontext()
+
+
+class EventTrace(Entity):
+    def __init__(self, recording=None, key='f6', path=None, max_events=MAX_EVENTS, **kwargs):
+        super().__init__(eternal=True, **kwargs)
+        self.key = key
+        self.events = deque(maxlen=max_events)
+        self.started = perf_counter()
+        self.frame = 0
+        self.frame_start = None
+        script = os.path.splitext(os.path.basename(sys.argv[0] or 'game'))[0]
+        self.path = path or f'trace_{script}.json'
+        if recording is None:
+            recording = '--trace' in sys.argv
+        self.recording = recording
+
+        application.base.taskMgr.add(self._frame_end, 'event_trace_frame_end', sort=_FRAME_END_SORT)
+        atexit.register(self.flush)
+
+    def _timestamp(self):
+        return (perf_counter() - self.started) * 1e6
+
+    def _add(self, phase, name, category, args):
+        event = {'name': name, 'cat': category, 'ph': phase, 'pid': 1, 'tid': _GAMEPLAY_TID,
+                 'ts': self._timestamp()}
+        if phase == 'i':
+            event['s'] = 't'
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def instant(self, name, category='gameplay', **args):
+        """Something that happened at one moment: a pickup, a warp, a hit"""
+        if self.recording:
+            self._add('i', name, category, args)
+
+    def begin(self, name, category='gameplay', **args):
+        if self.recording:
+            self._add('B', name, category, args)
+
+    def end(self, name, category='gameplay', **args):
+        if self.recording:
+            self._add('E', name, category, args)
+
+    def span(self, name, category='gameplay', **args):
+        """Context manager recording a begin/end pair around a block"""
+        if not self.recording:
+            return _NULL_SPAN
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name, category, args):
+        self._add('B', name, category, args)
+        try:
+            yield
+        finally:
+            self._add('E', name, category, None)
+
+    def _frame_end(self, task):
+        if not self.recording:
+            self.frame_start = None
+            return task.cont
+        now = self._timestamp()
+        if self.frame_start is not None:
+            self.events.append({'name': 'frame', 'cat': 'frame', 'ph': 'X', 'pid': 1, 'tid': _FRAME_TID,
+                                'ts': self.frame_start, 'dur': now - self.frame_start,
+                                'args': {'frame': self.frame}})
+            self.frame += 1
+        self.frame_start = now
+        return task.cont
+
+    def input(self, key):
+        if key == self.key:
+            if self.recording:
+                print(f'{len(self.events)} trace events written to {self.flush()}')
+            else:
+                self.recording = True
+
+    def flush(self):
+        """Write everything buffered so far; returns the path, or None if there was nothing"""
+        if not self.events:
+            return None
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in ((_FRAME_TID, 'frames'), (_GAMEPLAY_TID, 'gameplay'))]
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': names + list(self.events), 'displayTimeUnit': 'ms'}, f)
+        return self.path
@@ -0,0 +1,166 @@
+# ULTRA MARIO 3D BROS - Frame Pacing
+# Holds the game near a target frame time by trading image quality for speed.
+# Each frame is split into CPU work (input, game update) and the render task
+# (draw submission, GPU and buffer flip); the average of recent frames is
+# compared with the target. Over it, the pacer lowers the render resolution
+# when the render dominates and the draw distance (camera.clip_plane_far)
+# when the game's own work does. Well under it, quality comes back, resolution
+# first. It changes at most one step per cooldown, so quality doesn't flicker.
+#
+#   pacer = FramePacer(target_fps=60)
+#   pacer = FramePacer(draw_distances=())    # resolution only
+#
+# Below full resolution the 3D scene is rendered into a smaller offscreen
+# buffer and stretched over the window; the UI is still drawn at full size.
+# F7 shows the current settings. --target-fps N sets the target from the
+# command line and --no-pacing turns the pacer off.
+import sys
+from collections import deque
+from time import perf_counter
+from ursina import Entity, Text, camera, color, application
+
+TARGET_FPS = 60
+RESOLUTION_SCALES = (1.0, 0.85, 0.7, 0.6, 0.5)
+DRAW_DISTANCES = (None, 300, 200, 120, 80)  # None is the camera's own far plane
+WINDOW = 30  # Frames averaged before deciding
+COOLDOWN = 1.0  # Seconds between changes
+SLOW = 1.1  # Step down once the average frame is this much over the target
+FAST = 0.75  # Step back up once it is this far under
+
+# Panda3D runs the data loop (input) at sort -50 and the render task at sort 50
+_FRAME_BEGIN_SORT = -51
+_RENDER_SORT = 50
+
+
+def _argv_target_fps(argv):
+    if '--target-fps' in argv:
+        index = argv.index('--target-fps')
+        if index + 1 < len(argv):
+            return float(argv[index + 1])
+    return TARGET_FPS
+
+
+class FramePacer(Entity):
+    def __init__(self, target_fps=None, resolution_scales=RESOLUTION_SCALES, draw_distances=DRAW_DISTANCES,
+                 window=WINDOW, cooldown=COOLDOWN, active=None, **kwargs):
+        super().__init__(parent=camera.ui, eternal=True, **kwargs)
+        self.target = 1 / (target_fps or _argv_target_fps(sys.argv))
+        self.resolution_scales = tuple(resolution_scales)
+        self.draw_distances = tuple(draw_distances) or (None,)
+        self.cooldown = cooldown
+        self.active = '--no-pacing' not in sys.argv if active is None else active
+        self.resolution_level = 0
+        self.distance_level = 0
+        self.far = camera.clip_plane_far
+        self.filter_manager = None
+        self.changed_at = perf_counter()
+        self.changes = []  # (time, resolution scale, draw distance, avg frame ms) for every change
+
+        self.cpu_times = deque(maxlen=window)
+        self.render_times = deque(maxlen=window)
+        self.frame_times = deque(maxlen=window)
+        self.marks = {}
+        taskMgr = application.base.taskMgr
+        for name, sort in (('frame', _FRAME_BEGIN_SORT), ('render', _RENDER_SORT - 1),
+                           ('end', _RENDER_SORT + 1)):
+            taskMgr.add(self._mark, f'frame_pacer_{name}', sort=sort, extraArgs=[name], appendTask=True)
+
+        self.status = Text(parent=self, text='', position=(-0.85, 0.2), origin=(-0.5, 0.5),
+                           color=color.azure, enabled=False)
+
+    @property
+    def resolution_scale(self):
+        return self.resolution_scales[self.resolution_level]
+
+    @property
+    def draw_distance(self):
+        return self.draw_distances[self.distance_level] or self.far
+
+    def _mark(self, name, task):
+        now = perf_counter()
+        if name == 'end' and 'frame' in self.marks and 'render' in self.marks:
+            self.cpu_times.append(self.marks['render'] - self.marks['frame'])
+            self.render_times.append(now - self.marks['render'])
+            if 'end' in self.marks:
+                self.frame_times.append(now - self.marks['end'])
+            if self.active:
+                self.pace(now)
+        self.marks[name] = now
+        return task.cont
+
+    def pace(self, now):
+        """Step quality down or up if the recent frames call for it and the cooldown has passed"""
+        if len(self.frame_times) < self.frame_times.maxlen or now - self.changed_at < self.cooldown:
+            return
+        average = sum(self.frame_times) / len(self.frame_times)
+        render_bound = sum(self.render_times) >= sum(self.cpu_times)
+
+        if average > self.target * SLOW:
+            can_lower_resolution = self.resolution_level < len(self.resolution_scales) - 1
+            can_lower_distance = self.distance_level < len(self.draw_distances) - 1
+            if can_lower_resolution and (render_bound or not can_lower_distance):
+                self.set_quality(self.resolution_level + 1, self.distance_level)
+            elif can_lower_distance:
+                self.set_quality(self.resolution_level, self.distance_level + 1)
+            else:
+                return
+        elif average < self.target * FAST:
+            if self.resolution_level:
+                self.set_quality(self.resolution_level - 1, self.distance_level)
+            elif self.distance_level:
+                self.set_quality(self.resolution_level, self.distance_level - 1)
+            else:
+                return
+        else:
+            return
+        self.changed_at = now
+        self.changes.append((now, self.resolution_scale, self.draw_distance, average * 1000))
+        # Frames measured before the change say nothing about the new settings
+        self.frame_times.clear()
+
+    def set_quality(self, resolution_level, distance_level):
+        self.resolution_level = resolution_level
+        self.distance_level = distance_level
+        self._apply_resolution(self.resolution_scale)
+        camera.clip_plane_far = self.draw_distance
+        if self.status.enabled:
+            self.redraw()
+
+    def _apply_resolution(self, scale):
+        if scale >= 1:
+            if self.filter_manager:
+                self.filter_manager.cleanup()
+                self.quad.remove_node()
+                self.filter_manager = None
+            return
+        if self.filter_manager is None:
+            from direct.filter.FilterManager import FilterManager
+            from panda3d.core import Texture, SamplerState
+            base = application.base
+            self.texture = Texture('frame_pacer_scene')
+            self.texture.set_minfilter(SamplerState.FT_linear)
+            self.texture.set_magfilter(SamplerState.FT_linear)
+            self.filter_manager = FilterManager(base.win, base.cam)
+            self.quad = self.filter_manager.renderSceneInto(colortex=self.texture)
+            self.quad.set_color(1, 1, 1, 1)
+        # The scene buffer is the first FilterManager buffer; it is resized with the window using this scale
+        self.filter_manager.sizes[0] = (scale, 1, 1)
+        self.filter_manager.resizeBuffers()
+
+    def input(self, key):
+        if key == 'f7':
+            self.status.enabled = not self.status.enabled
+            if self.status.enabled:
+                self.redraw()
+
+    def update(self):
+        if self.status.enabled and self.frame_times:
+            self.redraw()
+
+    def redraw(self):
+        frame_ms = sum(self.frame_times) / max(len(self.frame_times), 1) * 1000
+        cpu_ms = sum(self.cpu_times) / max(len(self.cpu_times), 1) * 1000
+        render_ms = sum(self.render_times) / max(len(self.render_times), 1) * 1000
+        self.status.text = (f'frame {frame_ms:.1f}/{self.target * 1000:.1f} ms (cpu {cpu_ms:.1f}, render {render_ms:.1f})\n'
+                            f'resolution {self.resolution_scale:.0%}, draw distance {self.draw_distance:g}'
+                            + ('' if self.active else ' (pacing off)'))
@@ -0,0 +1,206 @@
+# ULTRA MARIO 3D BROS - Frame Profiler
+# Named scopes time the parts of a frame (input, player physics, collectibles...)
+# into a ring buffer of the last few hundred frames. F3 shows an overlay with
+# per-scope percentiles and a frame-time graph, and whatever was recorded is
+# dumped to CSV and JSON on exit.
+#
+#   profiler = FrameProfiler()
+#   with profiler.scope('collectibles'):
+#       ...
+#   @profiler.timed('player')
+#   def update(self): ...
+#
+# Scopes are inclusive: a scope opened inside another counts towards both.
+# While recording is off, scope() hands back a shared do-nothing context, so
+# instrumented code pays for one attribute check and nothing else.
+import atexit
+import csv
+import json
+import os
+import sys
+import time
+from time import perf_counter
+from functools import wraps
+from contextlib import nullcontext
+from ursina import Entity, Text, Mesh, camera, color, application
+
+DEFAULT_SCOPES = ('input', 'player', 'collectibles', 'triggers', 'hud', 'render')
+HISTORY = 600  # Frames kept in the ring buffer (10 seconds at 60 fps)
+PERCENTILES = (50, 95, 99)
+OVERLAY_REFRESH = 0.25  # Seconds between overlay redraws
+GRAPH_CEILING = 1 / 20  # Frame time at the top of the graph
+
+# Panda3D runs the render (igLoop) task at sort 50, after Ursina's update task
+_RENDER_SORT = 50
+
+_NULL_SCOPE = nullcontext()
+
+
+class _Scope:
+    __slots__ = ('total', 'start')
+
+    def __init__(self):
+        self.total = 0.0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        self.total += perf_counter() - self.start
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class FrameProfiler(Entity):
+    def __init__(self, scopes=DEFAULT_SCOPES, history=HISTORY, recording=None, dump_path=None, **kwargs):
+        super().__init__(parent=camera.ui, eternal=True, **kwargs)
+        self.scope_names = tuple(scopes)
+        self.history = history
+        self.scopes = {name: _Scope() for name in self.scope_names}
+        self.samples = {name: [0.0] * history for name in self.scope_names}
+        self.frame_times = [0.0] * history
+        self.frames = 0  # Total frames recorded; the ring index is frames % history
+        self.frame_start = None
+        self.refresh_timer = 0.0
+
+        script = os.path.splitext(os.path.basename(sys.argv[0] or 'game'))[0]
+        self.dump_path = dump_path or f'profile_{script}'
+        # Not self.enabled: a disabled Entity gets no input, so F3 could never turn it back on
+        if recording is None:
+            recording = '--profile' in sys.argv
+        self.recording = recording
+
+        self.overlay = Text(parent=self, text='', position=(-0.85, -0.1), scale=0.8,
+                            origin=(-0.5, 0.5), font='VeraMono.ttf', background=True)
+        self.graph = Entity(parent=self, model=Mesh(vertices=[], mode='line', thickness=2),
+                            position=(-0.85, -0.45), color=color.lime)
+        self.budget_line = Entity(parent=self, model=Mesh(vertices=[(0, 0, 0), (0.6, 0, 0)], mode='line'),
+                                  position=(-0.85, -0.45 + 0.2 * (1 / 60) / GRAPH_CEILING), color=color.red)
+        self.visible = False
+
+        taskMgr = application.base.taskMgr
+        taskMgr.add(self._render_begin, 'frame_profiler_render_begin', sort=_RENDER_SORT - 1)
+        taskMgr.add(self._frame_end, 'frame_profiler_frame_end', sort=_RENDER_SORT + 1)
+        atexit.register(self.dump)
+
+    def scope(self, name):
+        """Context manager timing a named part of the frame"""
+        if not self.recording:
+            return _NULL_SCOPE
+        return self.scopes[name]
+
+    def timed(self, name):
+        """Decorator timing every call of a function as a named scope"""
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.recording:
+                    return func(*args, **kwargs)
+                with self.scopes[name]:
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def _render_begin(self, task):
+        if self.recording and 'render' in self.scopes:
+            self.scopes['render'].__enter__()
+        return task.cont
+
+    def _frame_end(self, task):
+        now = perf_counter()
+        if not self.recording:
+            self.frame_start = None
+            return task.cont
+        if 'render' in self.scopes:
+            self.scopes['render'].__exit__()
+
+        if self.frame_start is not None:
+            index = self.frames % self.history
+            self.frame_times[index] = now - self.frame_start
+            for name, scope in self.scopes.items():
+                self.samples[name][index] = scope.total
+            self.frames += 1
+        for scope in self.scopes.values():
+            scope.total = 0.0
+        self.frame_start = now
+        return task.cont
+
+    def recorded(self, values):
+        """The ring buffer contents in recording order"""
+        if self.frames < self.history:
+            return values[:self.frames]
+        index = self.frames % self.history
+        return values[index:] + values[:index]
+
+    def stats(self):
+        """{scope: {'mean', 'p50', 'p95', 'p99', 'max'}} in milliseconds over the ring buffer"""
+        columns = {'frame': self.frame_times, **self.samples}
+        stats = {}
+        for name, values in columns.items():
+            ordered = sorted(self.recorded(values))
+            entry = {'mean': sum(ordered) / len(ordered) * 1000 if ordered else 0.0}
+            for p in PERCENTILES:
+                entry[f'p{p}'] = _percentile(ordered, p) * 1000
+            entry['max'] = (ordered[-1] if ordered else 0.0) * 1000
+            stats[name] = entry
+        return stats
+
+    def input(self, key):
+        if key == 'f3':
+            self.visible = not self.visible
+            if self.visible:
+                self.recording = True
+                self.refresh_timer = OVERLAY_REFRESH
+
+    @property
+    def visible(self):
+        return self.overlay.enabled
+
+    @visible.setter
+    def visible(self, value):
+        self.overlay.enabled = value
+        self.graph.enabled = value
+        self.budget_line.enabled = value
+
+    def update(self):
+        if not self.visible:
+            return
+        self.refresh_timer += time.dt
+        if self.refresh_timer < OVERLAY_REFRESH:
+            return
+        self.refresh_timer = 0.0
+        self.redraw()
+
+    def redraw(self):
+        lines = [f'{"ms":<13}{"mean":>7}' + ''.join(f'{"p" + str(p):>7}' for p in PERCENTILES) + f'{"max":>7}']
+        for name, entry in self.stats().items():
+            lines.append(f'{name:<13}{entry["mean"]:7.2f}'
+                         + ''.join(f'{entry[f"p{p}"]:7.2f}' for p in PERCENTILES)
+                         + f'{entry["max"]:7.2f}')
+        self.overlay.text = '\n'.join(lines)
+
+        frame_times = self.recorded(self.frame_times)
+        step = 0.6 / self.history
+        self.graph.model.vertices = [(i * step, min(t / GRAPH_CEILING, 1) * 0.2, 0)
+                                     for i, t in enumerate(frame_times)]
+        self.graph.model.generate()
+
+    def dump(self):
+        """Write the recorded frames to <dump_path>.csv and the summary to <dump_path>.json"""
+        if not self.frames:
+            return
+        columns = [self.recorded(self.frame_times)] + [self.recorded(self.samples[name]) for name in self.scope_names]
+        with open(self.dump_path + '.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'frame_ms'] + [f'{name}_ms' for name in self.scope_names])
+            first = self.frames - len(columns[0])
+            for i, row in enumerate(zip(*columns)):
+                writer.writerow([first + i] + [round(value * 1000, 4) for value in row])
+
+        with open(self.dump_path + '.json', 'w') as f:
+            json.dump({'frames': self.frames, 'history': len(columns[0]), 'stats': self.stats()}, f, indent=2)
@@ -0,0 +1,111 @@
+# ULTRA MARIO 3D BROS - Game Runner
+# Runs a port script in this process for a tool (benchmark, startup tracer...).
+# The script executes as __main__ the way `python script.py` would, but its
+# Ursina app can be made offscreen (software rendered, no GPU needed) and its
+# app.run() call is handed to the tool, which steps frames itself.
+import multiprocessing
+import os
+import sys
+import types
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OFFSCREEN_CONFIG = ('window-type offscreen\nload-display p3tinydisplay\n'
+                    'audio-library-name null\nsync-video false')
+# Settings the scripts apply right after startup that need a real window
+WINDOW_SETTINGS = ('title', 'size', 'position', 'borderless', 'fullscreen', 'icon', 'vsync', 'cursor', 'color')
+MOUSE_SETTINGS = ('locked', 'visible', 'position', 'x', 'y')
+
+
+class _Stop(Exception):
+    pass
+
+
+def tolerate_offscreen(obj, names):
+    """Let window settings that need a real window be set without effect on an offscreen buffer"""
+    cls = type(obj)
+    for name in names:
+        prop = getattr(cls, name, None)
+        if not isinstance(prop, property) or prop.fset is None:
+            continue
+
+        def fset(self, value, prop=prop, name=name):
+            try:
+                prop.fset(self, value)
+            except AttributeError:  # GraphicsBuffer has no request_properties/get_pointer
+                self.__dict__['_offscreen_' + name] = value
+
+        def fget(self, prop=prop, name=name):
+            try:
+                return prop.fget(self)
+            except AttributeError:
+                return self.__dict__.get('_offscreen_' + name)
+
+        setattr(cls, name, property(fget, fset))
+
+
+def run_game(script, on_run, offscreen=False, before_app=None, after_app=None, argv=()):
+    """Run script until it calls app.run(), then call on_run(app, game) instead.
+
+    game is the script's module, so tools can call into it (start_game() etc.).
+    before_app() and after_app(app) are called around the script's Ursina().
+    Returns whatever on_run returns.
+    """
+    if offscreen:
+        from panda3d.core import loadPrcFileData
+        loadPrcFileData('gamerunner', OFFSCREEN_CONFIG)
+    import ursina
+    from ursina import main as ursina_main
+
+    path = os.path.join(REPO_DIR, script)
+    os.chdir(REPO_DIR)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    sys.argv = [path, *argv]
+
+    # Ursina looks up update() and input() on __main__, so that has to be the game
+    game = types.ModuleType('__main__')
+    game.__file__ = path
+    ursina_main.__main__ = game
+
+    result = {}
+
+    def run(app, *args, **kwargs):
+        result['value'] = on_run(app, game)
+        raise _Stop
+
+    # Scripts get Ursina through `from ursina import *`, so swapping the module
+    # attribute is enough to wrap the app they create
+    make_app = ursina.Ursina
+
+    def create_app(*args, **kwargs):
+        if offscreen:
+            kwargs.update(window_type='offscreen', vsync=False)
+        if before_app:
+            before_app()
+        app = make_app(*args, **kwargs)
+        if offscreen:
+            tolerate_offscreen(ursina.window, WINDOW_SETTINGS)
+            tolerate_offscreen(ursina.mouse, MOUSE_SETTINGS)
+        if after_app:
+            after_app(app)
+        app.run = types.MethodType(run, app)
+        return app
+
+    ursina.Ursina = create_app
+    with open(path, encoding='utf-8') as f:
+        code = compile(f.read(), path, 'exec')
+    try:
+        exec(code, game.__dict__)
+    except _Stop:
+        return result['value']
+    finally:
+        ursina.Ursina = make_app
+    raise RuntimeError(f'{script} exited without calling app.run()')
+
+
+def in_new_process(function, *args):
+    """Call function(*args) in a fresh spawned process; for tools that run more than one game"""
+    # One game per process: Panda3D and the scripts' globals can't be torn down and rebuilt
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(function, args)
@@ -0,0 +1,258 @@
+# ULTRA MARIO 3D BROS - Ghost Racing
+# Records the player's position and facing at a fixed rate while a level is
+# played and saves each run as a small ghost file. Entering the level again
+# plays the best earlier runs back next to the player as translucent
+# silhouettes of the player's character model, interpolated between samples.
+#
+#   ghosts = GhostRace(MarioCharacter)
+#   ghosts.start('grassland', player)     # on level load: race the saved ghosts
+#   ghosts.finish(stars=3)                # on leaving: save this run as a ghost
+#
+# Every ghost is drawn from one entity: the character's parts are combined
+# into one mesh, drawn once per ghost with hardware instancing, and a shader
+# places each copy from a uniform array the ghosts' transforms are written
+# into each frame. 50 ghosts cost one draw call. Where the graphics card
+# can't run shaders, each ghost is a plain instance of that mesh instead.
+#
+# Ghost files store samples as centimetre and half-degree steps, delta encoded
+# and byte shuffled before compression, so a minute of play is a few KB.
+import json
+import os
+import struct
+import zlib
+from datetime import datetime
+import numpy as np
+from ursina import Entity, Shader, color, scene, time, application, destroy
+from panda3d.core import PTA_LVecBase4f, OmniBoundingVolume, TransparencyAttrib
+
+# The file layout is MAGIC, a uint16 format version, a uint32 header length,
+# the JSON header, then the compressed samples. Bump FORMAT_VERSION whenever
+# the layout changes; older versions are still readable.
+MAGIC = b'M64GHOST'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sHI')
+# Sample columns: x, y, z, rotation_y, stored as integer multiples of these
+QUANTUM = np.array([0.01, 0.01, 0.01, 0.5])
+
+RATE = 20  # Samples per second
+MAX_GHOSTS = 50
+GHOST_DIRECTORY = 'ghosts'
+GHOST_COLOR = color.rgba32(180, 220, 255, 90)
+
+ghost_shader = Shader(name='ghost_shader', language=Shader.GLSL, vertex='''#version 140
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+in vec4 p3d_Vertex;
+uniform vec4 ghost_transforms[64];
+
+void main() {
+    // xyz is the ghost's position, w its rotation_y in radians (clockwise seen from above)
+    vec4 transform = ghost_transforms[gl_InstanceID];
+    float c = cos(transform.w);
+    float s = sin(transform.w);
+    vec3 v = p3d_Vertex.xyz;
+    v = vec3(v.x * c + v.z * s, v.y, v.z * c - v.x * s);
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(v + transform.xyz, 1.);
+}
+''',
+fragment='''
+#version 140
+
+uniform vec4 p3d_ColorScale;
+out vec4 fragColor;
+
+void main() {
+    fragColor = p3d_ColorScale;
+}
+''')
+_SHADER_SLOTS = 64  # Size of ghost_transforms in the shader
+
+
+class Ghost:
+    def __init__(self, samples=None, rate=RATE, level='', stars=0, recorded=''):
+        # One row per sample: x, y, z, rotation_y in degrees
+        self.samples = np.zeros((0, 4)) if samples is None else np.asarray(samples, dtype=np.float64)
+        self.rate = rate
+        self.level = level
+        self.stars = stars
+        self.recorded = recorded
+
+    @property
+    def duration(self):
+        return max(len(self.samples) - 1, 0) / self.rate
+
+    def save(self, path):
+        steps = np.round(self.samples / QUANTUM).astype(np.int32)
+        deltas = np.diff(steps, axis=0, prepend=np.zeros((1, 4), dtype=np.int32))
+        # Deltas are small, so most of their high bytes are 0 or 255; grouping bytes by
+        # significance puts those runs next to each other for zlib
+        shuffled = deltas.astype('<i4').view(np.uint8).reshape(-1, 4).T.copy()
+
+        header = json.dumps({'level': self.level, 'rate': self.rate, 'samples': len(self.samples),
+                             'stars': self.stars, 'duration': self.duration, 'recorded': self.recorded}).encode()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(zlib.compress(shuffled.tobytes(), 9))
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read_header(f, path):
+        magic, version, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a ghost file')
+        if version > FORMAT_VERSION:
+            raise ValueError(f'{path} uses ghost format {version}, this build reads up to {FORMAT_VERSION}')
+        return json.loads(f.read(header_length))
+
+    @classmethod
+    def read_header(cls, path):
+        """Just the header (level, stars, duration...), without decoding the samples"""
+        with open(path, 'rb') as f:
+            return cls._read_header(f, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            header = cls._read_header(f, path)
+            body = zlib.decompress(f.read())
+        count = header['samples']
+        deltas = np.frombuffer(body, dtype=np.uint8).reshape(4, count * 4).T.copy().view('<i4').reshape(count, 4)
+        samples = np.cumsum(deltas, axis=0) * QUANTUM
+        return cls(samples, header['rate'], header['level'], header['stars'], header['recorded'])
+
+
+def ghost_paths(level, directory=GHOST_DIRECTORY):
+    """Saved ghosts of a level, best first: most stars, then fastest"""
+    entries = []
+    if not os.path.isdir(directory):
+        return []
+    for name in os.listdir(directory):
+        if not name.startswith(f'{level}_') or not name.endswith('.m64g'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            header = Ghost.read_header(path)
+        except (OSError, ValueError, struct.error):
+            continue
+        entries.append((-header['stars'], header['duration'], path))
+    return [path for _, _, path in sorted(entries)]
+
+
+class GhostRace(Entity):
+    def __init__(self, character, directory=GHOST_DIRECTORY, rate=RATE, max_ghosts=MAX_GHOSTS,
+                 ghost_color=GHOST_COLOR, **kwargs):
+        super().__init__(eternal=True, **kwargs)
+        self.directory = directory
+        self.rate = rate
+        self.max_ghosts = min(max_ghosts, _SHADER_SLOTS)
+        self.target = None
+        self.level = None
+        self.recording = None
+        self.elapsed = 0
+        self.ghosts = []
+        self.tracks = np.zeros((0, 0, 4))  # (ghost, sample, column), each ghost padded with its last sample
+        self.lengths = np.zeros(0, dtype=np.int64)
+
+        # The character's parts become one mesh; its own scale is baked in by combining from a parent
+        holder = Entity(eternal=True)
+        template = character()
+        template.parent = holder
+        holder.combine()
+        self.silhouette = Entity(model=holder.model, parent=scene, eternal=True, color=ghost_color,
+                                 unlit=True, enabled=False)
+        destroy(holder)
+        self.silhouette.setTransparency(TransparencyAttrib.M_alpha)
+        self.silhouette.set_depth_write(False)
+        # Instances are placed by the shader, so the entity's own bounds say nothing about them
+        self.silhouette.node().set_bounds(OmniBoundingVolume())
+        self.silhouette.node().set_final(True)
+
+        gsg = application.base.win.gsg
+        self.instanced = gsg.supports_basic_shaders and gsg.supports_geometry_instancing
+        if self.instanced:
+            self.transforms = PTA_LVecBase4f.empty_array(_SHADER_SLOTS)
+            # A view of the shader input, so writing the array updates what the shader reads
+            self.transform_view = np.frombuffer(self.transforms, dtype=np.float32).reshape(_SHADER_SLOTS, 4)
+            self.silhouette.shader = ghost_shader
+            self.silhouette.set_shader_input('ghost_transforms', self.transforms)
+        else:
+            self.copies = []
+
+    def start(self, level, target):
+        """Begin recording target in level and load that level's best ghosts to race"""
+        self.finish(save=False)
+        self.level = level
+        self.target = target
+        self.elapsed = 0
+        self.recording = []
+        self.ghosts = [Ghost.load(path) for path in ghost_paths(level, self.directory)[:self.max_ghosts]]
+        longest = max((len(ghost.samples) for ghost in self.ghosts), default=0)
+        self.tracks = np.zeros((len(self.ghosts), longest, 4))
+        self.lengths = np.array([len(ghost.samples) for ghost in self.ghosts], dtype=np.int64)
+        for i, ghost in enumerate(self.ghosts):
+            samples = ghost.samples.copy()
+            # Interpolate facing the short way round
+            samples[:, 3] = np.degrees(np.unwrap(np.radians(samples[:, 3])))
+            self.tracks[i, :len(samples)] = samples
+            self.tracks[i, len(samples):] = samples[-1]
+        if not self.instanced:
+            for copy in self.copies:
+                copy.remove_node()
+            self.copies = [self.silhouette.instance_under_node(scene, 'ghost') for _ in self.ghosts]
+        # Without instancing the copies are drawn, not the silhouette itself
+        self.silhouette.enabled = self.instanced and bool(self.ghosts)
+        self._place(0)
+
+    def finish(self, stars=0, save=True):
+        """Stop racing; save the run as a ghost unless save is False. Returns the saved path, if any"""
+        path = None
+        if save and self.recording and len(self.recording) > 1:
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            path = os.path.join(self.directory, f'{self.level}_{stamp}.m64g')
+            Ghost(self.recording, self.rate, self.level, stars, stamp).save(path)
+        self.recording = None
+        self.target = None
+        self.ghosts = []
+        self.silhouette.enabled = False
+        if not self.instanced:
+            for copy in self.copies:
+                copy.remove_node()
+            self.copies = []
+        return path
+
+    def update(self):
+        if self.recording is None:
+            return
+        self.elapsed += time.dt
+        # Sample at a fixed rate however fast frames come
+        if self.target:
+            while len(self.recording) <= self.elapsed * self.rate:
+                target = self.target
+                self.recording.append((target.world_x, target.world_y, target.world_z, target.world_rotation_y))
+        if self.ghosts:
+            self._place(self.elapsed)
+
+    def _place(self, elapsed):
+        if not self.ghosts:
+            return
+        # Linear interpolation between the two samples around this moment, for every ghost at once
+        # (saved ghosts have at least two samples; finished ones stay on their last)
+        position = np.minimum(elapsed * self.rate, self.lengths - 1)
+        index = np.minimum(position.astype(np.int64), self.tracks.shape[1] - 2)
+        rows = np.arange(len(self.ghosts))
+        before = self.tracks[rows, index]
+        after = self.tracks[rows, index + 1]
+        weight = (position - index)[:, None]
+        current = before + (after - before) * weight
+
+        if self.instanced:
+            self.transform_view[:len(current), :3] = current[:, :3]
+            self.transform_view[:len(current), 3] = np.radians(current[:, 3])
+            self.silhouette.setInstanceCount(len(current))
+        else:
+            for copy, (x, y, z, rotation_y) in zip(self.copies, current.tolist()):
+                copy.set_pos(x, y, z)
+                copy.set_h(-rotation_y)
@@ -0,0 +1,262 @@
+# ULTRA MARIO 3D BROS - Input Recording and Replay
+# InputRecorder captures every frame's input (key events, mouse position and
+# velocity, dt) and InputPlayer feeds it back through the same paths the real
+# input takes: key events go through app.input, so held_keys and every input()
+# handler see them, and the mouse and clock report the recorded values to
+# update(). The random module is seeded from the recording so a replay also
+# repeats any random choices the game makes.
+#
+#   python "cat'ssm64.py" --record session.m64i
+#   python "cat'ssm64.py" --replay session.m64i --dt fixed --exit --profile
+import argparse
+import atexit
+import inspect
+import json
+import os
+import random
+import struct
+import sys
+import zlib
+from ursina import Entity, Vec3, mouse, held_keys, application
+from panda3d.core import ClockObject
+
+# The file layout is MAGIC, a uint16 format version, a uint32 header length,
+# the JSON header, then zlib-compressed frames. Bump FORMAT_VERSION whenever
+# the layout changes; older versions are still readable.
+MAGIC = b'M64INPUT'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sHI')
+_FRAME = struct.Struct('<5dH')  # dt, mouse x, mouse y, velocity x, velocity y, event count
+_EVENT = struct.Struct('<H')    # Index into the header's key table
+
+DT_MODES = ('recorded', 'fixed', 'real')
+DEFAULT_FIXED_DT = 1 / 60
+
+# Panda3D dispatches input events at sort -50 and Ursina runs update() at sort 0
+_BEFORE_UPDATE = -1
+_AFTER_UPDATE = 1
+
+_clock = ClockObject.getGlobalClock()
+
+
+class Recording:
+    def __init__(self, frames=None, seed=0, script=''):
+        # Each frame is (dt, (mouse x, mouse y), (velocity x, velocity y), (key events...))
+        self.frames = frames if frames is not None else []
+        self.seed = seed
+        self.script = script
+
+    def save(self, path):
+        keys = sorted({key for frame in self.frames for key in frame[3]})
+        key_index = {key: i for i, key in enumerate(keys)}
+        body = bytearray()
+        for dt, position, velocity, events in self.frames:
+            body += _FRAME.pack(dt, *position, *velocity, len(events))
+            for key in events:
+                body += _EVENT.pack(key_index[key])
+
+        header = json.dumps({'script': self.script, 'seed': self.seed,
+                             'frames': len(self.frames), 'keys': keys}).encode()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(zlib.compress(bytes(body), 9))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, header_length = _PREFIX.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an input recording')
+        if version > FORMAT_VERSION:
+            raise ValueError(f'{path} uses recording format {version}, this build reads up to {FORMAT_VERSION}')
+
+        start = _PREFIX.size
+        header = json.loads(data[start:start + header_length])
+        body = zlib.decompress(data[start + header_length:])
+        keys = header['keys']
+        frames = []
+        offset = 0
+        for _ in range(header['frames']):
+            dt, x, y, vx, vy, count = _FRAME.unpack_from(body, offset)
+            offset += _FRAME.size
+            events = tuple(keys[_EVENT.unpack_from(body, offset + i * _EVENT.size)[0]] for i in range(count))
+            offset += count * _EVENT.size
+            frames.append((dt, (x, y), (vx, vy), events))
+        return cls(frames, header['seed'], header['script'])
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class InputRecorder(Entity):
+    def __init__(self, path=None, seed=None, **kwargs):
+        super().__init__(eternal=True, **kwargs)
+        self.path = path
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        random.seed(seed)
+        self.recording = Recording(seed=seed, script=os.path.basename(sys.argv[0]))
+        self.events = []
+        self.recording_active = True
+        self.task = application.base.taskMgr.add(self._end_frame, 'input_recorder', sort=_AFTER_UPDATE)
+        if path:
+            atexit.register(self.save)
+
+    def input(self, key):
+        if self.recording_active:
+            self.events.append(key)
+
+    def _end_frame(self, task):
+        if self.recording_active:
+            # Offscreen windows have no pointer, and Ursina doesn't track the mouse there either
+            onscreen = application.window_type == 'onscreen'
+            self.recording.frames.append((
+                _clock.getDt(),
+                (mouse.x, mouse.y) if onscreen else (0.0, 0.0),
+                (mouse.velocity[0], mouse.velocity[1]),
+                tuple(self.events),
+            ))
+            self.events.clear()
+        return task.cont
+
+    def stop(self):
+        """Stop recording and return the recording"""
+        self.recording_active = False
+        self.task.remove()
+        return self.recording
+
+    def save(self):
+        if self.path and self.recording.frames:
+            self.recording.save(self.path)
+
+
+class _ReplayMouse(type(mouse)):
+    """Mouse that reports the recorded position and velocity instead of the real pointer"""
+
+    @property
+    def x(self):
+        return self.replay_position[0]
+
+    @x.setter
+    def x(self, value):
+        pass
+
+    @property
+    def y(self):
+        return self.replay_position[1]
+
+    @y.setter
+    def y(self, value):
+        pass
+
+    @property
+    def position(self):
+        return Vec3(self.replay_position[0], self.replay_position[1], 0)
+
+    @position.setter
+    def position(self, value):
+        pass
+
+    def update(self):
+        super().update()
+        self.velocity = Vec3(self.replay_velocity[0], self.replay_velocity[1], 0)
+
+
+class InputPlayer:
+    def __init__(self, recording, dt_mode='recorded', fixed_dt=DEFAULT_FIXED_DT, on_finish=None):
+        if dt_mode not in DT_MODES:
+            raise ValueError(f'dt_mode must be one of {DT_MODES}, not {dt_mode!r}')
+        self.recording = recording
+        self.dt_mode = dt_mode
+        self.fixed_dt = fixed_dt
+        self.on_finish = on_finish
+        self.frame = 0
+        self.playing = False
+        self.task = None
+        self.accepts_raw = 'is_raw' in inspect.signature(application.base.input).parameters
+
+    def play(self):
+        random.seed(self.recording.seed)
+        held_keys.clear()
+        self.frame = 0
+        self.playing = True
+        self.mouse_class = type(mouse)
+        mouse.replay_position = (0, 0)
+        mouse.replay_velocity = (0, 0)
+        mouse.__class__ = _ReplayMouse
+        if self.dt_mode != 'real':
+            _clock.setMode(ClockObject.MNonRealTime)
+        self.task = application.base.taskMgr.add(self._begin_frame, 'input_player', sort=_BEFORE_UPDATE)
+
+    def _begin_frame(self, task):
+        if self.frame >= len(self.recording.frames):
+            self.stop()
+            if self.on_finish:
+                self.on_finish(self)
+            return task.done
+
+        dt, position, velocity, events = self.recording.frames[self.frame]
+        if self.dt_mode == 'recorded':
+            _clock.setDt(dt)
+        elif self.dt_mode == 'fixed':
+            _clock.setDt(self.fixed_dt)
+        mouse.replay_position = position
+        mouse.replay_velocity = velocity
+        for key in events:
+            if self.accepts_raw:
+                application.base.input(key, is_raw=True)
+            else:
+                application.base.input(key)
+        self.frame += 1
+        return task.cont
+
+    def stop(self):
+        if not self.playing:
+            return
+        self.playing = False
+        if self.task:
+            self.task.remove()
+        mouse.__class__ = self.mouse_class
+        _clock.setMode(ClockObject.MNormal)
+
+
+def from_argv(end_state=None, argv=None):
+    """Start recording or replaying as asked for on the command line.
+
+    --record PATH records the session to PATH. --replay PATH plays a recording
+    back, with --dt recorded|fixed|real (and --fixed-dt SECONDS) choosing the
+    frame time; --exit quits once it finishes. end_state is an optional callable
+    returning a JSON-able dict of game state, printed and written to
+    --end-state PATH when a replay finishes.
+    Returns the InputRecorder or InputPlayer, or None.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--record')
+    parser.add_argument('--replay')
+    parser.add_argument('--dt', choices=DT_MODES, default='recorded')
+    parser.add_argument('--fixed-dt', type=float, default=DEFAULT_FIXED_DT)
+    parser.add_argument('--exit', action='store_true')
+    parser.add_argument('--end-state')
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+
+    if args.replay:
+        def finish(player):
+            if end_state:
+                state = end_state()
+                print('Replay finished:', json.dumps(state))
+                if args.end_state:
+                    with open(args.end_state, 'w') as f:
+                        json.dump(state, f, indent=2)
+            if args.exit:
+                application.quit()
+
+        player = InputPlayer(Recording.load(args.replay), args.dt, args.fixed_dt, on_finish=finish)
+        player.play()
+        return player
+    if args.record:
+        return InputRecorder(args.record)
+    return None
@@ -0,0 +1,157 @@
+# ULTRA MARIO 3D BROS - Interest Management
+# Decides, per client and per tick, which entities a multiplayer snapshot
+# carries. Each entity has a priority for each client: its kind's weight,
+# falling off with distance, and lower again when a wall or platform is in
+# the way. Entities past the relevance radius aren't sent at all. Priorities
+# accumulate every tick an entity waits, so far and hidden ones still get
+# their turn, just less often. The most urgent are packed into a byte budget
+# per tick, and whatever is sent starts waiting again from zero.
+#
+#   interest = InterestManager(colliders, budget=600)
+#   keys = interest.select(client_id, eye, candidates, cost)
+#
+# Running this file is a fake-client harness: it puts 2 to 64 players in
+# cat'ssm64.py's courtyard and reports snapshot bytes per tick with and
+# without interest management, using netplay.py's server with the network
+# replaced by direct calls.
+#
+#   python interest.py --players 2 4 8 16 32 64 --ticks 300
+import argparse
+import sys
+import numpy as np
+
+BUDGET = 600  # Bytes per client per tick, about 36 KB/s at 60 ticks
+RADIUS = 80  # Past this, entities aren't relevant
+FALLOFF = 10  # Priority halves this far away
+OCCLUDED = 0.25  # Priority factor for entities out of sight
+WEIGHTS = {'player': 1.0, 'star': 0.5, 'coin': 0.3}
+
+
+class InterestManager:
+    def __init__(self, colliders=None, budget=BUDGET, radius=RADIUS, falloff=FALLOFF, occluded=OCCLUDED,
+                 weights=WEIGHTS):
+        self.colliders = colliders
+        self.budget = budget
+        self.radius = radius
+        self.falloff = falloff
+        self.occluded = occluded
+        self.weights = weights
+        self.waiting = {}  # Viewer -> {entity key: accumulated priority}
+
+    def visible(self, eye, targets):
+        """For each target, whether the segment from eye to it misses every collider box"""
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+        if self.colliders is None or not len(self.colliders) or not len(targets):
+            return np.ones(len(targets), dtype=bool)
+        low = self.colliders.low.astype(np.float64)
+        high = self.colliders.high.astype(np.float64)
+        eye = np.asarray(eye, dtype=np.float64)
+        direction = targets - eye
+        # Slab test of every segment against every box, as segment parameters in [0, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / direction[:, None, :]
+            near = (low - eye) * inverse
+            far = (high - eye) * inverse
+        entry = np.nanmax(np.minimum(near, far), axis=2)
+        leave = np.nanmin(np.maximum(near, far), axis=2)
+        # Along an axis the segment doesn't move on, it is either inside that slab or never
+        parallel = direction[:, None, :] == 0
+        outside = parallel & ((eye < low) | (eye > high))
+        blocked = (entry <= leave) & (leave >= 0) & (entry <= 1) & ~outside.any(axis=2)
+        # Boxes the viewer or the target stands inside (a castle they walk around in) don't block
+        inside = lambda points: np.all((points[:, None, :] >= low) & (points[:, None, :] <= high), axis=2)
+        blocked &= ~inside(eye[None])
+        blocked &= ~inside(targets)
+        return ~blocked.any(axis=1)
+
+    def priorities(self, eye, kinds, positions):
+        """This tick's priority of each entity for a viewer at eye (0 when not relevant)"""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        distance = np.linalg.norm(positions - np.asarray(eye, dtype=np.float64), axis=1)
+        weight = np.array([self.weights.get(kind, 1.0) for kind in kinds])
+        priority = weight * self.falloff / (self.falloff + distance)
+        priority[~self.visible(eye, positions)] *= self.occluded
+        priority[distance > self.radius] = 0
+        return priority
+
+    def select(self, viewer, eye, candidates, cost, budget=None):
+        """Keys of the candidates to send this tick, most urgent first, within the byte budget
+
+        candidates: (key, kind, position) for everything that changed since the viewer last had it.
+        cost(key): bytes that entity would take in the snapshot.
+        """
+        budget = self.budget if budget is None else budget
+        waiting = self.waiting.setdefault(viewer, {})
+        if not candidates:
+            return []
+        keys = [key for key, _, _ in candidates]
+        sizes = {key: cost(key) for key in keys}
+        if sum(sizes.values()) <= budget:
+            # Everything fits: no need to rank it
+            for key in keys:
+                waiting.pop(key, None)
+            return keys
+        priority = self.priorities(eye, [kind for _, kind, _ in candidates], [pos for _, _, pos in candidates])
+        for key, value in zip(keys, priority.tolist()):
+            if value > 0:
+                waiting[key] = waiting.get(key, 0) + value
+
+        chosen = []
+        for key in sorted((key for key in keys if key in waiting), key=waiting.get, reverse=True):
+            size = sizes[key]
+            # Something too big for what's left may still leave room for smaller ones
+            if size <= budget:
+                budget -= size
+                chosen.append(key)
+                del waiting[key]
+        return chosen
+
+    def forget(self, viewer=None, key=None):
+        """Drop a viewer that left, or an entity that's gone from every viewer"""
+        if viewer is not None:
+            self.waiting.pop(viewer, None)
+        if key is not None:
+            for waiting in self.waiting.values():
+                waiting.pop(key, None)
+
+
+def run_harness(world, player_counts, ticks, budget, seed=0):
+    """Fake clients around netplay's server, with and without interest management; returns rows"""
+    import netplay
+    rows = []
+    for players in player_counts:
+        for managed in (False, True):
+            interest = InterestManager(netplay.make_colliders(world), budget=budget) if managed else None
+            stats = netplay.run_fake_clients(world, players, ticks, interest, seed)
+            rows.append({'players': players, 'interest': managed, **stats})
+            print(f'{players:>3} players, interest {"on " if managed else "off"}: '
+                  f'{stats["bytes_per_tick"]:8.1f} B/tick a client, {stats["server_bytes_per_tick"]:9.1f} B/tick in all, '
+                  f'{stats["players_per_snapshot"]:5.1f} players a snapshot, '
+                  f'others {stats["near_error"]:.2f} m off near / {stats["far_error"]:.2f} m far',
+                  file=sys.stderr)
+    return rows
+
+
+def main():
+    import json
+    import netplay
+    parser = argparse.ArgumentParser(description='Snapshot bytes per tick as players are added')
+    parser.add_argument('--players', nargs='*', type=int, default=[2, 4, 8, 16, 32, 64])
+    parser.add_argument('--ticks', type=int, default=300)
+    parser.add_argument('--budget', type=int, default=BUDGET, help='bytes per client per tick')
+    parser.add_argument('--world', choices=tuple(netplay.WORLDS), default='courtyard')
+    parser.add_argument('--output', help='also write the rows as JSON here')
+    args = parser.parse_args()
+    if max(args.players) > netplay.PLAYER_LIMIT:
+        parser.error(f'at most {netplay.PLAYER_LIMIT} players')
+
+    world = netplay.collect_world(args.world)
+    rows = run_harness(world, args.players, args.ticks, args.budget)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
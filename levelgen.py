@@ -0,0 +1,273 @@
+# ULTRA MARIO 3D BROS - Procedural Layout Generation
+# Level layouts are generated from an explicit seed into plain NumPy arrays
+# (positions, scales, colours) and cached on disk by (generator version, seed),
+# so the same seed always gives the same level and repeat builds load instantly.
+# Props are placed with placement.Placer so they never overlap each other, the
+# stars or the spawn point. seedsweep.py picks seeds for the hub's levels
+# into level_seeds.json, read back with best_seeds().
+import json
+import os
+import numpy as np
+from placement import Placer
+
+CACHE_DIR = os.environ.get('LAYOUT_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layout_cache'))
+
+# name -> (version, generator function)
+# Bump a generator's version whenever its output for a given seed changes.
+GENERATORS = {}
+_memory_cache = {}
+BEST_SEEDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'level_seeds.json')
+
+
+def generator(name, version):
+    def register(func):
+        GENERATORS[name] = (version, func)
+        return func
+    return register
+
+
+def cache_path(name, seed):
+    version, _ = GENERATORS[name]
+    return os.path.join(CACHE_DIR, f'{name}_v{version}_{seed}.npz')
+
+
+def generate(name, seed, use_cache=True):
+    """Return the layout for a level, generating and caching it if needed"""
+    version, func = GENERATORS[name]
+    key = (name, version, seed)
+    if use_cache and key in _memory_cache:
+        return _memory_cache[key]
+
+    path = cache_path(name, seed)
+    layout = None
+    if use_cache and os.path.exists(path):
+        try:
+            layout = load_layout(path)
+        except (OSError, ValueError, KeyError):
+            layout = None  # Corrupt cache entry, regenerate it
+
+    if layout is None:
+        layout = func(np.random.default_rng(seed))
+        if use_cache:
+            save_layout(path, layout)
+
+    if use_cache:
+        _memory_cache[key] = layout
+    return layout
+
+
+def best_seeds(path=BEST_SEEDS_FILE):
+    """{level: seed} picked by the last seed sweep, or {} without one"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return {level: int(seed) for level, seed in json.load(f).items()}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_layout(path, layout):
+    arrays = {f'{group}.{field}': values
+              for group, fields in layout.items()
+              for field, values in fields.items()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp.npz'
+    np.savez(temp_path, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_layout(path):
+    layout = {}
+    with np.load(path) as data:
+        for key in data.files:
+            group, field = key.split('.', 1)
+            layout.setdefault(group, {})[field] = data[key]
+    return layout
+
+
+# Jump reach used to keep platforms climbable: (max rise, max horizontal gap)
+PLATFORM_REACH = (2.5, 3.0)
+STAR_CLEARANCE = 1.6
+
+
+def _box(rng, count, *axes):
+    """count rows, one column per axis; an axis is a fixed value or a (low, high) range"""
+    columns = [rng.uniform(axis[0], axis[1], count) if isinstance(axis, tuple)
+               else np.full(count, float(axis))
+               for axis in axes]
+    return np.stack(columns, axis=1)
+
+
+def _colors(rng, count, low, high):
+    return rng.integers(low, high + 1, size=(count, 3))
+
+
+# Room each enemy kind (enemies.py) takes up where it stands
+ENEMY_SIZES = {'goomba': (1.2, 1, 1.2), 'bobomb': (1.1, 1.1, 1.1), 'whomp': (3, 4, 1)}
+
+
+def _enemies(rng, placer, extent=25, **counts):
+    """Groups of enemies on the floor, named by kind ('goombas', ...): their feet and headings"""
+    groups = {}
+    for kind, count in counts.items():
+        size = np.array(ENEMY_SIZES[kind], dtype=float)
+        feet, _ = placer.place(rng, count, (-extent, size[1] / 2, -extent), (extent, size[1] / 2, extent), size,
+                               spacing=2, standable=False)
+        feet[:, 1] = 0
+        groups[kind + 's'] = {'position': feet, 'heading': rng.uniform(0, 360, len(feet))}
+    return groups
+
+
+def _level_placer(stars, spawn=(0, 2, 0), exit_portal=(0, 1.5, -30), floor_y=0.0):
+    """Placer with the stars, player spawn and exit portal of a hub level kept clear"""
+    placer = Placer(cell_size=8.0, floor_y=floor_y)
+    placer.add(stars, STAR_CLEARANCE)
+    placer.add([spawn], (3, 4, 3))
+    placer.add([exit_portal], (4, 4, 2))
+    return placer
+
+
+# sm64pyv0hub.py levels
+GRASSLAND_STARS = [(10, 5, 10), (-15, 3, -10), (0, 10, 0)]
+DESERT_STARS = [(15, 8, 15), (-10, 5, -15), (0, 15, 0)]
+ICE_STARS = [(12, 6, 8), (-8, 4, -12), (0, 8, 0)]
+LAVA_STARS = [(10, 8, 10), (-12, 6, -8), (0, 12, 0)]
+
+
+@generator('grassland', version=3)
+def grassland_layout(rng):
+    placer = _level_placer(GRASSLAND_STARS)
+    # Tree boxes cover the trunk and the leaves above it
+    trees, _ = placer.place(rng, 20, (-25, 2.75, -25), (25, 2.75, 25), (3, 5.5, 3), spacing=1)
+    platform_pos, platform_scale = placer.place(rng, 15, (-20, 1, -20), (20, 8, 20), (3, 1, 3), (6, 1, 6),
+                                                spacing=1, reach=PLATFORM_REACH)
+    trees[:, 1] = 0
+    return {
+        'stars': {'position': np.array(GRASSLAND_STARS, dtype=float)},
+        'trees': {'position': trees},
+        'platforms': {'scale': platform_scale, 'position': platform_pos},
+        **_enemies(rng, placer, goomba=6, bobomb=3),
+    }
+
+
+@generator('desert', version=3)
+def desert_layout(rng):
+    placer = _level_placer(DESERT_STARS)
+    # Pyramid boxes cover all five stacked layers
+    pyramids, _ = placer.place(rng, 3, (-20, 2, -20), (20, 2, 20), (10, 5, 10), spacing=2)
+    cacti, _ = placer.place(rng, 10, (-25, 2, -25), (25, 2, 25), (0.5, 2, 0.5), spacing=1)
+    pyramids[:, 1] = 0
+    cacti[:, 1] = 1
+    return {
+        'stars': {'position': np.array(DESERT_STARS, dtype=float)},
+        'pyramids': {'position': pyramids},
+        'cacti': {'position': cacti},
+        **_enemies(rng, placer, goomba=4, whomp=3),
+    }
+
+
+@generator('ice', version=3)
+def ice_layout(rng):
+    placer = _level_placer(ICE_STARS)
+    block_pos, block_scale = placer.place(rng, 20, (-20, 0, -20), (20, 5, 20), (2, 1, 2), (5, 3, 5),
+                                          spacing=0.5, reach=PLATFORM_REACH)
+    snowmen, _ = placer.place(rng, 5, (-15, 1.6, -15), (15, 1.6, 15), (1.5, 3.2, 1.5), spacing=1)
+    snowmen[:, 1] = 0
+    return {
+        'stars': {'position': np.array(ICE_STARS, dtype=float)},
+        'ice_blocks': {'scale': block_scale, 'position': block_pos},
+        'snowmen': {'position': snowmen},
+        **_enemies(rng, placer, goomba=3, bobomb=3),
+    }
+
+
+@generator('lava', version=2)
+def lava_layout(rng):
+    placer = _level_placer(LAVA_STARS)
+    platform_pos, platform_scale = placer.place(rng, 25, (-25, 0, -25), (25, 10, 25), (3, 1, 3), (5, 1, 5),
+                                                spacing=1, reach=PLATFORM_REACH)
+    # Pillar footprints are kept clear at their tallest, then given a height
+    pillars, _ = placer.place(rng, 8, (-20, 5.5, -20), (20, 5.5, 20), (2, 15, 2), spacing=1)
+    pillars[:, 1] = -2
+    return {
+        'stars': {'position': np.array(LAVA_STARS, dtype=float)},
+        'platforms': {'scale': platform_scale, 'position': platform_pos},
+        'pillars': {
+            'scale': _box(rng, len(pillars), 2, (5, 15), 2),
+            'position': pillars,
+        },
+    }
+
+
+# samsoft1.0peach.py
+SPACE_SPAWN = (0, 30, 0)
+
+# Castle geometry the peach decorations have to stay out of
+PEACH_CASTLE_BOXES = [
+    ((0, 4, 0), (15, 8, 15)),      # Main castle
+    ((18, 5, 18), (3, 10, 3)),     # Towers
+    ((-18, 5, 18), (3, 10, 3)),
+    ((18, 5, -18), (3, 10, 3)),
+    ((-18, 5, -18), (3, 10, 3)),
+    ((0, 1, -20), (5, 2, 5)),      # Space portal
+]
+
+
+@generator('space', version=2)
+def space_layout(rng):
+    placer = Placer(cell_size=16.0)
+    placer.add([SPACE_SPAWN], 6)
+    hole_pos, hole_size = placer.place(rng, 3, (-120, 20, -120), (120, 60, 120), 3, 8, spacing=10)
+    warp_pos, _ = placer.place(rng, 2, (-100, 10, -100), (100, 40, 100), (5, 0.2, 5), spacing=4)
+    platform_pos, platform_scale = placer.place(rng, 20, (-100, 5, -100), (100, 50, 100), (3, 0.5, 3), (8, 0.5, 8),
+                                                spacing=2)
+    asteroid_pos, asteroid_size = placer.place(rng, 30, (-150, 10, -150), (150, 80, 150), 1, 5, spacing=2)
+    return {
+        'platforms': {
+            'scale': platform_scale,
+            'position': platform_pos,
+            'color': _colors(rng, len(platform_pos), 100, 200),
+        },
+        'asteroids': {
+            'scale': asteroid_size[:, 0],
+            'position': asteroid_pos,
+            'color': _colors(rng, len(asteroid_pos), 50, 150),
+        },
+        'black_holes': {'scale': hole_size[:, 0], 'position': hole_pos},
+        'warp_zones': {'position': warp_pos},
+        # Visual effect only, so these are free to overlap
+        'gravitational_fields': {
+            'scale': rng.uniform(10, 20, 5),
+            'position': _box(rng, 5, (-130, 130), (30, 70), (-130, 130)),
+        },
+    }
+
+
+@generator('peach_decorations', version=2)
+def peach_decorations_layout(rng):
+    placer = Placer(cell_size=4.0)
+    for center, size in PEACH_CASTLE_BOXES:
+        placer.add([center], size)
+    positions, scales = placer.place(rng, 15, (-18, 0, -18), (18, 0, 18), (0.5, 2, 0.5), (0.5, 4, 0.5), spacing=1)
+    return {'trees': {'scale': scales, 'position': positions}}
+
+
+# HackerSM64PYV09.21.251.0.py - x/z in [-1, 1], scaled by the decoration range in the game
+@generator('hacker_decorations', version=1)
+def hacker_decorations_layout(rng):
+    return {
+        'trees': {
+            'position': _box(rng, 25, (-1, 1), 0, (-1, 1)),
+            'height': rng.uniform(2, 4, 25),
+        },
+    }
+
+
+# cat'ssm64.py
+@generator('courtyard_decorations', version=2)
+def courtyard_decorations_layout(rng):
+    placer = Placer(cell_size=8.0)
+    placer.add([(0, 5, 0)], (20, 10, 20))  # Keep the trees outside the central castle
+    trees, _ = placer.place(rng, 18, (-30, 2, -30), (30, 2, 30), (2, 4, 2), spacing=1)
+    trees[:, 1] = 0
+    return {'trees': {'position': trees}}
@@ -0,0 +1,222 @@
+# ULTRA MARIO 3D BROS - Batched Mario Movement Simulation
+# MarioPlayer.update() from cat'ssm64.py (walking, jump, double and triple
+# jump, wall slide, wall jump, ground pound, long jump) rewritten to step
+# thousands of independent Marios at once. State is kept as structure-of-
+# arrays, one entry per Mario, and every rule is applied as a NumPy mask over
+# all of them, against one shared set of static box colliders. Nothing here
+# needs Ursina or a window, so it runs in worker processes and at thousands of
+# frames per second for level testing and route search.
+#
+#   colliders = Colliders.from_entities(scene.entities)   # or Colliders(centers, sizes)
+#   sim = MarioSim(colliders, count=4096, start=(0, 2, 0))
+#   for frame in range(600):
+#       sim.step(keys, dt=1/60)                            # keys: one bitmask per Mario
+#
+# The raycasts of the original become tests against axis-aligned boxes:
+# rotation on colliders is ignored, and so are sphere colliders (the game
+# only uses those for collectibles).
+import numpy as np
+
+# Input bits, one uint8 per Mario per frame
+W, S, A, D, JUMP, GROUND_POUND, LONG_JUMP = (1 << bit for bit in range(7))
+KEYS = {'w': W, 's': S, 'a': A, 'd': D, 'space': JUMP, 'left shift': GROUND_POUND, 'left control': LONG_JUMP}
+
+# MarioPlayer's defaults
+SPEED = 6
+JUMP_HEIGHT = 10
+GRAVITY = 25
+WALL_SLIDE_SPEED = 3
+WALL_JUMP_PUSH = 2
+GROUND_RAY = 1.1
+WALL_RAY = 0.6
+
+WALL_JUMP_DIRECTIONS = np.array([(1, 1, 0), (-1, 1, 0), (0, 1, -1), (0, 1, 1)], dtype=np.float64) / np.sqrt(2)
+# Wall rays in the order the original checks them: left, right, front, back
+_WALL_RAYS = ((0, -1), (0, 1), (2, 1), (2, -1))  # (axis, sign)
+
+
+def keys_from_held(held):
+    """The input bitmask for a set of held key names"""
+    mask = 0
+    for key in held:
+        mask |= KEYS.get(key, 0)
+    return mask
+
+
+class Colliders:
+    """Static axis-aligned boxes, as (M, 3) arrays of minimum and maximum corners"""
+
+    def __init__(self, centers, sizes):
+        # Single precision like Panda3D's transforms, so edge cases land on the same side
+        centers = np.asarray(centers, dtype=np.float32).reshape(-1, 3)
+        # Ursina gives every box collider some thickness
+        half = np.maximum(np.abs(np.asarray(sizes, dtype=np.float32).reshape(-1, 3)) / 2, np.float32(0.001))
+        self.low = centers - half
+        self.high = centers + half
+
+    def __len__(self):
+        return len(self.low)
+
+    @classmethod
+    def from_entities(cls, entities):
+        """The box colliders of some Ursina entities (UI left out), taken as axis aligned"""
+        from ursina import camera
+        from ursina.collider import BoxCollider
+        centers, sizes = [], []
+        for entity in entities:
+            collider = getattr(entity, 'collider', None)
+            if not isinstance(collider, BoxCollider) or not entity.enabled or entity.has_ancestor(camera.ui):
+                continue
+            scale = np.array(entity.world_scale)
+            centers.append(np.array(entity.world_position) + np.array(collider.center) * scale)
+            sizes.append(np.array(collider.size) * scale)
+        return cls(centers, sizes)
+
+    def to_lists(self):
+        """Centers and sizes as plain lists, for pickling or JSON; Colliders(**to_lists()) rebuilds them"""
+        return {'centers': ((self.low + self.high) / 2).tolist(), 'sizes': (self.high - self.low).tolist()}
+
+    def ray_hits(self, origins, axis, sign, distance):
+        """For each origin, whether a ray along +-axis hits any box within distance"""
+        if not len(self):
+            return np.zeros(len(origins), dtype=bool)
+        # A ray along one axis can only hit a box when the other two coordinates are inside it
+        hits = np.ones((len(origins), len(self)), dtype=bool)
+        for other in range(3):
+            if other != axis:
+                coord = origins[:, other, None]
+                hits &= (coord >= self.low[:, other]) & (coord <= self.high[:, other])
+        # Like Panda3D, a ray hits the face it enters through, or the face it leaves
+        # through when it starts inside the box
+        start = origins[:, axis, None]
+        entry_face, exit_face = (self.low, self.high) if sign > 0 else (self.high, self.low)
+        to_entry = (entry_face[:, axis] - start) * sign
+        to_exit = (exit_face[:, axis] - start) * sign
+        to_hit = np.where(to_entry >= 0, to_entry, to_exit)
+        hits &= (to_exit >= 0) & (to_hit <= distance)
+        return hits.any(axis=1)
+
+
+class MarioSim:
+    # Every per-Mario array, for state() and restore()
+    STATE = ('position', 'rotation_y', 'velocity_y', 'air_time', 'jumping', 'wall_sliding', 'is_long_jumping',
+             'double_jump_available', 'wall_jump_available', 'wall_jump_direction', 'triple_jump_count')
+
+    def __init__(self, colliders, count=1, start=(0, 2, 0), speed=SPEED, jump_height=JUMP_HEIGHT,
+                 gravity=GRAVITY, improved_collision=True, wall_slide_speed=WALL_SLIDE_SPEED,
+                 wall_jump_push=WALL_JUMP_PUSH, triple_jump=True):
+        self.colliders = colliders
+        self.speed = speed
+        self.jump_height = jump_height
+        self.gravity = gravity
+        self.improved_collision = improved_collision
+        # The HackerSM64 edition's Player slides and pushes off walls more gently and has no triple jump
+        self.wall_slide_speed = wall_slide_speed
+        self.wall_jump_push = wall_jump_push
+        self.triple_jump = triple_jump
+
+        self.position = np.tile(np.asarray(start, dtype=np.float32), (count, 1))
+        self.rotation_y = np.zeros(count)
+        self.velocity_y = np.zeros(count)
+        self.air_time = np.zeros(count)
+        self.jumping = np.zeros(count, dtype=bool)
+        self.wall_sliding = np.zeros(count, dtype=bool)
+        self.is_long_jumping = np.zeros(count, dtype=bool)
+        self.double_jump_available = np.ones(count, dtype=bool)
+        self.wall_jump_available = np.zeros(count, dtype=bool)
+        self.wall_jump_direction = np.zeros((count, 3))
+        self.triple_jump_count = np.zeros(count, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.position)
+
+    def state(self):
+        """A copy of every Mario's state, to restore() later"""
+        return {name: getattr(self, name).copy() for name in self.STATE}
+
+    def restore(self, state, index=None):
+        """Restore a state() copy, or pick Marios out of it (index: array of rows, one per Mario)"""
+        for name in self.STATE:
+            values = state[name]
+            setattr(self, name, values.copy() if index is None else values[index])
+
+    def step(self, keys, dt, rotation_y=None):
+        """Advance every Mario by one frame; keys is one input bitmask per Mario (or one for all)"""
+        keys = np.broadcast_to(np.asarray(keys, dtype=np.uint8), (len(self),))
+        if rotation_y is not None:
+            self.rotation_y = np.broadcast_to(np.asarray(rotation_y, dtype=np.float64), (len(self),)).copy()
+        jump = (keys & JUMP) != 0
+        improved = self.improved_collision
+        position = self.position
+
+        # Walking, in world axes like the original
+        direction = np.zeros((len(self), 3))
+        direction[:, 2] += ((keys & W) != 0).astype(np.float64) - ((keys & S) != 0)
+        direction[:, 0] += ((keys & D) != 0).astype(np.float64) - ((keys & A) != 0)
+        length = np.linalg.norm(direction, axis=1)
+        moving = length > 0
+        direction[moving] /= length[moving, None]
+        position += direction * (self.speed * dt)
+
+        grounded = self.colliders.ray_hits(position, 1, -1, GROUND_RAY)
+        airborne = ~grounded
+
+        # On the ground: reset, and jump if asked to
+        self.velocity_y[grounded] = 0
+        self.jumping[grounded] = False
+        self.air_time[grounded] = 0
+        self.double_jump_available[grounded] = True
+        self.wall_sliding[grounded] = False
+        self.triple_jump_count[grounded] = 0
+        takeoff = grounded & jump
+        self.velocity_y[takeoff] = self.jump_height
+        self.jumping[takeoff] = True
+        self.triple_jump_count[takeoff] = 1
+
+        # In the air: gravity, then the air moves in the original's order
+        self.velocity_y[airborne] -= self.gravity * dt
+        self.air_time[airborne] += dt
+        if improved:
+            checking = airborne & (self.air_time > 0.2)
+            if checking.any():
+                rows = np.flatnonzero(checking)
+                hits = np.stack([self.colliders.ray_hits(position[rows], axis, sign, WALL_RAY)
+                                 for axis, sign in _WALL_RAYS], axis=1)
+                wall_hit = hits.any(axis=1)
+                walled = rows[wall_hit]
+                self.wall_sliding[rows] = wall_hit
+                self.wall_jump_available[rows] = wall_hit
+                self.velocity_y[walled] = np.maximum(self.velocity_y[walled], -self.wall_slide_speed)
+                # The first wall hit in left, right, front, back order picks the direction
+                self.wall_jump_direction[walled] = WALL_JUMP_DIRECTIONS[hits[wall_hit].argmax(axis=1)]
+
+            double_jump = airborne & self.double_jump_available & jump & (self.air_time > 0.2)
+            self.velocity_y[double_jump] = self.jump_height * 0.8
+            self.double_jump_available[double_jump] = False
+            self.triple_jump_count[double_jump] = 2
+
+            if self.triple_jump:
+                triple_jump = airborne & (self.triple_jump_count == 2) & jump & (self.air_time > 0.4)
+                self.velocity_y[triple_jump] = self.jump_height * 1.2
+                self.triple_jump_count[triple_jump] = 3
+
+            wall_jump = airborne & self.wall_jump_available & jump
+            self.velocity_y[wall_jump] = self.jump_height
+            position[wall_jump] += self.wall_jump_direction[wall_jump] * self.wall_jump_push
+            self.wall_jump_available[wall_jump] = False
+
+        ground_pound = airborne & ((keys & GROUND_POUND) != 0) & (self.velocity_y > -10)
+        self.velocity_y[ground_pound] = -20
+
+        position[:, 1] += self.velocity_y * dt
+
+        # Long jump, forward along the facing direction
+        long_jump = ((keys & LONG_JUMP) != 0) & jump & ~self.jumping
+        if long_jump.any():
+            yaw = np.radians(self.rotation_y[long_jump])
+            forward = np.stack([np.sin(yaw), np.zeros_like(yaw), np.cos(yaw)], axis=1)
+            self.velocity_y[long_jump] = self.jump_height * 0.7
+            position[long_jump] += forward * 3
+            self.jumping[long_jump] = True
+            self.is_long_jumping[long_jump] = True
+        return grounded
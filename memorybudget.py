@@ -0,0 +1,176 @@
+# ULTRA MARIO 3D BROS - Memory Budgets
+# Wrap a level build in MemoryBudget.build() and it works out what the build
+# cost: Python memory (tracemalloc, net of what was freed again), Panda3D
+# nodes, vertex bytes and texture bytes, the last two broken down by model and
+# texture. Geometry and textures shared between entities (every 'cube' shares
+# one vertex buffer) are only counted once per build. A build over its budget
+# prints a warning, and F4 shows the numbers for every level built so far.
+#
+#   memory_budget = MemoryBudget(budgets={'space': {'nodes': 4000}})
+#   with memory_budget.build('grassland'):
+#       level.create()
+#
+# A build spread over several frames calls begin(label, sliced=True), wraps
+# each slice in slice(label) and calls end(label) when done; only the slices
+# are traced, not the gameplay frames between them.
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from ursina import Entity, Text, scene, camera
+
+MB = 1024 * 1024
+DEFAULT_BUDGET = {
+    'python_bytes': 8 * MB,
+    'nodes': 2000,
+    'vertex_bytes': 16 * MB,
+    'texture_bytes': 64 * MB,
+}
+
+
+def measure(entities):
+    """Memory held by the given entities' own nodes, geometry and textures"""
+    nodes = 0
+    vertex_arrays = set()
+    textures = set()
+    by_model = Counter()
+    by_texture = Counter()
+
+    for entity in entities:
+        nodes += 1
+        model = entity.model
+        if model:
+            nodes += 1 + model.count_num_descendants()
+            name = model.name or 'unnamed'
+            geom_nodes = list(model.find_all_matches('**/+GeomNode'))
+            if model.node().is_geom_node():
+                geom_nodes.append(model)
+            for geom_node in geom_nodes:
+                for geom in geom_node.node().get_geoms():
+                    data = geom.get_vertex_data()
+                    for i in range(data.get_num_arrays()):
+                        array = data.get_array(i)
+                        if array not in vertex_arrays:
+                            vertex_arrays.add(array)
+                            by_model[name] += array.get_data_size_bytes()
+
+        for texture in entity.find_all_textures():
+            if texture not in textures:
+                textures.add(texture)
+                by_texture[texture.name or 'unnamed'] += texture.estimate_texture_memory()
+
+    return {
+        'nodes': nodes,
+        'vertex_bytes': sum(by_model.values()),
+        'texture_bytes': sum(by_texture.values()),
+        'by_model': dict(by_model),
+        'by_texture': dict(by_texture),
+    }
+
+
+class MemoryBudget(Entity):
+    def __init__(self, budgets=None, default=DEFAULT_BUDGET, report=print, **kwargs):
+        super().__init__(parent=camera.ui, eternal=True, **kwargs)
+        self.budgets = budgets or {}
+        self.default = default
+        self.report = report
+        self.levels = {}  # label -> measurements of its last build
+        self.pending = {}
+        self.overlay = Text(parent=self, text='', position=(0.3, -0.1), scale=0.8,
+                            origin=(-0.5, 0.5), font='VeraMono.ttf', background=True, enabled=False)
+
+    def budget(self, label):
+        return {**self.default, **self.budgets.get(label, {})}
+
+    def begin(self, label, sliced=False):
+        """Start accounting for a build that may run over several frames.
+
+        A sliced build is only traced inside its slice() blocks, so the gameplay
+        frames between slices run without tracemalloc and aren't charged to it.
+        """
+        existing = {id(entity) for entity in scene.entities}
+        self.pending[label] = {'existing': existing, 'python_bytes': 0, 'traced_from': None, 'started_tracing': False}
+        if not sliced:
+            self._resume(self.pending[label])
+
+    def _resume(self, pending):
+        pending['started_tracing'] = not tracemalloc.is_tracing()
+        if pending['started_tracing']:
+            tracemalloc.start()
+        pending['traced_from'] = tracemalloc.get_traced_memory()[0]
+
+    def _pause(self, pending):
+        pending['python_bytes'] += tracemalloc.get_traced_memory()[0] - pending['traced_from']
+        pending['traced_from'] = None
+        if pending['started_tracing']:
+            tracemalloc.stop()
+
+    @contextmanager
+    def slice(self, label):
+        """Trace one slice of a sliced build"""
+        pending = self.pending[label]
+        self._resume(pending)
+        try:
+            yield
+        finally:
+            self._pause(pending)
+
+    def end(self, label, entities=None):
+        """Finish accounting for a build; returns its measurements.
+
+        The build is charged for the entities it created, or for entities if given
+        (for builds that run alongside gameplay and shouldn't be charged for it).
+        """
+        pending = self.pending.pop(label)
+        if pending['traced_from'] is not None:
+            self._pause(pending)
+        python_bytes = max(pending['python_bytes'], 0)
+        existing = pending['existing']
+
+        if entities is None:
+            entities = [entity for entity in scene.entities if id(entity) not in existing]
+        created = list(entities)
+        usage = measure(created)
+        usage['python_bytes'] = python_bytes
+        usage['entities'] = len(created)
+        self.levels[label] = usage
+
+        over = {key: (usage[key], limit) for key, limit in self.budget(label).items() if usage[key] > limit}
+        if over:
+            self.report(f"'{label}' is over its memory budget: " +
+                        ', '.join(f'{key} {_format(key, value)} > {_format(key, limit)}'
+                                  for key, (value, limit) in over.items()))
+        if self.overlay.enabled:
+            self.redraw()
+        return usage
+
+    @contextmanager
+    def build(self, label):
+        self.begin(label)
+        try:
+            yield
+        finally:
+            self.end(label)
+
+    def input(self, key):
+        if key == 'f4':
+            self.overlay.enabled = not self.overlay.enabled
+            if self.overlay.enabled:
+                self.redraw()
+
+    def redraw(self, top=3):
+        lines = [f'{"level":<12}{"python":>9}{"nodes":>7}{"verts":>9}{"tex":>9}']
+        for label, usage in self.levels.items():
+            budget = self.budget(label)
+            flag = ' !' if any(usage[key] > limit for key, limit in budget.items()) else ''
+            lines.append(f'{label:<12}{_format("python_bytes", usage["python_bytes"]):>9}{usage["nodes"]:>7}'
+                         f'{_format("vertex_bytes", usage["vertex_bytes"]):>9}'
+                         f'{_format("texture_bytes", usage["texture_bytes"]):>9}{flag}')
+            for title in ('by_model', 'by_texture'):
+                heaviest = Counter(usage[title]).most_common(top)
+                if heaviest:
+                    lines.append('  ' + ', '.join(f'{name} {value / 1024:.0f}K' for name, value in heaviest))
+        self.overlay.text = '\n'.join(lines)
+
+
+def _format(key, value):
+    return str(value) if key == 'nodes' else f'{value / MB:.2f}M'
@@ -0,0 +1,385 @@
+# ULTRA MARIO 3D BROS - Navigation Mesh
+# A waypoint graph over a level's static box colliders, for anything that
+# moves on its own (enemies, bots). Walkable points are laid on a grid over
+# the top of every box that has room to stand above it, and joined to their
+# neighbours when the step between them is small enough to walk. Separate
+# surfaces are then joined by jump links (up to a jump's height and reach)
+# and drop links (down off an edge). A* answers path queries, and paths are
+# kept in a cache, so agents that share a start and a goal share the search.
+#
+#   mesh = NavMesh.for_level('grassland', seed, colliders)   # built once, then read from disk
+#   points = mesh.path(enemy_position, player_position)      # feet positions, or None
+#   waypoint = mesh.steer(enemy_position, player_position)   # just the next one
+#
+# Graphs are saved under navmesh_cache/, named by level and seed, with a
+# digest of the colliders and settings so a changed layout builds a new one.
+# Running this file builds the graphs for sm64pyv0hub.py's levels and the
+# HackerSM64 castle and times queries:
+#
+#   python navmesh.py --seeds 0 1 2 --queries 2000
+#
+# sm64pyv0hub.py's enemies (enemies.py) chase the player along these paths.
+#
+# Links follow the default jump physics (mariosim.py's SPEED, JUMP_HEIGHT,
+# GRAVITY) and leave out double jumps, wall jumps and ceilings in the way.
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import os
+import sys
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+import mariosim
+
+FORMAT_VERSION = 1
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'navmesh_cache')
+
+CELL = 1.0  # Spacing of walkable points
+INSET = 0.3  # Points keep this far in from the edges of a top
+CLEARANCE = 2.0  # Room needed above a point to stand there
+STEP = 0.6  # Most a walk between neighbouring points may climb
+# A plain jump: the rise is v^2 / 2g, and the reach is what walking speed covers while airborne
+JUMP_RISE = 0.9 * mariosim.JUMP_HEIGHT ** 2 / (2 * mariosim.GRAVITY)
+JUMP_REACH = 0.8 * mariosim.SPEED * 2 * mariosim.JUMP_HEIGHT / mariosim.GRAVITY
+MAX_DROP = 12.0
+LINKS_PER_SURFACE = 3  # Jump and drop links kept from an edge point to each other surface in reach
+JUMP_COST = 1.5  # Jumps count as this much farther than walking the same distance
+PATH_CACHE = 4096
+
+WALK, JUMP, DROP = range(3)
+_NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def _walkable_points(colliders, cell, inset, clearance):
+    """Grid points on top of every box, without the ones another box leaves no room above"""
+    low, high = colliders.low.astype(np.float64), colliders.high.astype(np.float64)
+    points = []
+    for box in range(len(low)):
+        x0, x1 = low[box, 0] + inset, high[box, 0] - inset
+        z0, z1 = low[box, 2] + inset, high[box, 2] - inset
+        # On the shared grid, so points on neighbouring boxes line up; a box narrower than that gets its middle
+        xs = np.arange(math.ceil(x0 / cell), math.floor(x1 / cell) + 1) * cell if x1 >= x0 else np.array([])
+        zs = np.arange(math.ceil(z0 / cell), math.floor(z1 / cell) + 1) * cell if z1 >= z0 else np.array([])
+        if not len(xs):
+            xs = np.array([(low[box, 0] + high[box, 0]) / 2])
+        if not len(zs):
+            zs = np.array([(low[box, 2] + high[box, 2]) / 2])
+        gx, gz = np.meshgrid(xs, zs, indexing='ij')
+        points.append(np.column_stack([gx.ravel(), np.full(gx.size, high[box, 1]), gz.ravel()]))
+    if not points:
+        return np.zeros((0, 3))
+    points = np.concatenate(points)
+
+    keep = np.ones(len(points), dtype=bool)
+    for start in range(0, len(points), 4096):
+        chunk = points[start:start + 4096]
+        above = ((chunk[:, None, 0] > low[:, 0]) & (chunk[:, None, 0] < high[:, 0]) &
+                 (chunk[:, None, 2] > low[:, 2]) & (chunk[:, None, 2] < high[:, 2]) &
+                 (high[:, 1] > chunk[:, None, 1] + 1e-3) & (low[:, 1] < chunk[:, None, 1] + clearance))
+        keep[start:start + 4096] = ~above.any(axis=1)
+    points = points[keep]
+    # Coplanar boxes side by side or stacked give the same point twice
+    keys = np.column_stack([np.round(points[:, 0] / cell * 8), np.round(points[:, 2] / cell * 8),
+                            np.round(points[:, 1] * 20)])
+    _, first = np.unique(keys, axis=0, return_index=True)
+    return points[np.sort(first)]
+
+
+def _walk_links(points, cell, step):
+    """Links between grid neighbours (diagonals too) whose heights are within a step"""
+    columns = np.round(points[:, [0, 2]] / cell).astype(np.int64)
+    offset = columns.min(axis=0) - 1
+    width = columns[:, 1].max() - offset[1] + 2
+    keys = (columns[:, 0] - offset[0]) * width + (columns[:, 1] - offset[1])
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    layers = np.bincount(np.unique(sorted_keys, return_inverse=True)[1]).max()
+
+    sources, targets = [], []
+    for dx, dz in _NEIGHBOURS:
+        wanted = keys + dx * width + dz
+        first = np.searchsorted(sorted_keys, wanted, side='left')
+        last = np.searchsorted(sorted_keys, wanted, side='right')
+        for layer in range(layers):
+            present = first + layer < last
+            source = np.flatnonzero(present)
+            target = order[first[present] + layer]
+            close = np.abs(points[target, 1] - points[source, 1]) <= step
+            sources.append(source[close])
+            targets.append(target[close])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def _surfaces(count, sources, targets):
+    """Connected component of every point over the walk links"""
+    parent = np.arange(count)
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(sources.tolist(), targets.tolist()):
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([root(i) for i in range(count)])
+
+
+def _air_links(points, surface, edge, reach, rise, drop, per_surface):
+    """Jump and drop links from each edge point to the nearest points of other surfaces in reach, both ways"""
+    buckets = {}
+    bucket_of = np.floor(points[:, [0, 2]] / reach).astype(np.int64)
+    for index, (bx, bz) in enumerate(bucket_of.tolist()):
+        buckets.setdefault((bx, bz), []).append(index)
+    buckets = {key: np.array(value) for key, value in buckets.items()}
+
+    sources, targets, kinds = [], [], []
+    for a in np.flatnonzero(edge).tolist():
+        bx, bz = bucket_of[a]
+        nearby = [buckets[key] for key in ((bx + i, bz + j) for i in (-1, 0, 1) for j in (-1, 0, 1)) if key in buckets]
+        candidates = np.concatenate(nearby)
+        candidates = candidates[surface[candidates] != surface[a]]
+        if not len(candidates):
+            continue
+        flat = np.hypot(*(points[candidates][:, [0, 2]] - points[a, [0, 2]]).T)
+        within = flat <= reach
+        candidates, flat = candidates[within], flat[within]
+        for other in np.unique(surface[candidates]).tolist():
+            mine = surface[candidates] == other
+            for b in candidates[mine][np.argsort(flat[mine], kind='stable')[:per_surface]].tolist():
+                dy = points[b, 1] - points[a, 1]
+                # a -> b, then b -> a
+                for source, target, up in ((a, b, dy), (b, a, -dy)):
+                    kind = JUMP if 0 <= up <= rise else DROP if -drop <= up < 0 else None
+                    if kind is not None:
+                        sources.append(source)
+                        targets.append(target)
+                        kinds.append(kind)
+    return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64), np.array(kinds, dtype=np.int8)
+
+
+class NavMesh:
+    def __init__(self, points, indptr, targets, costs, kinds, path_cache=PATH_CACHE):
+        self.points = np.asarray(points, dtype=np.float64)  # Feet positions of the waypoints
+        self.indptr = np.asarray(indptr, dtype=np.int64)  # Links of point i: targets[indptr[i]:indptr[i + 1]]
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.costs = np.asarray(costs, dtype=np.float64)
+        self.kinds = np.asarray(kinds, dtype=np.int8)  # WALK, JUMP or DROP
+        self.path_cache = path_cache
+        self.cache = OrderedDict()  # (start, goal) -> tuple of points, most recently used last
+        self.hits = 0
+        self.misses = 0
+        # A* runs on plain lists: much faster to index one at a time than arrays
+        self._links = [list(zip(self.targets[a:b].tolist(), self.costs[a:b].tolist()))
+                       for a, b in zip(self.indptr[:-1].tolist(), self.indptr[1:].tolist())]
+        self._xyz = self.points.tolist()
+        # Grid column -> (top, index) of its points, for agents standing on the grid
+        self._columns = {}
+        for index, (x, y, z) in enumerate(self._xyz):
+            self._columns.setdefault((round(x / CELL), round(z / CELL)), []).append((y, index))
+        self._buckets = {}
+        for index, (x, z) in enumerate(np.floor(self.points[:, [0, 2]] / (CELL * 4)).astype(np.int64).tolist()):
+            self._buckets.setdefault((x, z), []).append(index)
+        self._buckets = {key: np.array(value) for key, value in self._buckets.items()}
+
+    def __len__(self):
+        return len(self.points)
+
+    @classmethod
+    def build(cls, colliders, cell=CELL, inset=INSET, clearance=CLEARANCE, step=STEP, jump_rise=JUMP_RISE,
+              jump_reach=JUMP_REACH, max_drop=MAX_DROP, per_surface=LINKS_PER_SURFACE):
+        points = _walkable_points(colliders, cell, inset, clearance)
+        if not len(points):
+            return cls(points, np.zeros(1, dtype=np.int64), [], [], [])
+        walk_from, walk_to = _walk_links(points, cell, step)
+        surface = _surfaces(len(points), walk_from, walk_to)
+        # Points missing a walkable neighbour are on an edge, where jumps and drops start
+        edge = np.bincount(walk_from, minlength=len(points)) < len(_NEIGHBOURS)
+        air_from, air_to, air_kinds = _air_links(points, surface, edge, jump_reach, jump_rise, max_drop, per_surface)
+
+        sources = np.concatenate([walk_from, air_from])
+        targets = np.concatenate([walk_to, air_to])
+        kinds = np.concatenate([np.full(len(walk_from), WALK, dtype=np.int8), air_kinds])
+        costs = np.linalg.norm(points[targets] - points[sources], axis=1)
+        costs[kinds == JUMP] *= JUMP_COST
+        order = np.lexsort((targets, sources))
+        sources, targets, kinds, costs = sources[order], targets[order], kinds[order], costs[order]
+        # Each link once (a point can be linked to the same neighbour through two layers)
+        unique = np.ones(len(sources), dtype=bool)
+        unique[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        sources, targets, kinds, costs = sources[unique], targets[unique], kinds[unique], costs[unique]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(points)))])
+        return cls(points, indptr, targets, costs, kinds)
+
+    @classmethod
+    def for_level(cls, level, seed, colliders, directory=CACHE_DIRECTORY, **settings):
+        """The level's graph from the disk cache, built and saved there the first time"""
+        digest = hashlib.sha1()
+        digest.update(colliders.low.tobytes())
+        digest.update(colliders.high.tobytes())
+        digest.update(json.dumps([FORMAT_VERSION, sorted(settings.items())]).encode())
+        path = os.path.join(directory, f'{level}_{seed}_{digest.hexdigest()[:12]}.npz')
+        if os.path.exists(path):
+            try:
+                return cls.load(path)
+            except (OSError, ValueError, KeyError):
+                pass  # Unreadable: build it again
+        mesh = cls.build(colliders, **settings)
+        mesh.save(path)
+        return mesh
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = path + '.tmp.npz'
+        np.savez_compressed(temp_path, version=FORMAT_VERSION, points=self.points, indptr=self.indptr,
+                            targets=self.targets, costs=self.costs, kinds=self.kinds)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != FORMAT_VERSION:
+                raise ValueError(f'{path} is navmesh format {int(data["version"])}, not {FORMAT_VERSION}')
+            return cls(data['points'], data['indptr'], data['targets'], data['costs'], data['kinds'])
+
+    def nearest(self, position):
+        """Index of the waypoint an agent at position stands on or nearest to, or None for an empty graph"""
+        if not len(self.points):
+            return None
+        x, y, z = (float(value) for value in position)
+        # Usually the highest point of its grid column that isn't over its head
+        below = [entry for entry in self._columns.get((round(x / CELL), round(z / CELL)), ()) if entry[0] <= y + 0.5]
+        if below:
+            return max(below)[1]
+        position = np.array((x, y, z))
+        bx, bz = np.floor(position[[0, 2]] / (CELL * 4)).astype(np.int64).tolist()
+        nearby = [self._buckets[key] for key in ((bx + i, bz + j) for i in (-1, 0, 1) for j in (-1, 0, 1))
+                  if key in self._buckets]
+        candidates = np.concatenate(nearby) if nearby else np.arange(len(self.points))
+        offset = self.points[candidates] - position
+        # Prefer the ground under the agent to a platform over its head
+        offset[:, 1] = np.where(offset[:, 1] > 0.5, offset[:, 1] * 4, offset[:, 1])
+        return int(candidates[np.argmin(np.einsum('ij,ij->i', offset, offset))])
+
+    def node_path(self, start, goal):
+        """Waypoint indices from start to goal (both included), or None when goal can't be reached"""
+        key = (start, goal)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        path = self._search(start, goal)
+        self.cache[key] = path
+        if len(self.cache) > self.path_cache:
+            self.cache.popitem(last=False)
+        return path
+
+    def _search(self, start, goal):
+        xyz, links = self._xyz, self._links
+        gx, gy, gz = xyz[goal]
+        came_from = {start: None}
+        cost = {start: 0.0}
+        frontier = [(0.0, 0.0, start)]
+        while frontier:
+            _, base, node = heapq.heappop(frontier)
+            if base > cost[node]:
+                continue  # Reached more cheaply since this entry was pushed
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = came_from[node]
+                return tuple(reversed(path))
+            for target, step_cost in links[node]:
+                new_cost = base + step_cost
+                if new_cost < cost.get(target, math.inf):
+                    cost[target] = new_cost
+                    came_from[target] = node
+                    x, y, z = xyz[target]
+                    heapq.heappush(frontier, (new_cost + math.sqrt((x - gx) ** 2 + (y - gy) ** 2 + (z - gz) ** 2),
+                                              new_cost, target))
+        return None
+
+    def path(self, start, goal):
+        """Feet positions from the waypoint nearest start to the one nearest goal, or None"""
+        nodes = self.node_path(self.nearest(start), self.nearest(goal))
+        return None if nodes is None else self.points[list(nodes)]
+
+    def steer(self, position, goal):
+        """The next waypoint toward goal (the goal's own when already there), or None when unreachable"""
+        nodes = self.node_path(self.nearest(position), self.nearest(goal))
+        if nodes is None:
+            return None
+        return self.points[nodes[1] if len(nodes) > 1 else nodes[0]]
+
+    def link_counts(self):
+        return {name: int((self.kinds == kind).sum()) for kind, name in ((WALK, 'walk'), (JUMP, 'jump'), (DROP, 'drop'))}
+
+
+def _castle_level(seed):
+    import tas
+    castle = tas.collect_castle(seed)
+    return {'level': 'castle', 'seed': seed, 'spawn': castle['spawn'], 'colliders': castle['colliders']}
+
+
+def time_queries(mesh, queries, agents, rng):
+    """Queries a second between random waypoints: all different (cold), then agents sharing goals (warm)"""
+    mesh.cache.clear()
+    starts = rng.integers(0, len(mesh), queries)
+    goals = rng.integers(0, len(mesh), queries)
+    began = perf_counter()
+    found = sum(mesh.path(mesh.points[a], mesh.points[b]) is not None for a, b in zip(starts, goals))
+    cold = queries / (perf_counter() - began)
+
+    # Agents standing still for a moment and chasing a few targets, the way enemies do
+    positions = mesh.points[rng.integers(0, len(mesh), agents)]
+    targets = mesh.points[rng.integers(0, len(mesh), 4)]
+    began = perf_counter()
+    for frame in range(max(queries // agents, 1)):
+        for index, position in enumerate(positions):
+            mesh.steer(position, targets[index % len(targets)])
+    warm = max(queries // agents, 1) * agents / (perf_counter() - began)
+    return {'found': found / queries, 'cold_per_second': round(cold), 'warm_per_second': round(warm)}
+
+
+def main():
+    import botfarm
+    from gamerunner import in_new_process
+    parser = argparse.ArgumentParser(description='Build navigation meshes and time path queries')
+    parser.add_argument('--seeds', nargs='*', type=int, default=[0])
+    parser.add_argument('--levels', nargs='*', help='only these levels (by name; castle is the HackerSM64 castle)')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--agents', type=int, default=200)
+    parser.add_argument('--rebuild', action='store_true', help='ignore the disk cache')
+    args = parser.parse_args()
+
+    levels = in_new_process(botfarm.collect_levels, 'sm64pyv0hub.py', args.seeds)
+    for seed in args.seeds:
+        levels.append(in_new_process(_castle_level, seed))
+    rng = np.random.default_rng(0)
+    for level in levels:
+        if args.levels and level['level'] not in args.levels:
+            continue
+        colliders = mariosim.Colliders(level['colliders']['centers'], level['colliders']['sizes'])
+        began = perf_counter()
+        if args.rebuild:
+            mesh = NavMesh.build(colliders)
+        else:
+            mesh = NavMesh.for_level(level['level'], level['seed'], colliders)
+        built = perf_counter() - began
+        timing = time_queries(mesh, args.queries, args.agents, rng)
+        print(f'{level["level"]} (seed {level["seed"]}): {len(mesh)} points, {mesh.link_counts()}, '
+              f'ready in {built * 1000:.0f} ms; {timing["found"]:.0%} of random pairs connected, '
+              f'{timing["cold_per_second"]} queries/s uncached, {timing["warm_per_second"]} steers/s '
+              f'for {args.agents} agents')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,733 @@
+# ULTRA MARIO 3D BROS - Local Multiplayer
+# An authoritative server for the HackerSM64 edition's castle (or cat'ssm64.py's
+# courtyard) and clients that predict their own movement, over UDP with
+# asyncio. The server builds the world once offscreen (like tas.py) and then
+# simulates every player with the batched movement model in mariosim.py at 60
+# ticks a second. Coins and stars are shared; in the castle whoever touches the
+# crown once every coin is taken wins, in the courtyard whoever takes the last star.
+#
+# Clients send their input every tick, with the last few inputs repeated so a
+# lost packet costs nothing, and step their own Mario straight away. Each
+# snapshot says which input the server got to; when the server's state there
+# differs from what the client predicted, the client takes the server's state
+# and replays the inputs since. Snapshots are binary and delta encoded against
+# the last snapshot the client acknowledged: per player, only the fields that
+# changed are sent, and a player the client already has as they are isn't
+# sent at all. With interest management (interest.py, on by default) each
+# client gets the players most relevant to it within a byte budget a tick.
+#
+#   python netplay.py server --port 6464 --world courtyard
+#   python netplay.py client --host 127.0.0.1 --seconds 30
+#   python netplay.py local --players 16 --latency 60 --jitter 10 --loss 0.05
+#
+# local runs a server and bot clients in one process over real localhost
+# sockets, with latency, jitter and loss simulated on every packet sent, and
+# reports tick times, bandwidth and how often and how far predictions were
+# corrected. The bots play benchmark.py's scripted input.
+#
+# Unlike the port, falling off the map also clears the falling speed: the
+# port keeps it, which usually drops the player straight through the castle.
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import zlib
+from time import perf_counter
+import numpy as np
+from gamerunner import in_new_process, run_game
+from interest import InterestManager
+import mariosim
+import tas
+
+PORT = 6464
+PROTOCOL = 2
+TICK_RATE = 60
+MAX_PLAYERS = 16
+PLAYER_LIMIT = 64  # Players present are sent as a 64-bit mask
+INPUT_REDUNDANCY = 8  # Inputs repeated in every input packet
+MAX_BACKLOG = 8  # Inputs a client may get ahead of the server before old ones are skipped
+HISTORY = 64  # Snapshots kept as delta baselines
+TIMEOUT = 5.0  # Seconds of silence before a client is dropped
+HELLO_RETRY = 0.5
+
+_HELLO = struct.Struct('<cI')  # b'H', protocol
+_WELCOME = struct.Struct('<cBI')  # b'W', player id, tick; then the world as zlib'd JSON
+_INPUT = struct.Struct('<cIIB')  # b'I', newest snapshot tick received, first input sequence, count; then keys
+# b'S', tick, baseline tick, input ack, mask of coins and stars taken, winner, players present, player count
+_SNAPSHOT = struct.Struct('<cIIIIBQB')
+_PLAYER = struct.Struct('<BB')  # Player id, mask of the fields that follow
+_BYE = b'B'
+NO_WINNER = 255
+
+# Every field a client needs to restore a player into its own simulation
+FIELDS = (
+    ('position', struct.Struct('<3f')),
+    ('velocity_y', struct.Struct('<f')),
+    ('air_time', struct.Struct('<f')),
+    ('flags', struct.Struct('<B')),  # Jump state bits and the triple jump count
+    ('wall_jump', struct.Struct('<B')),  # Index into the wall jump directions, 4 for none
+    ('score', struct.Struct('<H')),
+)
+_FLAGS = ('jumping', 'wall_sliding', 'is_long_jumping', 'double_jump_available', 'wall_jump_available')
+_ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+
+def _castle(seed):
+    """The HackerSM64 edition's castle: coins, then the crown"""
+    return dict(tas.collect_castle(seed), rules=tas.PLAYER_RULES, stars=[], star_radius=0)
+
+
+def _courtyard(seed):
+    """cat'ssm64.py's courtyard from create_peach_castle_hub(), with its stars; it has no coins"""
+
+    def read_courtyard(app, game):
+        stars = game.stars
+        solids = [entity for entity in game.scene.entities if entity is not game.player and entity not in stars]
+        return {
+            'seed': seed,
+            'spawn': tuple(game.player.position),
+            'fall_limit': -10,
+            'improved_collision': game.HACKER_SM64_CONFIG['improved_collision'],
+            'rules': {},  # MarioPlayer's, mariosim's defaults
+            'coins': [], 'coin_radius': 0,
+            'stars': [tuple(star.world_position) for star in stars],
+            'star_radius': stars[0].world_scale_x / 2 if stars else 0,
+            'crown': None,
+            'colliders': mariosim.Colliders.from_entities(solids).to_lists(),
+        }
+
+    return run_game("cat'ssm64.py", read_courtyard, offscreen=True, argv=('--no-pacing',))
+
+
+WORLDS = {'castle': _castle, 'courtyard': _courtyard}
+
+
+def collect_world(name, seed=0):
+    """Build a world offscreen in a fresh process and return what the server needs"""
+    return in_new_process(WORLDS[name], seed)
+
+
+def make_colliders(world):
+    return mariosim.Colliders(world['colliders']['centers'], world['colliders']['sizes'])
+
+
+def make_sim(world, count):
+    return mariosim.MarioSim(make_colliders(world), count=count, start=world['spawn'],
+                             improved_collision=world['improved_collision'], **world['rules'])
+
+
+def step_players(sim, keys, world):
+    """One tick of movement for every row of sim, with the port's respawn, on server and clients alike"""
+    sim.step(keys, 1 / TICK_RATE)
+    fallen = sim.position[:, 1] < world['fall_limit']
+    sim.position[fallen] = world['spawn']
+    sim.velocity_y[fallen] = 0
+
+
+def encode_player(sim, row, score):
+    """A player's fields as bytes, one entry per FIELDS entry"""
+    flags = sum(1 << bit for bit, name in enumerate(_FLAGS) if getattr(sim, name)[row])
+    flags |= int(sim.triple_jump_count[row]) << len(_FLAGS)
+    matches = np.flatnonzero(np.all(mariosim.WALL_JUMP_DIRECTIONS == sim.wall_jump_direction[row], axis=1))
+    values = (tuple(sim.position[row].tolist()), (sim.velocity_y[row],), (sim.air_time[row],), (flags,),
+              (int(matches[0]) if len(matches) else 4,), (score,))
+    return [fmt.pack(*value) for (_, fmt), value in zip(FIELDS, values)]
+
+
+def restore_player(sim, row, fields):
+    """Put a player's decoded fields into one row of sim; returns the score"""
+    position, velocity_y, air_time, flags, wall_jump, score = (fmt.unpack(data) for (_, fmt), data
+                                                               in zip(FIELDS, fields))
+    sim.position[row] = position
+    sim.velocity_y[row] = velocity_y[0]
+    sim.air_time[row] = air_time[0]
+    for bit, name in enumerate(_FLAGS):
+        getattr(sim, name)[row] = bool(flags[0] >> bit & 1)
+    sim.triple_jump_count[row] = flags[0] >> len(_FLAGS)
+    sim.wall_jump_direction[row] = mariosim.WALL_JUMP_DIRECTIONS[wall_jump[0]] if wall_jump[0] < 4 else 0
+    return score[0]
+
+
+def _changed_fields(fields, old):
+    return _ALL_FIELDS if old is None else sum(1 << i for i, (a, b) in enumerate(zip(fields, old)) if a != b)
+
+
+def player_cost(fields, old):
+    """Bytes a player takes in a snapshot, delta encoded against old (None: sent whole)"""
+    mask = _changed_fields(fields, old)
+    return _PLAYER.size + sum(len(data) for i, data in enumerate(fields) if mask >> i & 1)
+
+
+def encode_snapshot(tick, baseline_tick, input_ack, collected, winner, present, players, baseline):
+    """players and baseline: {player id: field bytes}; fields equal to the baseline's are left out.
+    present is a mask of every player in the game, sent or not"""
+    parts = [_SNAPSHOT.pack(b'S', tick, baseline_tick, input_ack, collected, winner, present, len(players))]
+    for player_id, fields in players.items():
+        mask = _changed_fields(fields, baseline.get(player_id))
+        parts.append(_PLAYER.pack(player_id, mask))
+        parts.extend(data for i, data in enumerate(fields) if mask >> i & 1)
+    return b''.join(parts)
+
+
+def decode_snapshot(data, baselines):
+    """Returns (tick, baseline tick, input ack, collected, winner, present, {player id: field bytes}),
+    or None when the baseline it was encoded against isn't in baselines ({tick: players})"""
+    _, tick, baseline_tick, input_ack, collected, winner, present, count = _SNAPSHOT.unpack_from(data)
+    baseline = baselines.get(baseline_tick, {}) if baseline_tick else {}
+    if baseline_tick and baseline_tick not in baselines:
+        return None
+    offset = _SNAPSHOT.size
+    players = {}
+    for _ in range(count):
+        player_id, mask = _PLAYER.unpack_from(data, offset)
+        offset += _PLAYER.size
+        old = baseline.get(player_id)
+        if old is None and mask != _ALL_FIELDS:
+            return None
+        fields = []
+        for i, (_, fmt) in enumerate(FIELDS):
+            if mask >> i & 1:
+                fields.append(data[offset:offset + fmt.size])
+                offset += fmt.size
+            else:
+                fields.append(old[i])
+        players[player_id] = fields
+    return tick, baseline_tick, input_ack, collected, winner, present, players
+
+
+class SimulatedNetwork:
+    """Delays and drops outgoing datagrams, to try the game over a bad connection on one machine"""
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.latency = latency  # One way, in seconds
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+
+    def sendto(self, transport, data, address=None):
+        if self.loss and self.rng.random() < self.loss:
+            return
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter) if self.latency else 0
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, _send_if_open, transport, data, address)
+        else:
+            transport.sendto(data, address)
+
+
+def _send_if_open(transport, data, address):
+    if not transport.is_closing():
+        transport.sendto(data, address)
+
+
+class _Client:
+    def __init__(self, address, player_id):
+        self.address = address
+        self.player_id = player_id
+        self.inputs = {}  # Sequence -> keys, not yet simulated
+        self.processed = None  # Sequence of the last input simulated
+        self.keys = 0
+        self.acked = 0  # Newest snapshot tick the client has received
+        self.sent = {}  # Tick -> {player id: field bytes} sent in that snapshot, kept as baselines
+        self.confirmed = {}  # Player id -> (tick, field bytes) the client is known to have
+        self.last_sent = {}  # Player id -> tick last sent
+        self.heard = perf_counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class GameServer(asyncio.DatagramProtocol):
+    def __init__(self, world, tick_rate=TICK_RATE, network=None, max_players=MAX_PLAYERS, interest=None):
+        if max_players > PLAYER_LIMIT:
+            raise ValueError(f'at most {PLAYER_LIMIT} players')
+        self.world = world
+        self.tick_rate = tick_rate
+        self.network = network or SimulatedNetwork()
+        self.max_players = max_players
+        self.interest = interest  # An InterestManager, or None to send every player that changed
+        self.sim = make_sim(world, max_players)
+        # Coins then stars, one bit each in the collected mask
+        self.collectibles = np.array(list(world['coins']) + list(world['stars']), dtype=np.float64).reshape(-1, 3)
+        self.radii = np.array([world['coin_radius']] * len(world['coins']) + [world['star_radius']] * len(world['stars']))
+        self.collected = 0
+        self.scores = [0] * max_players
+        self.winner = NO_WINNER
+        self.crown = None
+        if world['crown']:
+            crown_center, crown_scale = (np.array(value) for value in world['crown'])
+            self.crown = (crown_center, np.abs(crown_scale) / 2 + np.array(tas.PLAYER_HALF_SIZE))
+        self.clients = {}  # Address -> _Client
+        self.tick = 0
+        self.tick_ms = []
+        self.started = None
+        self.welcome = zlib.compress(json.dumps(world).encode(), 9)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _send(self, data, address):
+        self.network.sendto(self.transport, data, address)
+
+    def datagram_received(self, data, address):
+        kind = data[:1]
+        client = self.clients.get(address)
+        if client:
+            client.heard = perf_counter()
+            client.bytes_in += len(data)
+        if kind == b'H':
+            if _HELLO.unpack_from(data)[1] != PROTOCOL:
+                return
+            if client is None:
+                taken = {client.player_id for client in self.clients.values()}
+                free = [player_id for player_id in range(self.max_players) if player_id not in taken]
+                if not free:
+                    return
+                client = self.clients[address] = _Client(address, free[0])
+                self._join(client.player_id)
+            # Sent again for every hello, in case the first welcome was lost
+            self._send(_WELCOME.pack(b'W', client.player_id, self.tick) + self.welcome, address)
+        elif kind == b'I' and client:
+            _, acked, first, count = _INPUT.unpack_from(data)
+            if acked > client.acked:
+                client.acked = acked
+                for player_id, fields in client.sent.get(acked, {}).items():
+                    client.confirmed[player_id] = (acked, fields)
+            for i, keys in enumerate(data[_INPUT.size:_INPUT.size + count]):
+                sequence = first + i
+                if client.processed is None or sequence > client.processed:
+                    client.inputs[sequence] = keys
+        elif kind == _BYE and client:
+            self._leave(client)
+
+    def _join(self, player_id):
+        fresh = make_sim(self.world, 1).state()
+        for name, values in fresh.items():
+            getattr(self.sim, name)[player_id] = values[0]
+        self.scores[player_id] = 0
+
+    def _leave(self, client):
+        del self.clients[client.address]
+        # Whoever gets this player id next is someone else
+        for other in self.clients.values():
+            other.confirmed.pop(client.player_id, None)
+            other.last_sent.pop(client.player_id, None)
+        if self.interest:
+            self.interest.forget(viewer=client.player_id, key=client.player_id)
+
+    def _next_keys(self, client):
+        """The keys to simulate for a client this tick, or None to hold it until its input arrives"""
+        if not client.inputs:
+            return None
+        newest = max(client.inputs)
+        if client.processed is None:
+            client.processed = min(client.inputs) - 1
+        if newest - client.processed > MAX_BACKLOG:
+            # Too far behind the client: skip ahead, and let its prediction be corrected
+            client.processed = newest - MAX_BACKLOG
+        sequence = client.processed + 1
+        if sequence in client.inputs:
+            client.keys = client.inputs[sequence]
+        # Otherwise the input was lost despite the repeats; guess it was the same as the last one
+        client.processed = sequence
+        for old in [old for old in client.inputs if old <= sequence]:
+            del client.inputs[old]
+        return client.keys
+
+    def step(self):
+        began = perf_counter()
+        self.tick += 1
+        now = perf_counter()
+        for client in [client for client in self.clients.values() if now - client.heard > TIMEOUT]:
+            self._leave(client)
+
+        keys = np.zeros(self.max_players, dtype=np.uint8)
+        moving = np.zeros(self.max_players, dtype=bool)
+        for client in self.clients.values():
+            client_keys = self._next_keys(client)
+            if client_keys is not None:
+                keys[client.player_id] = client_keys
+                moving[client.player_id] = True
+        # Everyone is stepped at once; players still waiting for input are put back where they were
+        held = self.sim.state()
+        step_players(self.sim, keys, self.world)
+        for name in self.sim.STATE:
+            getattr(self.sim, name)[~moving] = held[name][~moving]
+        self._collect(moving)
+
+        players = {client.player_id: encode_player(self.sim, client.player_id, self.scores[client.player_id])
+                   for client in self.clients.values()}
+        present = sum(1 << player_id for player_id in players)
+        for client in self.clients.values():
+            self._send_snapshot(client, players, present)
+        self.tick_ms.append((perf_counter() - began) * 1000)
+
+    def _collect(self, moving):
+        everything = (1 << len(self.collectibles)) - 1
+        if len(self.collectibles) and moving.any():
+            touching = tas.touching_coins(self.sim.position.astype(np.float64), self.collectibles, self.radii)
+            for player_id, item in zip(*np.nonzero(touching & moving[:, None])):
+                if not self.collected >> item & 1:
+                    self.collected |= 1 << int(item)
+                    self.scores[player_id] += 1
+                    if self.crown is None and self.collected == everything:
+                        self.winner = int(player_id)
+        if self.crown and self.winner == NO_WINNER and self.collected == everything:
+            center, reach = self.crown
+            on_crown = np.all(np.abs(self.sim.position - center) < reach, axis=1) & moving
+            if on_crown.any():
+                self.winner = int(np.flatnonzero(on_crown)[0])
+
+    def _send_snapshot(self, client, players, present):
+        own = client.player_id
+        baseline_tick = client.acked if client.acked in client.sent else 0
+        baseline = client.sent.get(baseline_tick, {})
+        # Players the client may not have as they are now: changed since they were last sent,
+        # or last sent in a snapshot that never arrived (a newer one was acknowledged instead)
+        candidates = []
+        for player_id, fields in players.items():
+            last = client.last_sent.get(player_id)
+            if player_id == own:
+                continue
+            if last is None or fields != client.sent.get(last, {}).get(player_id):
+                candidates.append(player_id)
+            elif client.acked >= last and client.confirmed.get(player_id, (-1,))[0] < last:
+                candidates.append(player_id)
+
+        if self.interest is None:
+            chosen = candidates
+        else:
+            # The client's own player always goes first: its prediction is checked against it
+            room = self.interest.budget - _SNAPSHOT.size - player_cost(players[own], baseline.get(own))
+            chosen = self.interest.select(
+                own, self.sim.position[own], [(player_id, 'player', self.sim.position[player_id])
+                                              for player_id in candidates],
+                lambda player_id: player_cost(players[player_id], baseline.get(player_id)), budget=room)
+        sent = {player_id: players[player_id] for player_id in [own] + chosen}
+        client.sent[self.tick] = sent
+        client.sent.pop(self.tick - HISTORY, None)
+        for player_id in sent:
+            client.last_sent[player_id] = self.tick
+
+        data = encode_snapshot(self.tick, baseline_tick, client.processed or 0, self.collected, self.winner,
+                               present, sent, baseline)
+        client.bytes_out += len(data)
+        self._send(data, client.address)
+
+    async def serve(self, seconds=None):
+        """Tick at tick_rate until cancelled or for a number of seconds"""
+        interval = 1 / self.tick_rate
+        self.started = next_tick = perf_counter()
+        while seconds is None or perf_counter() - self.started < seconds:
+            self.step()
+            next_tick += interval
+            delay = next_tick - perf_counter()
+            if delay < -interval * 5:
+                next_tick = perf_counter()  # Far behind: stop trying to catch up
+            await asyncio.sleep(max(delay, 0))
+
+
+class BotClient(asyncio.DatagramProtocol):
+    """A client playing scripted input, predicting its own Mario and reconciling with the server"""
+
+    def __init__(self, script, network=None, tick_rate=TICK_RATE):
+        self.script = script  # Keys bitmask for every tick, repeated
+        self.network = network or SimulatedNetwork()
+        self.tick_rate = tick_rate
+        self.transport = None
+        self.welcomed = asyncio.Event()
+        self.player_id = None
+        self.world = None
+        self.sim = None
+        self.sequence = 0
+        self.inputs = {}  # Sequence -> keys, until the server has simulated it
+        self.predicted = {}  # Sequence -> predicted state after that input
+        self.acked_input = 0
+        self.snapshots = {}  # Tick -> {player id: field bytes} in that snapshot, kept as delta baselines
+        self.newest_tick = 0
+        self.known = {}  # Player id -> newest field bytes received
+        self.collected = 0
+        self.winner = NO_WINNER
+        self.corrections = []  # How far the predicted position moved at each correction
+        self.errors = []  # Distance from predicted to server position at every acknowledged input
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.snapshots_received = 0
+        self.players_received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _send(self, data):
+        self.bytes_out += len(data)
+        self.network.sendto(self.transport, data)
+
+    def datagram_received(self, data, address):
+        self.bytes_in += len(data)
+        kind = data[:1]
+        if kind == b'W' and self.world is None:
+            _, self.player_id, _ = _WELCOME.unpack_from(data)
+            self.world = json.loads(zlib.decompress(data[_WELCOME.size:]))
+            self.sim = make_sim(self.world, 1)
+            self.welcomed.set()
+        elif kind == b'S' and self.sim is not None:
+            decoded = decode_snapshot(data, self.snapshots)
+            if decoded is None or decoded[0] <= self.newest_tick:
+                return  # Late, or its baseline is gone: the next one will do
+            tick, _, input_ack, self.collected, self.winner, present, players = decoded
+            self.snapshots_received += 1
+            self.players_received += len(players)
+            self.newest_tick = tick
+            self.snapshots[tick] = players
+            self.snapshots.pop(tick - HISTORY, None)
+            self.known.update(players)
+            for player_id in [player_id for player_id in self.known if not present >> player_id & 1]:
+                del self.known[player_id]
+            if self.player_id in players and input_ack > self.acked_input:
+                self._reconcile(input_ack, players[self.player_id])
+
+    @property
+    def others(self):
+        """Player id -> position of every other player, as last received"""
+        return {player_id: FIELDS[0][1].unpack(fields[0]) for player_id, fields in self.known.items()
+                if player_id != self.player_id}
+
+    def _reconcile(self, input_ack, fields):
+        self.acked_input = input_ack
+        server = make_sim(self.world, 1)
+        restore_player(server, 0, fields)
+        predicted = self.predicted.get(input_ack)
+        for old in [old for old in self.inputs if old <= input_ack]:
+            del self.inputs[old]
+            self.predicted.pop(old, None)
+        if predicted is not None:
+            self.errors.append(float(np.linalg.norm(predicted['position'][0] - server.position[0])))
+            if self._same(predicted, server):
+                return  # The prediction was right, so everything predicted since still holds
+        # Take the server's state and replay the inputs it hasn't seen yet
+        before = self.sim.position[0].copy()
+        self.sim.restore(server.state())
+        for sequence in sorted(self.inputs):
+            step_players(self.sim, self.inputs[sequence], self.world)
+            self.predicted[sequence] = self.sim.state()
+        self.corrections.append(float(np.linalg.norm(self.sim.position[0] - before)))
+
+    @staticmethod
+    def _same(predicted, server):
+        # Snapshots carry single precision, so compare with a little slack
+        return (np.allclose(predicted['position'], server.position, atol=1e-4) and
+                np.allclose(predicted['velocity_y'], server.velocity_y, atol=1e-4) and
+                np.allclose(predicted['air_time'], server.air_time, atol=1e-4) and
+                all((predicted[name] == getattr(server, name)).all() for name in _FLAGS))
+
+    def hello(self):
+        self._send(_HELLO.pack(b'H', PROTOCOL))
+
+    def tick(self):
+        """Take this tick's input: predict it and send it, with the ones before it the server may not have"""
+        self.sequence += 1
+        keys = self.script[self.sequence % len(self.script)]
+        self.inputs[self.sequence] = keys
+        step_players(self.sim, keys, self.world)
+        self.predicted[self.sequence] = self.sim.state()
+        first = max(self.sequence - INPUT_REDUNDANCY + 1, self.acked_input + 1, 1)
+        sent = bytes(self.inputs[sequence] for sequence in range(first, self.sequence + 1))
+        self._send(_INPUT.pack(b'I', self.newest_tick, first, len(sent)) + sent)
+
+    async def play(self, seconds):
+        began = perf_counter()
+        while not self.welcomed.is_set():
+            if perf_counter() - began > TIMEOUT:
+                raise ConnectionError('no answer from the server')
+            self.hello()
+            try:
+                await asyncio.wait_for(self.welcomed.wait(), HELLO_RETRY)
+            except asyncio.TimeoutError:
+                pass
+
+        interval = 1 / self.tick_rate
+        began = next_tick = perf_counter()
+        while perf_counter() - began < seconds:
+            self.tick()
+            next_tick += interval
+            await asyncio.sleep(max(next_tick - perf_counter(), 0))
+        self._send(_BYE)
+
+
+def bot_script(offset=0):
+    """benchmark.py's scripted input as one keys bitmask per tick, started offset ticks in"""
+    from benchmark import INPUT_CYCLE
+    script = []
+    for length, keys, _ in INPUT_CYCLE:
+        script.extend([mariosim.keys_from_held(keys)] * length)
+    return script[offset % len(script):] + script[:offset % len(script)]
+
+
+async def run_server(world, host, port, network, interest=None, report_every=5.0):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(
+        lambda: GameServer(world, network=network, interest=interest), local_addr=(host, port))
+    print(f'Serving on {host}:{transport.get_extra_info("sockname")[1]}', file=sys.stderr)
+    ticker = asyncio.create_task(server.serve())
+    try:
+        while True:
+            await asyncio.sleep(report_every)
+            recent = server.tick_ms[-int(report_every * TICK_RATE):]
+            print(f'tick {server.tick}: {len(server.clients)} players, '
+                  f'{sum(recent) / max(len(recent), 1):.2f} ms a tick', file=sys.stderr)
+    finally:
+        ticker.cancel()
+        transport.close()
+
+
+async def run_bot(host, port, seconds, network, offset=0):
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(lambda: BotClient(bot_script(offset), network),
+                                                            remote_addr=(host, port))
+    try:
+        await client.play(seconds)
+    finally:
+        transport.close()
+    return client
+
+
+async def run_local(world, players, seconds, network_settings, interest=None, seed=0):
+    """A server and bot clients in this process over localhost; returns a report"""
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(
+        lambda: GameServer(world, network=SimulatedNetwork(*network_settings, seed=seed), max_players=players,
+                           interest=interest),
+        local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+    ticker = asyncio.create_task(server.serve())
+    try:
+        clients = await asyncio.gather(*(
+            run_bot('127.0.0.1', port, seconds, SimulatedNetwork(*network_settings, seed=seed + 1 + i), offset=i * 37)
+            for i in range(players)))
+    finally:
+        ticker.cancel()
+        transport.close()
+
+    ticks = sorted(server.tick_ms)
+    return {
+        'players': players,
+        'seconds': seconds,
+        'interest': interest is not None,
+        'latency_ms': network_settings[0] * 1000, 'jitter_ms': network_settings[1] * 1000,
+        'loss': network_settings[2],
+        'ticks': server.tick,
+        'tick_rate': server.tick / (perf_counter() - server.started),
+        'tick_ms': {'mean': sum(ticks) / len(ticks), 'p99': ticks[int(len(ticks) * 0.99)], 'max': ticks[-1]},
+        'down_bytes_per_second': sum(client.bytes_in for client in clients) / players / seconds,
+        'up_bytes_per_second': sum(client.bytes_out for client in clients) / players / seconds,
+        'snapshots_per_second': sum(client.snapshots_received for client in clients) / players / seconds,
+        'corrections': sum(len(client.corrections) for client in clients),
+        'mean_correction': float(np.mean([c for client in clients for c in client.corrections] or [0])),
+        'max_prediction_error': max((error for client in clients for error in client.errors), default=0),
+        'collected': bin(server.collected).count('1'),
+    }
+
+
+class _Wire:
+    """Stands in for a socket: hands datagrams straight to the other side"""
+
+    def __init__(self, receive, address=None):
+        self.receive = receive
+        self.address = address  # Where the other side sees these datagrams come from
+
+    def sendto(self, data, address=None):
+        self.receive(data, address if self.address is None else self.address)
+
+    def is_closing(self):
+        return False
+
+
+def run_fake_clients(world, players, ticks, interest=None, seed=0, near=10.0):
+    """The server and bot clients calling each other directly, with no network and no waiting.
+    Returns snapshot bytes per tick and how far behind the clients' view of other players was,
+    for players nearer than near and farther"""
+    server = GameServer(world, max_players=players, interest=interest)
+    clients = [BotClient(bot_script(i * 37)) for i in range(players)]
+    server.connection_made(_Wire(lambda data, index: clients[index].datagram_received(data, None)))
+    for index, client in enumerate(clients):
+        client.connection_made(_Wire(server.datagram_received, address=index))
+        client.hello()
+
+    # Spread everyone around the spawn so some are near each other and some aren't
+    rng = np.random.default_rng(seed)
+    spawn = np.array(world['spawn'], dtype=np.float32)
+    for client in clients:
+        server.sim.position[client.player_id] = spawn + rng.uniform(-9, 9, 3).astype(np.float32) * (1, 0, 1)
+
+    near_errors, far_errors = [], []
+    for _ in range(ticks):
+        for client in clients:
+            client.tick()
+        server.step()
+        positions = server.sim.position
+        for client in clients:
+            eye = positions[client.player_id]
+            for player_id, position in client.others.items():
+                error = float(np.linalg.norm(positions[player_id] - position))
+                distance = float(np.linalg.norm(positions[player_id] - eye))
+                (near_errors if distance < near else far_errors).append(error)
+
+    sent = sum(client.bytes_out for client in server.clients.values())
+    return {
+        'ticks': ticks,
+        'bytes_per_tick': sent / players / ticks,
+        'server_bytes_per_tick': sent / ticks,
+        'players_per_snapshot': sum(client.players_received for client in clients) /
+                                max(sum(client.snapshots_received for client in clients), 1),
+        'near_error': float(np.mean(near_errors)) if near_errors else 0.0,
+        'far_error': float(np.mean(far_errors)) if far_errors else 0.0,
+        'tick_ms': float(np.mean(server.tick_ms)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multiplayer in the HackerSM64 castle or the cat\'ssm64 courtyard')
+    parser.add_argument('mode', choices=('server', 'client', 'local'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--world', choices=tuple(WORLDS), default='castle', help='world to serve (server, local)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the coin layout (server)')
+    parser.add_argument('--players', type=int, default=MAX_PLAYERS, help='bot clients (local)')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=0, help='simulated one-way latency in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='simulated latency jitter in ms')
+    parser.add_argument('--loss', type=float, default=0, help='simulated packet loss, 0 to 1')
+    parser.add_argument('--no-interest', action='store_true', help='send every player that changed to everyone')
+    parser.add_argument('--budget', type=int, default=None, help='snapshot bytes per client per tick')
+    args = parser.parse_args()
+    network_settings = (args.latency / 1000, args.jitter / 1000, args.loss)
+
+    if args.mode == 'client':
+        client = asyncio.run(run_bot(args.host, args.port, args.seconds, SimulatedNetwork(*network_settings)))
+        print(f'player {client.player_id}: {client.snapshots_received} snapshots, '
+              f'{len(client.corrections)} corrections, {client.bytes_in / args.seconds:.0f} B/s down')
+        return 0
+
+    world = collect_world(args.world, args.seed)
+    interest = None
+    if not args.no_interest:
+        interest = InterestManager(make_colliders(world))
+        if args.budget:
+            interest.budget = args.budget
+    if args.mode == 'server':
+        try:
+            asyncio.run(run_server(world, args.host, args.port, SimulatedNetwork(*network_settings), interest))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.players > PLAYER_LIMIT:
+        parser.error(f'at most {PLAYER_LIMIT} players')
+    report = asyncio.run(run_local(world, args.players, args.seconds, network_settings, interest, args.seed))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# ULTRA MARIO 3D BROS - Placement Engine
+# Props are placed in bulk with NumPy: candidate boxes are drawn a batch at a
+# time and rejected if they overlap (or sit closer than a minimum spacing to)
+# anything already placed, using a uniform grid on the x/z plane so each test
+# only looks at nearby boxes. An optional reach constraint only keeps boxes the
+# player can get onto from the floor or from a box that is already placed.
+import numpy as np
+
+_KEY_STRIDE = 1 << 21  # Packs an (x, z) cell into one int64 key
+
+
+def _cell_pairs(lo, hi, cell_size):
+    """Every (box index, cell key) pair for the grid cells each x/z rectangle covers"""
+    first = np.floor(lo / cell_size).astype(np.int64)
+    last = np.floor(hi / cell_size).astype(np.int64)
+    span = last - first + 1
+    counts = span[:, 0] * span[:, 1]
+    owner = np.repeat(np.arange(len(lo)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cell_x = first[owner, 0] + local // span[owner, 1]
+    cell_z = first[owner, 1] + local % span[owner, 1]
+    return owner, cell_x * _KEY_STRIDE + cell_z
+
+
+def _separated(centers_a, half_a, centers_b, half_b, spacing):
+    """True where box a and box b are at least spacing apart on some axis"""
+    return (np.abs(centers_a - centers_b) >= half_a + half_b + spacing).any(axis=1)
+
+
+class Placer:
+    def __init__(self, cell_size=8.0, floor_y=0.0):
+        self.cell_size = cell_size
+        self.floor_y = floor_y
+        self.centers = np.empty((0, 3))
+        self.half = np.empty((0, 3))
+        self.standable = np.empty(0, dtype=bool)
+        self._grid_keys = np.empty(0, dtype=np.int64)
+        self._grid_owner = np.empty(0, dtype=np.int64)
+
+    def add(self, centers, sizes, standable=False):
+        """Mark boxes as occupied (level geometry, stars, spawn points...)"""
+        centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        half = np.broadcast_to(np.asarray(sizes, dtype=float) / 2, centers.shape)
+        start = len(self.centers)
+        self.centers = np.concatenate([self.centers, centers])
+        self.half = np.concatenate([self.half, half])
+        self.standable = np.concatenate([self.standable, np.full(len(centers), standable)])
+
+        owner, keys = _cell_pairs(centers[:, [0, 2]] - half[:, [0, 2]],
+                                  centers[:, [0, 2]] + half[:, [0, 2]], self.cell_size)
+        keys = np.concatenate([self._grid_keys, keys])
+        owner = np.concatenate([self._grid_owner, owner + start])
+        order = np.argsort(keys, kind='stable')
+        self._grid_keys = keys[order]
+        self._grid_owner = owner[order]
+
+    def _neighbour_pairs(self, centers, half, margin):
+        """(query index, placed index) pairs whose x/z rectangles share a grid cell"""
+        lo = centers[:, [0, 2]] - half[:, [0, 2]] - margin
+        hi = centers[:, [0, 2]] + half[:, [0, 2]] + margin
+        query, keys = _cell_pairs(lo, hi, self.cell_size)
+        left = np.searchsorted(self._grid_keys, keys, side='left')
+        right = np.searchsorted(self._grid_keys, keys, side='right')
+        counts = right - left
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        placed = self._grid_owner[np.repeat(left, counts) + local]
+        return np.repeat(query, counts), placed
+
+    def _batch_pairs(self, centers, half, margin):
+        """(earlier, later) candidate index pairs within a batch that share a grid cell"""
+        owner, keys = _cell_pairs(centers[:, [0, 2]] - half[:, [0, 2]] - margin,
+                                  centers[:, [0, 2]] + half[:, [0, 2]] + margin, self.cell_size)
+        order = np.lexsort((owner, keys))
+        owner, keys = owner[order], keys[order]
+        group_end = np.searchsorted(keys, keys, side='right')
+        counts = group_end - np.arange(len(keys)) - 1
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        first = np.repeat(np.arange(len(keys)), counts)
+        return owner[first], owner[first + 1 + local]
+
+    def _blocked(self, centers, half, spacing):
+        blocked = np.zeros(len(centers), dtype=bool)
+        query, placed = self._neighbour_pairs(centers, half, spacing)
+        hit = ~_separated(centers[query], half[query], self.centers[placed], self.half[placed], spacing)
+        blocked[query[hit]] = True
+        return blocked
+
+    def _reachable(self, centers, half, max_rise, max_gap):
+        tops = centers[:, 1] + half[:, 1]
+        reachable = tops <= self.floor_y + max_rise
+        query, placed = self._neighbour_pairs(centers, half, max_gap)
+        keep = self.standable[placed]
+        query, placed = query[keep], placed[keep]
+        gap = np.maximum(np.abs(centers[query][:, [0, 2]] - self.centers[placed][:, [0, 2]])
+                         - half[query][:, [0, 2]] - self.half[placed][:, [0, 2]], 0)
+        rise = tops[query] - (self.centers[placed, 1] + self.half[placed, 1])
+        ok = (np.hypot(gap[:, 0], gap[:, 1]) <= max_gap) & (rise <= max_rise)
+        reachable[query[ok]] = True
+        return reachable
+
+    def place(self, rng, count, low, high, size_low, size_high=None, spacing=0.0,
+              reach=None, standable=True, batch_size=None, max_batches=64):
+        """Place up to count boxes that overlap nothing already placed.
+
+        low/high bound the box centres and size_low/size_high the full box sizes,
+        per axis; scalar sizes give cubes (for spheres). reach is an optional (max_rise, max_gap) pair: a box is only kept
+        if its top is within max_rise of the floor, or within max_rise above and
+        max_gap across from a standable box that is already placed.
+        Returns (centers, sizes) of the accepted boxes in placement order.
+        """
+        low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+        size_low = np.asarray(size_low, dtype=float)
+        size_high = size_low if size_high is None else np.asarray(size_high, dtype=float)
+        cubic = size_low.ndim == 0
+        start = len(self.centers)
+
+        for _ in range(max_batches):
+            missing = count - (len(self.centers) - start)
+            if missing <= 0:
+                break
+            batch = batch_size or min(max(2 * missing, 64), 4096)
+            centers = rng.uniform(low, high, size=(batch, 3))
+            if cubic:
+                half = np.repeat(rng.uniform(size_low, size_high, size=(batch, 1)) / 2, 3, axis=1)
+            else:
+                half = rng.uniform(size_low, size_high, size=(batch, 3)) / 2
+
+            ok = ~self._blocked(centers, half, spacing)
+            if reach is not None:
+                ok &= self._reachable(centers, half, *reach)
+
+            # Within the batch, a candidate loses to any earlier candidate it overlaps
+            index = np.flatnonzero(ok)
+            earlier, later = self._batch_pairs(centers[index], half[index], spacing)
+            hit = ~_separated(centers[index[earlier]], half[index[earlier]],
+                              centers[index[later]], half[index[later]], spacing)
+            ok[index[later[hit]]] = False
+            index = np.flatnonzero(ok)[:missing]
+
+            if len(index):
+                self.add(centers[index], half[index] * 2, standable)
+
+        return self.centers[start:].copy(), self.half[start:] * 2
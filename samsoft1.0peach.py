@@ -4,6 +4,12 @@ from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
 import random
 import math
+import threading
+import levelgen
+from memorybudget import MemoryBudget
+from stacksampler import StackSampler
+from eventtrace import EventTrace
+from framepacer import FramePacer
 
 app = Ursina()
 window.title = "ULTRA MARIO 3D BROS - Space World Tech Demo"
@@ -28,6 +34,10 @@ camera_mode = "follow"
 in_space = False
 current_section = "castle"  # castle, space_transition, space_world
 
+# Layout seeds - the same seed always builds the same space world and decorations
+SPACE_SEED = 64
+DECORATION_SEED = 1
+
 # HackerSM64 Configuration
 HACKER_SM64_CONFIG = {
     "extended_bounds": True,
@@ -43,6 +53,12 @@ space_objects = []
 black_holes = []
 warp_zones = []
 gravitational_fields = []
+space_skybox = None
+
+# Space world loading
+SPACE_PREFETCH_DISTANCE = 15   # Start building the space world when the player is this close to the portal
+SPACE_BUILD_BUDGET = 0.002     # Seconds per frame spent creating space entities while prefetching
+RELEASE_SPACE_ON_EXIT = False  # Destroy the space world after exit_space() to free its memory
 
 # Create main menu with Space World theme
 def create_main_menu():
@@ -179,102 +195,183 @@ def create_space_world():
                          color=color.rgb(200, 150, 150), collider='box')
         platforms.append(platform)
     
-    # Create space environment outside the castle
-    create_space_environment()
+    # The space environment outside the castle is built lazily by space_loader
     
     return ground, platforms, space_portal
 
-def create_space_environment():
+def create_space_environment(layout, built):
+    """Create the space world one entity per step, hidden until the player enters space"""
     # Space skybox
     global space_skybox
     space_skybox = Entity(model='sphere', double_sided=True, scale=500, texture='sky_default')
     space_skybox.enabled = False
+    built.append(space_skybox)
+    yield
     
     # Space platforms
-    for i in range(20):
+    platforms = layout['platforms']
+    for scale, pos, rgb in zip(platforms['scale'].tolist(), platforms['position'].tolist(), platforms['color'].tolist()):
         platform = Entity(
             model='cube', 
-            scale=(random.uniform(3, 8), 0.5, random.uniform(3, 8)),
-            position=(
-                random.uniform(-100, 100),
-                random.uniform(5, 50),
-                random.uniform(-100, 100)
-            ),
-            color=color.rgb(
-                random.randint(100, 200),
-                random.randint(100, 200),
-                random.randint(100, 200)
-            ),
-            collider='box'
+            scale=scale,
+            position=pos,
+            color=color.rgb(*rgb),
+            collider='box',
+            enabled=False
         )
         space_objects.append(platform)
+        built.append(platform)
+        yield
     
     # Floating asteroids
-    for i in range(30):
+    asteroids = layout['asteroids']
+    for scale, pos, rgb in zip(asteroids['scale'].tolist(), asteroids['position'].tolist(), asteroids['color'].tolist()):
         asteroid = Entity(
             model='sphere',
-            scale=random.uniform(1, 5),
-            position=(
-                random.uniform(-150, 150),
-                random.uniform(10, 80),
-                random.uniform(-150, 150)
-            ),
-            color=color.rgb(
-                random.randint(50, 150),
-                random.randint(50, 150),
-                random.randint(50, 150)
-            ),
-            collider='sphere'
+            scale=scale,
+            position=pos,
+            color=color.rgb(*rgb),
+            collider='sphere',
+            enabled=False
         )
         space_objects.append(asteroid)
+        built.append(asteroid)
+        yield
     
     # Black holes (hazard)
-    for i in range(3):
+    holes = layout['black_holes']
+    for scale, pos in zip(holes['scale'].tolist(), holes['position'].tolist()):
         black_hole = Entity(
             model='sphere',
-            scale=random.uniform(3, 8),
-            position=(
-                random.uniform(-120, 120),
-                random.uniform(20, 60),
-                random.uniform(-120, 120)
-            ),
+            scale=scale,
+            position=pos,
             color=color.black,
-            collider='sphere'
+            collider='sphere',
+            enabled=False
         )
         black_holes.append(black_hole)
         space_objects.append(black_hole)
+        built.append(black_hole)
+        yield
     
     # Warp zones
-    for i in range(2):
+    for pos in layout['warp_zones']['position'].tolist():
         warp_zone = Entity(
             model='cylinder',
             scale=(5, 0.2, 5),
-            position=(
-                random.uniform(-100, 100),
-                random.uniform(10, 40),
-                random.uniform(-100, 100)
-            ),
+            position=pos,
             color=color.magenta,
-            collider='mesh'
+            collider='mesh',
+            enabled=False
         )
         warp_zones.append(warp_zone)
         space_objects.append(warp_zone)
+        built.append(warp_zone)
+        yield
     
     # Gravitational fields (visual effect only)
-    for i in range(5):
+    fields = layout['gravitational_fields']
+    for scale, pos in zip(fields['scale'].tolist(), fields['position'].tolist()):
         field = Entity(
             model='sphere',
-            scale=random.uniform(10, 20),
-            position=(
-                random.uniform(-130, 130),
-                random.uniform(30, 70),
-                random.uniform(-130, 130)
-            ),
+            scale=scale,
+            position=pos,
             color=color.rgba(0, 100, 200, 50),
-            alpha=0.2
+            alpha=0.2,
+            enabled=False
         )
         gravitational_fields.append(field)
         space_objects.append(field)
+        built.append(field)
+        yield
+
+# Builds the space world on demand: the layout loads on a background thread once the
+# player gets near the portal, then entities are created a few per frame so entering
+# space doesn't hitch. Optionally released again after exit_space().
+class SpaceWorldLoader:
+    def __init__(self):
+        self.layout = None
+        self.layout_thread = None
+        self.build_steps = None
+        self.entities = []
+        self.ready = False
+    
+    def load_layout(self):
+        self.layout = levelgen.generate('space', SPACE_SEED)
+    
+    def prefetch(self):
+        """Start loading the space world in the background"""
+        if self.ready or self.layout_thread:
+            return
+        self.layout_thread = threading.Thread(target=self.load_layout, daemon=True)
+        self.layout_thread.start()
+    
+    def update(self):
+        """Spend up to SPACE_BUILD_BUDGET seconds creating space entities"""
+        if self.ready or self.layout is None:
+            return
+        if self.build_steps is None:
+            self.start_build()
+        
+        deadline = time.perf_counter() + SPACE_BUILD_BUDGET
+        with memory_budget.slice('space'):
+            for _ in self.build_steps:
+                if time.perf_counter() >= deadline:
+                    return
+        self.finish_build()
+    
+    def build_now(self):
+        """Finish building immediately (the player reached the portal before prefetching finished)"""
+        if self.ready:
+            return
+        if self.layout_thread:
+            self.layout_thread.join()
+        if self.layout is None:
+            self.load_layout()
+        if self.build_steps is None:
+            self.start_build()
+        with memory_budget.slice('space'):
+            for _ in self.build_steps:
+                pass
+        self.finish_build()
+    
+    def start_build(self):
+        tracer.begin('build space world')
+        memory_budget.begin('space', sliced=True)
+        self.build_steps = create_space_environment(self.layout, self.entities)
+    
+    def finish_build(self):
+        self.ready = True
+        memory_budget.end('space', self.entities)
+        tracer.end('build space world', entities=len(self.entities))
+    
+    def release(self):
+        """Destroy the space world; it is rebuilt the next time the player heads for the portal"""
+        global space_skybox
+        released = {id(entity) for entity in self.entities}
+        space_objects[:] = [obj for obj in space_objects if id(obj) not in released]
+        black_holes.clear()
+        warp_zones.clear()
+        gravitational_fields.clear()
+        for entity in self.entities:
+            destroy(entity)
+        
+        space_skybox = None
+        self.entities = []
+        self.build_steps = None
+        self.layout_thread = None
+        self.ready = False
+
+# What building the space world costs; F4 shows it
+memory_budget = MemoryBudget()
+# F5 samples the main thread for a few seconds, for frame drops that only show up in play
+sampler = StackSampler()
+# Gameplay events on a timeline with the frames (--trace or F6)
+tracer = EventTrace()
+# Lowers the render resolution when frames run long (F7 shows it). The space skybox
+# sits 250 units out, so the draw distance is left alone
+pacer = FramePacer(draw_distances=())
+space_loader = SpaceWorldLoader()
 
 # Enhanced Player class with space mechanics
 class Player(Entity):
@@ -329,6 +426,11 @@ class Player(Entity):
     
     def check_space_transition(self):
         global in_space, current_section
+        # Prefetch the space world once the player gets close to the portal
+        if not self.is_in_space and distance(self.position, space_portal.position) < SPACE_PREFETCH_DISTANCE:
+            space_loader.prefetch()
+        space_loader.update()
+        
         # Check if player entered the space portal
         if self.intersects(space_portal).hit and not self.is_in_space:
             self.enter_space()
@@ -343,8 +445,10 @@ class Player(Entity):
         in_space = True
         current_section = "space_world"
         location_text.text = "Location: Space World"
+        tracer.instant('enter space')
         
         # Enable space environment
+        space_loader.build_now()
         space_skybox.enabled = True
         for obj in space_objects:
             obj.enabled = True
@@ -359,11 +463,15 @@ class Player(Entity):
         in_space = False
         current_section = "castle"
         location_text.text = "Location: Peach's Castle"
+        tracer.instant('exit space')
         
         # Disable space environment
-        space_skybox.enabled = False
+        if space_skybox:
+            space_skybox.enabled = False
         for obj in space_objects:
             obj.enabled = False
+        if RELEASE_SPACE_ON_EXIT:
+            space_loader.release()
         
         # Position player back in castle
         self.position = (0, 5, 0)
@@ -448,6 +556,7 @@ class Player(Entity):
                     self.velocity_y = self.jump_height
                     self.position += self.wall_jump_direction * 1.5
                     self.wall_jump_available = False
+                    tracer.instant('wall jump')
                 
             self.y += self.velocity_y * time.dt
     
@@ -495,6 +604,7 @@ class Player(Entity):
                 global lives
                 lives -= 1
                 lives_text.text = f"Lives: {lives}"
+                tracer.instant('black hole damage', lives=lives)
                 
                 if lives <= 0:
                     global state
@@ -512,6 +622,7 @@ class Player(Entity):
                     random.uniform(-100, 100)
                 )
                 self.velocity_y = 0
+                tracer.instant('warp', to=list(self.position))
                 message_text.text = "Warped to new location!"
                 message_text.color = color.magenta
                 invoke(set_message_default, delay=2)
@@ -573,11 +684,12 @@ crown = create_goal()
 
 # Add some decorative elements
 decorations = []
-for i in range(15):
+trees = levelgen.generate('peach_decorations', DECORATION_SEED)['trees']
+for scale, pos in zip(trees['scale'].tolist(), trees['position'].tolist()):
     tree = Entity(
         model='cube', 
-        scale=(0.5, random.uniform(2, 4), 0.5), 
-        position=(random.uniform(-18, 18), 0, random.uniform(-18, 18)),
+        scale=scale, 
+        position=pos,
         color=color.green
     )
     decorations.append(tree)
@@ -611,6 +723,7 @@ def update():
                 player_score += 100
                 coins_text.text = f"Coins: {coins_collected}/{total_coins}"
                 score_text.text = f"Score: {player_score}"
+                tracer.instant('coin pickup', coins=coins_collected)
                 
                 # HackerSM64 nonstop stars feature
                 if HACKER_SM64_CONFIG["nonstop_stars"] and coins_collected % 5 == 0:
@@ -0,0 +1,61 @@
+# ULTRA MARIO 3D BROS - Scene Diffing
+# A scene is described as {key: entity kwargs}. SceneDiff keeps the entities it
+# built for the last description, and given a new one it only adds, removes or
+# updates the entities whose description changed - nothing else is rebuilt.
+# Keys are (group, index) tuples so related entities can be fetched together.
+from ursina import Entity, destroy
+
+# A change to one of these is a different kind of entity, so it is rebuilt instead of updated
+REBUILD_FIELDS = ('cls', 'model', 'collider', 'parent')
+
+
+class SceneDiff:
+    def __init__(self):
+        self.specs = {}
+        self.entities = {}
+
+    def build(self, spec):
+        spec = dict(spec)
+        cls = spec.pop('cls', Entity)
+        return cls(**spec)
+
+    def apply(self, specs):
+        """Bring the scene in line with specs; returns (added, removed, updated) counts"""
+        added = removed = updated = 0
+
+        for key in [key for key in self.specs if key not in specs]:
+            destroy(self.entities.pop(key))
+            del self.specs[key]
+            removed += 1
+
+        for key, spec in specs.items():
+            old = self.specs.get(key)
+            if old == spec:
+                continue
+
+            if old is None or old.keys() != spec.keys() or any(old.get(f) != spec.get(f) for f in REBUILD_FIELDS):
+                if old is not None:
+                    destroy(self.entities[key])
+                    removed += 1
+                self.entities[key] = self.build(spec)
+                added += 1
+            else:
+                entity = self.entities[key]
+                for field, value in spec.items():
+                    if old[field] != value:
+                        setattr(entity, field, value)
+                updated += 1
+            self.specs[key] = spec
+
+        return added, removed, updated
+
+    def group(self, name):
+        """Entities whose key is (name, index), ordered by index"""
+        keys = sorted(key for key in self.entities if key[0] == name)
+        return [self.entities[key] for key in keys]
+
+    def __getitem__(self, key):
+        return self.entities[key]
+
+    def __len__(self):
+        return len(self.entities)
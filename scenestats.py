@@ -0,0 +1,137 @@
+# ULTRA MARIO 3D BROS - Scene Graph Statistics and Leak Detection
+# A Snapshot counts the live entities by model, by parent and by the line of
+# game code that created them, plus the pending invoke()/animation sequences.
+# LeakDetector takes one at a checkpoint the game passes through repeatedly
+# (entering the hub, say); if the scene keeps growing between visits to the
+# same checkpoint, it reports what grew and where it was created, so entities
+# left behind by a level don't pile up over a session.
+#
+#   leak_detector = LeakDetector()
+#   def load_hub():
+#       ...
+#       leak_detector.checkpoint('hub')
+#
+# Creation sites cost a stack walk per entity, so they are only recorded with
+# --leak-check on the command line (or LeakDetector(track_sites=True)).
+import os
+import sys
+from collections import Counter
+import ursina
+from ursina import Entity, scene, application
+
+_URSINA_DIR = os.path.dirname(os.path.abspath(ursina.__file__))
+_THIS_FILE = os.path.abspath(__file__)
+UNTRACKED = '<untracked>'
+_original_init = None
+
+
+def _creation_site():
+    """file:line function of the first caller outside Ursina and this module"""
+    frame = sys._getframe(2)
+    while frame:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_URSINA_DIR) and filename != _THIS_FILE:
+            return f'{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return UNTRACKED
+
+
+def track_creation_sites():
+    """Record where every Entity created from now on was created"""
+    global _original_init
+    if _original_init is not None:
+        return
+    _original_init = Entity.__init__
+
+    def init(self, *args, **kwargs):
+        _original_init(self, *args, **kwargs)
+        self.creation_site = _creation_site()
+
+    Entity.__init__ = init
+
+
+def _name(node):
+    if node is None:
+        return None
+    return getattr(node, 'name', None) or type(node).__name__
+
+
+class Snapshot:
+    def __init__(self, label=''):
+        entities = list(scene.entities)
+        self.label = label
+        self.entities = len(entities)
+        self.by_model = Counter(_name(entity.model) if entity.model else None for entity in entities)
+        self.by_parent = Counter(_name(entity.parent) for entity in entities)
+        self.by_site = Counter(getattr(entity, 'creation_site', UNTRACKED) for entity in entities)
+        self.by_type = Counter(type(entity).__name__ for entity in entities)
+        self.sequences = len(application.sequences)
+        base = application.base
+        self.nodes = base.render.count_num_descendants() + base.render2d.count_num_descendants()
+
+    def growth(self, earlier):
+        """{'entities', 'nodes', 'sequences', 'by_model', ...} grown since an earlier snapshot"""
+        return {
+            'entities': self.entities - earlier.entities,
+            'nodes': self.nodes - earlier.nodes,
+            'sequences': self.sequences - earlier.sequences,
+            'by_model': self.by_model - earlier.by_model,
+            'by_parent': self.by_parent - earlier.by_parent,
+            'by_site': self.by_site - earlier.by_site,
+            'by_type': self.by_type - earlier.by_type,
+        }
+
+    def summary(self, top=5):
+        lines = [f'{self.entities} entities, {self.nodes} scene graph nodes, {self.sequences} sequences']
+        for title, counts in (('model', self.by_model), ('parent', self.by_parent),
+                              ('type', self.by_type), ('created at', self.by_site)):
+            common = ', '.join(f'{count} {key}' for key, count in counts.most_common(top))
+            lines.append(f'  by {title}: {common}')
+        return '\n'.join(lines)
+
+
+class LeakDetector:
+    def __init__(self, tolerance=0, cycles=2, track_sites=None, report=print):
+        """Flag a checkpoint once the scene has grown by more than tolerance
+        entities or sequences on `cycles` consecutive visits to it"""
+        self.tolerance = tolerance
+        self.cycles = cycles
+        self.report = report
+        self.last = {}
+        self.streak = Counter()
+        self.leaks = []  # (label, growth) for every flagged visit
+        if track_sites is None:
+            track_sites = '--leak-check' in sys.argv
+        if track_sites:
+            track_creation_sites()
+
+    def checkpoint(self, label):
+        """Snapshot the scene and compare it with the last visit to this checkpoint"""
+        snapshot = Snapshot(label)
+        earlier = self.last.get(label)
+        self.last[label] = snapshot
+        if earlier is None:
+            return snapshot
+
+        growth = snapshot.growth(earlier)
+        if growth['entities'] > self.tolerance or growth['sequences'] > self.tolerance:
+            self.streak[label] += 1
+        else:
+            self.streak[label] = 0
+        if self.streak[label] >= self.cycles:
+            self.leaks.append((label, growth))
+            self.report(self.describe(label, growth))
+        return snapshot
+
+    def describe(self, label, growth, top=5):
+        lines = [f"Scene grew by {growth['entities']} entities ({growth['nodes']} nodes, "
+                 f"{growth['sequences']} sequences) since the last '{label}' checkpoint, "
+                 f"{self.streak[label]} visits in a row"]
+        for title in ('by_site', 'by_model', 'by_parent'):
+            counts = growth[title]
+            if counts and set(counts) != {UNTRACKED}:
+                lines.append(f"  {title.replace('_', ' ')}: " +
+                             ', '.join(f'+{count} {key}' for key, count in counts.most_common(top)))
+        if UNTRACKED in growth['by_site']:
+            lines.append('  (run with --leak-check to see where they were created)')
+        return '\n'.join(lines)
@@ -0,0 +1,257 @@
+# ULTRA MARIO 3D BROS - Layout Seed Sweep
+# sm64pyv0hub.py's levels are generated from a seed, and some layouts cost a
+# lot more than others to draw and collide against. This builds many seeds of
+# each level offscreen, spread over a process pool, and scores every layout:
+#
+#   draw calls         the level's geometry after Panda3D batches it
+#                      (flatten_strong on a copy), plus the collectibles
+#   shadow draw calls  the same again for the entities the shadow pass draws
+#   kilo vertices      after batching
+#   overlap            how much the entities' bounds overlap each other, as a
+#                      share of their volume (overdraw, wasted geometry)
+#   colliders          box colliders, pairs of them that intersect, and
+#                      crowding: how many others each has within CROWDING
+#                      (clusters the player's collision checks all pay for)
+#   unreachable stars  stars the bot farm's search (botfarm.py) can't touch,
+#                      with the hub player's speed and single jump
+#                      (botfarm.hub_rules()); the jump arc is mariosim's, so
+#                      this approximates FirstPersonController rather than
+#                      replaying it
+#
+# Each is multiplied by its weight in WEIGHTS and summed; the lowest total is
+# best. Layouts with unreachable stars sort last whatever else they cost.
+#
+#   python seedsweep.py --seeds 64                       # seeds 0-63 of every level
+#   python seedsweep.py --levels lava --seeds 200 --workers 8
+#
+# The report (seedsweep.json) ranks every seed of every level, and the best
+# seed per level goes to level_seeds.json, which sm64pyv0hub.py loads over
+# its LEVEL_SEEDS (through levelgen.best_seeds()). A level whose seeds all
+# leave stars out of reach is left out, so the game keeps its own seed.
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+from gamerunner import REPO_DIR, run_game
+from levelgen import BEST_SEEDS_FILE, best_seeds
+import botfarm
+import mariosim
+
+SCRIPT = 'sm64pyv0hub.py'
+CHUNK = 16  # Seeds built per game process
+SEARCH_DEPTH = 40  # Bot farm search per layout: shallower than botfarm.py's own, there are many layouts
+SEARCH_BEAM = 1000
+CROWDING = 2.0  # Colliders closer than this to each other count as crowded
+GROUND_AREA = 1000  # Colliders with a footprint this big are floors, near everything by nature
+WEIGHTS = {
+    'draw_calls': 1.0,
+    'shadow_draw_calls': 1.0,
+    'kilo_vertices': 0.5,
+    'overlap': 20.0,
+    'colliders': 0.2,
+    'collider_overlaps': 1.0,
+    'crowding': 5.0,
+    'unreachable_stars': 100.0,
+}
+
+
+def _batched(entities):
+    """Draw calls and vertices the entities' geometry comes to once Panda3D has merged what it can"""
+    from panda3d.core import NodePath
+    holder = NodePath('batched')
+    for entity in entities:
+        copy = entity.copy_to(holder)
+        copy.set_transform(entity.get_transform(entity.get_top()))
+    holder.flatten_strong()
+    draw_calls = vertices = 0
+    for node_path in holder.find_all_matches('**/+GeomNode'):
+        for geom in node_path.node().get_geoms():
+            draw_calls += 1
+            vertices += geom.get_vertex_data().get_num_rows()
+    holder.remove_node()
+    return draw_calls, vertices
+
+
+def _bounds(entities):
+    """World bounding boxes as (N, 3) low and high corners"""
+    from ursina import scene
+    low, high = [], []
+    for entity in entities:
+        bounds = entity.get_tight_bounds(scene)
+        if bounds is None:
+            continue
+        low.append(tuple(bounds[0]))
+        high.append(tuple(bounds[1]))
+    return np.array(low, dtype=np.float64).reshape(-1, 3), np.array(high, dtype=np.float64).reshape(-1, 3)
+
+
+def _pair_overlaps(low, high):
+    """Volume of each box and the intersection volume of every pair (upper triangle)"""
+    extent = np.minimum(high[:, None, :], high[None, :, :]) - np.maximum(low[:, None, :], low[None, :, :])
+    intersection = np.prod(np.clip(extent, 0, None), axis=2)
+    intersection = np.triu(intersection, k=1)
+    volumes = np.prod(high - low, axis=1)
+    return volumes, intersection
+
+
+def _crowding(colliders):
+    """Mean number of other colliders within CROWDING of each one, floors left out"""
+    low, high = colliders.low.astype(np.float64), colliders.high.astype(np.float64)
+    footprint = (high[:, 0] - low[:, 0]) * (high[:, 2] - low[:, 2])
+    low, high = low[footprint < GROUND_AREA], high[footprint < GROUND_AREA]
+    if len(low) < 2:
+        return 0.0
+    gap = np.maximum(np.maximum(low[:, None, :] - high[None, :, :], low[None, :, :] - high[:, None, :]), 0)
+    near = np.linalg.norm(gap, axis=2) < CROWDING
+    np.fill_diagonal(near, False)
+    return float(near.sum(axis=1).mean())
+
+
+def measure_level(level):
+    """Render and collision numbers for a level that has just been created"""
+    from ursina.shaders import lit_with_shadows_shader
+    static = [entity for entity in level.entities if entity.model]
+    draw_calls, vertices = _batched(static)
+    casters = [entity for entity in static if entity.shader == lit_with_shadows_shader]
+    shadow_draw_calls = _batched(casters)[0] if casters else 0
+
+    # Overdraw from entities inside each other; the ground, flat and under everything, would only add noise
+    low, high = _bounds([entity for entity in static if entity.model.name != 'plane'])
+    volumes, intersection = _pair_overlaps(low, high)
+    overlap = float(intersection.sum() / max(volumes.sum(), 1e-9))
+
+    colliders = mariosim.Colliders.from_entities(level.entities)
+    _, collider_intersection = _pair_overlaps(colliders.low.astype(np.float64), colliders.high.astype(np.float64))
+    return {
+        'entities': len(level.entities) + len(level.stars),
+        # Stars are collected one by one, so they stay separate
+        'draw_calls': draw_calls + len(level.stars),
+        'shadow_draw_calls': shadow_draw_calls,
+        'kilo_vertices': vertices / 1000,
+        'overlap': round(overlap, 4),
+        'colliders': len(colliders),
+        'collider_overlaps': int((collider_intersection > 1e-3).sum()),
+        'crowding': round(_crowding(colliders), 3),
+        'collider_arrays': colliders.to_lists(),
+        'stars': [list(star.position) for star in level.stars],
+    }
+
+
+def build_layouts(level_name, seeds):
+    """Build each seed of a level offscreen and measure it; runs in a process of its own"""
+    # Sweep layouts go to a throwaway layout cache, not the game's
+    cache = tempfile.mkdtemp(prefix='seedsweep_')
+    os.environ['LAYOUT_CACHE_DIR'] = cache
+
+    def build(app, game):
+        level = game.game_manager.levels[level_name]
+        rules = botfarm.hub_rules(game.game_manager.player)
+        results = []
+        for seed in seeds:
+            level.seed = seed
+            level.create()
+            results.append({'level': level_name, 'seed': seed, 'rules': rules, **measure_level(level)})
+            level.destroy()
+        return results
+
+    try:
+        return run_game(SCRIPT, build, offscreen=True, argv=('--no-pacing',))
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+
+
+def _reachability(args):
+    layout, depth, beam = args
+    level = {'spawn': (0, 2, 0), 'pickup_radius': 2, 'stars': layout['stars'],
+             'colliders': layout['collider_arrays'], 'rules': layout['rules']}
+    found = botfarm.search(level, depth, beam)
+    return len(layout['stars']) - len(found)
+
+
+def score(layout, weights=WEIGHTS):
+    return sum(weight * layout[name] for name, weight in weights.items())
+
+
+def _level_names():
+    """The levels sm64pyv0hub.py's GameManager builds, read without starting the game"""
+    import ast
+    with open(os.path.join(REPO_DIR, SCRIPT), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'LEVEL_SEEDS' for target in node.targets):
+            return [key.value for key in node.value.keys]
+    raise RuntimeError(f'no LEVEL_SEEDS in {SCRIPT}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build many seeds of each level and rank the layouts')
+    parser.add_argument('--levels', nargs='*', help='only these levels')
+    parser.add_argument('--seeds', type=int, default=64, help='try seeds 0 to N-1')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--depth', type=int, default=SEARCH_DEPTH, help='bot farm search depth, in input segments')
+    parser.add_argument('--beam', type=int, default=SEARCH_BEAM)
+    parser.add_argument('--output', default=os.path.join(REPO_DIR, 'seedsweep.json'))
+    parser.add_argument('--no-save', action='store_true', help=f'leave {os.path.basename(BEST_SEEDS_FILE)} alone')
+    args = parser.parse_args()
+
+    levels = args.levels or _level_names()
+    seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+    chunks = [(level, seeds[i:i + CHUNK]) for level in levels for i in range(0, len(seeds), CHUNK)]
+    began = perf_counter()
+    print(f'Building {len(levels) * len(seeds)} layouts on {args.workers} workers...', file=sys.stderr)
+    # Spawned processes rather than forked ones: each builds its own Panda3D app, one game per process
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(min(args.workers, len(chunks)), maxtasksperchild=1) as pool:
+        layouts = [layout for chunk in pool.starmap(build_layouts, chunks) for layout in chunk]
+    print('Searching their stars...', file=sys.stderr)
+    with context.Pool(args.workers) as pool:
+        unreachable = pool.map(_reachability, [(layout, args.depth, args.beam) for layout in layouts])
+
+    report = {'weights': WEIGHTS, 'search': {'depth': args.depth, 'beam': args.beam}, 'levels': {}}
+    best = best_seeds()
+    for level in levels:
+        rows = []
+        for layout, missing in zip(layouts, unreachable):
+            if layout['level'] != level:
+                continue
+            row = {key: value for key, value in layout.items() if key not in ('collider_arrays', 'stars', 'level', 'rules')}
+            row['unreachable_stars'] = missing
+            row['score'] = round(score(row), 3)
+            rows.append(row)
+        rows.sort(key=lambda row: (row['unreachable_stars'] > 0, row['score']))
+        report['levels'][level] = rows
+        if rows[0]['unreachable_stars'] == 0:
+            best[level] = rows[0]['seed']
+        else:
+            # The game keeps its hand-picked seed rather than one with stars out of reach
+            best.pop(level, None)
+            print(f'warning: every seed of {level} has unreachable stars; keeping the seed in LEVEL_SEEDS',
+                  file=sys.stderr)
+
+        print(f'{level}:')
+        for rank, row in enumerate(rows[:5], 1):
+            print(f'  {rank}. seed {row["seed"]:>4}: score {row["score"]:7.2f}  {row["draw_calls"]} draws, '
+                  f'{row["kilo_vertices"]:.1f}k vertices, overlap {row["overlap"]:.3f}, {row["colliders"]} colliders '
+                  f'({row["collider_overlaps"]} intersecting, crowding {row["crowding"]:.2f}), '
+                  f'{row["unreachable_stars"]} unreachable stars')
+        worst = rows[-1]
+        print(f'  worst: seed {worst["seed"]}, score {worst["score"]:.2f}')
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if not args.no_save:
+        with open(BEST_SEEDS_FILE, 'w') as f:
+            json.dump(best, f, indent=2)
+    print(f'{len(layouts)} layouts in {perf_counter() - began:.0f} s; report written to {args.output}'
+          + ('' if args.no_save else f', best seeds to {BEST_SEEDS_FILE}'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
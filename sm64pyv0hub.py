@@ -1,8 +1,16 @@
 from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
 from ursina.shaders import lit_with_shadows_shader
-import random
 import math
+import levelgen
+from scenestats import LeakDetector
+from memorybudget import MemoryBudget
+from eventtrace import EventTrace
+from framepacer import FramePacer
+from ghosts import GhostRace
+from enemies import EnemySwarm, KINDS as ENEMY_KINDS
+from navmesh import NavMesh
+import mariosim
 
 app = Ursina()
 
@@ -19,6 +27,15 @@ class GameState:
         
 game_state = GameState()
 
+# Reports entities that survive a hub -> level -> hub round trip
+leak_detector = LeakDetector()
+# What each level build costs; F4 shows it
+memory_budget = MemoryBudget()
+# Gameplay events on a timeline with the frames (--trace or F6)
+tracer = EventTrace()
+# Trades resolution and draw distance for frame rate when frames run long (F7 shows it)
+pacer = FramePacer()
+
 # Enhanced Mario character model
 class MarioCharacter(Entity):
     def __init__(self, **kwargs):
@@ -68,6 +85,24 @@ class MarioCharacter(Entity):
         Entity(model='cube', color=color.brown, scale=(0.4, 0.2, 0.5), position=(-0.3, -1.3, 0.1), parent=self)
         Entity(model='cube', color=color.brown, scale=(0.4, 0.2, 0.5), position=(0.3, -1.3, 0.1), parent=self)
 
+# Earlier runs of a level race alongside as translucent Marios
+ghosts = GhostRace(MarioCharacter)
+
+def enemy_hurt(kind, index):
+    # No lives here: a hit sends the player back to the level's start
+    game_manager.player.position = Vec3(0, 2, 0)
+    Text('Ouch!', origin=(0, 0), scale=2, color=color.red, duration=1)
+    tracer.instant('enemy hit', level=game_state.current_level, enemy=kind)
+
+def enemy_stomped(kind, index):
+    # Bounce off it as if off the ground
+    game_manager.player.grounded = True
+    game_manager.player.jump()
+    tracer.instant('enemy stomp', level=game_state.current_level, enemy=kind)
+
+# The current level's enemies, all updated together (see enemies.py); the target is set with the player
+enemies = EnemySwarm(on_hurt=enemy_hurt, on_stomp=enemy_stomped)
+
 # Painting Portal Class
 class PaintingPortal(Entity):
     def __init__(self, level_name, title, position, rotation=(0,0,0), **kwargs):
@@ -83,7 +118,7 @@ class PaintingPortal(Entity):
         self.title = title
         
         # Frame
-        Entity(model='cube', color=color.brown, scale=(3.3, 4.3, 0.1), position=position + Vec3(0, 0, 0.05), rotation=rotation)
+        self.frame = Entity(model='cube', color=color.brown, scale=(3.3, 4.3, 0.1), position=position + Vec3(0, 0, 0.05), rotation=rotation)
         
         # Title plaque
         self.title_entity = Entity(
@@ -195,7 +230,7 @@ class HubWorld:
             position=Vec3(-18, 8, 0),
             rotation=(0, 90, 0)
         )
-        self.entities.append(self.painting1)
+        self.entities.extend([self.painting1, self.painting1.frame, self.painting1.title_entity])
         
         self.painting2 = PaintingPortal(
             "desert",
@@ -203,7 +238,7 @@ class HubWorld:
             position=Vec3(18, 8, 0),
             rotation=(0, -90, 0)
         )
-        self.entities.append(self.painting2)
+        self.entities.extend([self.painting2, self.painting2.frame, self.painting2.title_entity])
         
         self.painting3 = PaintingPortal(
             "ice",
@@ -211,7 +246,7 @@ class HubWorld:
             position=Vec3(0, 8, -18),
             rotation=(0, 0, 0)
         )
-        self.entities.append(self.painting3)
+        self.entities.extend([self.painting3, self.painting3.frame, self.painting3.title_entity])
         
         self.painting4 = PaintingPortal(
             "lava",
@@ -219,7 +254,7 @@ class HubWorld:
             position=Vec3(0, 13, 15),
             rotation=(0, 180, 0)
         )
-        self.entities.append(self.painting4)
+        self.entities.extend([self.painting4, self.painting4.frame, self.painting4.title_entity])
         
         # Decorative elements
         # Chandelier
@@ -258,27 +293,49 @@ class HubWorld:
             if hasattr(entity, 'disable'):
                 entity.disable()
             destroy(entity)
+        self.entities = []
 
 # Level Base Class
 class Level:
-    def __init__(self, name):
+    def __init__(self, name, seed=0):
         self.name = name
+        self.seed = seed
         self.entities = []
         self.stars = []
         self.collected_stars = 0
         
     def create(self):
         raise NotImplementedError
+    
+    def layout(self):
+        # Same seed, same level - generated once and then loaded from the layout cache
+        return levelgen.generate(self.name, self.seed)
+    
+    def spawn_enemies(self, layout):
+        # The layout's goombas, bob-ombs and whomps join the shared swarm
+        for kind in ENEMY_KINDS:
+            group = layout.get(kind + 's')
+            if group is not None and len(group['position']):
+                enemies.spawn(kind, group['position'], group['heading'])
+    
+    def navmesh(self):
+        # Paths around the level's props for the enemies; built once per seed, then read from navmesh_cache/
+        return NavMesh.for_level(self.name, self.seed, mariosim.Colliders.from_entities(self.entities))
         
     def destroy(self):
         for entity in self.entities:
             destroy(entity)
         for star in self.stars:
             destroy(star)
+        self.entities = []
+        self.stars = []
+        enemies.clear()
 
 # Grassland Level
 class GrasslandLevel(Level):
     def create(self):
+        layout = self.layout()
+        
         # Ground
         ground = Entity(
             model='plane',
@@ -291,12 +348,8 @@ class GrasslandLevel(Level):
         self.entities.append(ground)
         
         # Trees
-        for i in range(20):
-            tree_pos = Vec3(
-                random.uniform(-25, 25),
-                0,
-                random.uniform(-25, 25)
-            )
+        for pos in layout['trees']['position'].tolist():
+            tree_pos = Vec3(*pos)
             
             # Tree trunk
             trunk = Entity(
@@ -318,15 +371,12 @@ class GrasslandLevel(Level):
             self.entities.append(leaves)
         
         # Platforms
-        for i in range(15):
+        platforms = layout['platforms']
+        for scale, pos in zip(platforms['scale'].tolist(), platforms['position'].tolist()):
             platform = Entity(
                 model='cube',
-                scale=(random.uniform(3, 6), 1, random.uniform(3, 6)),
-                position=(
-                    random.uniform(-20, 20),
-                    random.uniform(1, 8),
-                    random.uniform(-20, 20)
-                ),
+                scale=scale,
+                position=pos,
                 color=color.rgb(100, 200, 100),
                 texture='grass',
                 collider='box'
@@ -334,8 +384,7 @@ class GrasslandLevel(Level):
             self.entities.append(platform)
         
         # Stars
-        star_positions = [(10, 5, 10), (-15, 3, -10), (0, 10, 0)]
-        for pos in star_positions:
+        for pos in layout['stars']['position'].tolist():
             star = Entity(
                 model='sphere',
                 color=color.yellow,
@@ -345,12 +394,15 @@ class GrasslandLevel(Level):
             )
             self.stars.append(star)
         
+        # Enemies
+        self.spawn_enemies(layout)
+        
         # Exit portal
         self.exit_portal = Entity(
             model='cube',
             scale=(2, 3, 0.5),
             position=(0, 1.5, -30),
-            color=color.purple,
+            color=color.violet,
             collider='box'
         )
         self.entities.append(self.exit_portal)
@@ -360,6 +412,8 @@ class GrasslandLevel(Level):
 # Desert Level
 class DesertLevel(Level):
     def create(self):
+        layout = self.layout()
+        
         # Sandy ground
         ground = Entity(
             model='plane',
@@ -372,12 +426,8 @@ class DesertLevel(Level):
         self.entities.append(ground)
         
         # Pyramids
-        for i in range(3):
-            pyramid_pos = Vec3(
-                random.uniform(-20, 20),
-                0,
-                random.uniform(-20, 20)
-            )
+        for pos in layout['pyramids']['position'].tolist():
+            pyramid_pos = Vec3(*pos)
             
             for level in range(5):
                 size = 10 - level * 2
@@ -392,23 +442,18 @@ class DesertLevel(Level):
                 self.entities.append(pyramid_level)
         
         # Cacti
-        for i in range(10):
+        for pos in layout['cacti']['position'].tolist():
             cactus = Entity(
                 model='cylinder',
                 scale=(0.5, 2, 0.5),
-                position=(
-                    random.uniform(-25, 25),
-                    1,
-                    random.uniform(-25, 25)
-                ),
+                position=pos,
                 color=color.rgb(50, 150, 50),
                 collider='box'
             )
             self.entities.append(cactus)
         
         # Stars
-        star_positions = [(15, 8, 15), (-10, 5, -15), (0, 15, 0)]
-        for pos in star_positions:
+        for pos in layout['stars']['position'].tolist():
             star = Entity(
                 model='sphere',
                 color=color.yellow,
@@ -418,12 +463,15 @@ class DesertLevel(Level):
             )
             self.stars.append(star)
         
+        # Enemies
+        self.spawn_enemies(layout)
+        
         # Exit portal
         self.exit_portal = Entity(
             model='cube',
             scale=(2, 3, 0.5),
             position=(0, 1.5, -30),
-            color=color.purple,
+            color=color.violet,
             collider='box'
         )
         self.entities.append(self.exit_portal)
@@ -433,6 +481,8 @@ class DesertLevel(Level):
 # Ice Level
 class IceLevel(Level):
     def create(self):
+        layout = self.layout()
+        
         # Icy ground
         ground = Entity(
             model='plane',
@@ -445,59 +495,48 @@ class IceLevel(Level):
         self.entities.append(ground)
         
         # Ice blocks and platforms
-        for i in range(20):
+        ice_blocks = layout['ice_blocks']
+        for scale, pos in zip(ice_blocks['scale'].tolist(), ice_blocks['position'].tolist()):
             ice_block = Entity(
                 model='cube',
-                scale=(random.uniform(2, 5), random.uniform(1, 3), random.uniform(2, 5)),
-                position=(
-                    random.uniform(-20, 20),
-                    random.uniform(0, 5),
-                    random.uniform(-20, 20)
-                ),
+                scale=scale,
+                position=pos,
                 color=color.rgb(200, 230, 255),
                 texture='white_cube',
                 collider='box'
             )
             self.entities.append(ice_block)
         
-        # Snowmen
-        for i in range(5):
-            snowman_pos = Vec3(
-                random.uniform(-15, 15),
-                0,
-                random.uniform(-15, 15)
-            )
+        # Snowmen (kept in self.entities rather than parented to the scaled ground)
+        for pos in layout['snowmen']['position'].tolist():
+            snowman_pos = Vec3(*pos)
             
             # Bottom
-            Entity(
+            self.entities.append(Entity(
                 model='sphere',
                 scale=1.5,
                 position=snowman_pos + Vec3(0, 0.75, 0),
-                color=color.white,
-                parent=self.entities[0]
-            )
+                color=color.white
+            ))
             
             # Middle
-            Entity(
+            self.entities.append(Entity(
                 model='sphere',
                 scale=1,
                 position=snowman_pos + Vec3(0, 2, 0),
-                color=color.white,
-                parent=self.entities[0]
-            )
+                color=color.white
+            ))
             
             # Head
-            Entity(
+            self.entities.append(Entity(
                 model='sphere',
                 scale=0.7,
                 position=snowman_pos + Vec3(0, 2.8, 0),
-                color=color.white,
-                parent=self.entities[0]
-            )
+                color=color.white
+            ))
         
         # Stars
-        star_positions = [(12, 6, 8), (-8, 4, -12), (0, 8, 0)]
-        for pos in star_positions:
+        for pos in layout['stars']['position'].tolist():
             star = Entity(
                 model='sphere',
                 color=color.yellow,
@@ -507,12 +546,15 @@ class IceLevel(Level):
             )
             self.stars.append(star)
         
+        # Enemies
+        self.spawn_enemies(layout)
+        
         # Exit portal
         self.exit_portal = Entity(
             model='cube',
             scale=(2, 3, 0.5),
             position=(0, 1.5, -30),
-            color=color.purple,
+            color=color.violet,
             collider='box'
         )
         self.entities.append(self.exit_portal)
@@ -522,6 +564,8 @@ class IceLevel(Level):
 # Lava Level
 class LavaLevel(Level):
     def create(self):
+        layout = self.layout()
+        
         # Lava floor (deadly!)
         lava = Entity(
             model='plane',
@@ -535,15 +579,12 @@ class LavaLevel(Level):
         self.entities.append(lava)
         
         # Safe platforms
-        for i in range(25):
+        platforms = layout['platforms']
+        for scale, pos in zip(platforms['scale'].tolist(), platforms['position'].tolist()):
             platform = Entity(
                 model='cube',
-                scale=(random.uniform(3, 5), 1, random.uniform(3, 5)),
-                position=(
-                    random.uniform(-25, 25),
-                    random.uniform(0, 10),
-                    random.uniform(-25, 25)
-                ),
+                scale=scale,
+                position=pos,
                 color=color.rgb(80, 60, 40),
                 texture='brick',
                 collider='box'
@@ -551,22 +592,18 @@ class LavaLevel(Level):
             self.entities.append(platform)
         
         # Lava pillars
-        for i in range(8):
+        pillars = layout['pillars']
+        for scale, pos in zip(pillars['scale'].tolist(), pillars['position'].tolist()):
             pillar = Entity(
                 model='cylinder',
-                scale=(2, random.uniform(5, 15), 2),
-                position=(
-                    random.uniform(-20, 20),
-                    -2,
-                    random.uniform(-20, 20)
-                ),
+                scale=scale,
+                position=pos,
                 color=color.red
             )
             self.entities.append(pillar)
         
         # Stars
-        star_positions = [(10, 8, 10), (-12, 6, -8), (0, 12, 0)]
-        for pos in star_positions:
+        for pos in layout['stars']['position'].tolist():
             star = Entity(
                 model='sphere',
                 color=color.yellow,
@@ -581,13 +618,23 @@ class LavaLevel(Level):
             model='cube',
             scale=(2, 3, 0.5),
             position=(0, 1.5, -30),
-            color=color.purple,
+            color=color.violet,
             collider='box'
         )
         self.entities.append(self.exit_portal)
         
         return self.entities
 
+# Layout seed for each level - change a seed to get a different (but repeatable) level
+LEVEL_SEEDS = {
+    "grassland": 1,
+    "desert": 2,
+    "ice": 3,
+    "lava": 4
+}
+# Seeds picked by seedsweep.py for cheap, fully reachable layouts, when it has been run
+LEVEL_SEEDS.update({name: seed for name, seed in levelgen.best_seeds().items() if name in LEVEL_SEEDS})
+
 # Game Manager
 class GameManager:
     def __init__(self):
@@ -595,10 +642,10 @@ class GameManager:
         self.current_level = None
         self.hub_world = HubWorld()
         self.levels = {
-            "grassland": GrasslandLevel("grassland"),
-            "desert": DesertLevel("desert"),
-            "ice": IceLevel("ice"),
-            "lava": LavaLevel("lava")
+            "grassland": GrasslandLevel("grassland", LEVEL_SEEDS["grassland"]),
+            "desert": DesertLevel("desert", LEVEL_SEEDS["desert"]),
+            "ice": IceLevel("ice", LEVEL_SEEDS["ice"]),
+            "lava": LavaLevel("lava", LEVEL_SEEDS["lava"])
         }
         self.ui_text = None
         
@@ -606,23 +653,32 @@ class GameManager:
         self.load_hub()
         
     def load_hub(self):
+        if self.current_level in self.levels.values():
+            ghosts.finish(stars=self.current_level.collected_stars)
         if self.current_level:
             self.current_level.destroy()
         
         game_state.current_level = "hub"
         self.current_level = self.hub_world
-        self.hub_world.create()
+        with tracer.span('level load', level='hub'), memory_budget.build('hub'):
+            self.hub_world.create()
         
         # Create player
         if self.player:
+            # The character model and the cursor aren't children of the controller
+            destroy(self.player.character)
             destroy(self.player)
+            destroy(self.player.cursor)
         
+        character = MarioCharacter()
         self.player = FirstPersonController(
-            model=MarioCharacter(),
+            model=character,
             position=(0, 2, 0),
             speed=8,
             jump_height=3
         )
+        self.player.character = character
+        enemies.target = self.player
         
         # Set up camera
         self.player.camera_pivot.z = -8
@@ -639,6 +695,7 @@ class GameManager:
             scale=2,
             color=color.yellow
         )
+        leak_detector.checkpoint('hub')
     
     def load_level(self, level_name):
         if self.current_level:
@@ -647,10 +704,14 @@ class GameManager:
         game_state.current_level = level_name
         level = self.levels[level_name]
         self.current_level = level
-        level.create()
+        with tracer.span('level load', level=level_name), memory_budget.build(level_name):
+            level.create()
+        if len(enemies):
+            enemies.navmesh = level.navmesh()
         
         # Reset player position
         self.player.position = Vec3(0, 2, 0)
+        ghosts.start(level_name, self.player)
         
         # Update UI
         if self.ui_text:
@@ -671,6 +732,7 @@ class GameManager:
             paintings = [p for p in self.current_level.entities if isinstance(p, PaintingPortal)]
             for painting in paintings:
                 if distance(self.player.position, painting.position) < 3:
+                    tracer.instant('painting enter', level=painting.level_name)
                     self.load_level(painting.level_name)
                     return
         
@@ -685,6 +747,7 @@ class GameManager:
                     destroy(star)
                     level.collected_stars += 1
                     game_state.stars_collected += 1
+                    tracer.instant('star collect', level=game_state.current_level, stars=game_state.stars_collected)
                     
                     # Update UI
                     self.ui_text.text = f'Level: {game_state.current_level.title()} | Stars: {level.collected_stars}/{len(level.stars) + level.collected_stars} | Total: {game_state.stars_collected}'
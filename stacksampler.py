@@ -0,0 +1,132 @@
+# ULTRA MARIO 3D BROS - Stack Sampler
+# A statistical profiler for live play. F5 starts a background thread that
+# looks at the main thread's Python stack every few milliseconds for a set
+# number of seconds (F5 again stops early), then writes how often each stack
+# was seen as collapsed stacks next to the game - one "root;caller;callee count"
+# line per stack, the input flamegraph.pl, speedscope.app and inferno expect.
+#
+#   sampler = StackSampler()                # F5, 10 seconds
+#   sampler = StackSampler(key=None)        # the game's input() calls sampler.toggle()
+#   python "samsoft1.0peach.py" --sample-seconds 30
+#
+# Sampling doesn't touch the game's own code, so costs nothing until it is
+# started and little while it runs. Time the main thread spends in Panda3D's
+# C++ (rendering) shows up under the Python frame that called into it.
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from time import perf_counter, sleep
+from ursina import Entity, Text, camera, color
+
+DEFAULT_SECONDS = 10
+INTERVAL = 0.005  # Seconds between samples
+
+
+def _argv_seconds(argv):
+    if '--sample-seconds' in argv:
+        index = argv.index('--sample-seconds')
+        if index + 1 < len(argv):
+            return float(argv[index + 1])
+    return DEFAULT_SECONDS
+
+
+class StackSampler(Entity):
+    def __init__(self, key='f5', seconds=None, interval=INTERVAL, directory=None, **kwargs):
+        super().__init__(parent=camera.ui, eternal=True, **kwargs)
+        self.key = key
+        self.seconds = _argv_seconds(sys.argv) if seconds is None else seconds
+        self.interval = interval
+        script = sys.argv[0] or 'game'
+        self.script = os.path.splitext(os.path.basename(script))[0]
+        self.directory = directory or os.path.dirname(os.path.abspath(script))
+        self.samples = Counter()
+        self.sample_count = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.started = 0.0
+        self.last_path = None
+        self.labels = {}  # code object -> frame label, so each function is only formatted once
+        self.status = Text(parent=self, text='', position=(0.5, 0.47), origin=(0.5, 0.5),
+                           color=color.orange, enabled=False)
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        """Sample the main thread until stop() or until self.seconds have passed"""
+        if self.running:
+            return
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stopping.clear()
+        self.started = perf_counter()
+        self.thread = threading.Thread(target=self._sample, args=(threading.main_thread().ident,),
+                                       name='stack_sampler', daemon=True)
+        self.thread.start()
+        self.status.enabled = True
+
+    def stop(self):
+        """Stop sampling, write the collapsed stacks and return their path"""
+        if not self.running:
+            return None
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.status.enabled = False
+        self.last_path = self.write()
+        print(f'{self.sample_count} stack samples written to {self.last_path}')
+        return self.last_path
+
+    def _sample(self, main_id):
+        deadline = self.started + self.seconds
+        while not self.stopping.is_set() and perf_counter() < deadline:
+            frame = sys._current_frames().get(main_id)
+            if frame is not None:
+                self.samples[self._stack(frame)] += 1
+                self.sample_count += 1
+            sleep(self.interval)
+
+    def _stack(self, frame):
+        labels = self.labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return ';'.join(stack)
+
+    def write(self, path=None):
+        """Write the samples as collapsed stacks, heaviest first"""
+        if path is None:
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(self.directory, f'samples_{self.script}_{stamp}.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def input(self, key):
+        if key == self.key:
+            self.toggle()
+
+    def update(self):
+        if not self.running:
+            return
+        elapsed = perf_counter() - self.started
+        if not self.thread.is_alive():
+            self.stop()
+            return
+        self.status.text = f'Sampling {elapsed:.0f}/{self.seconds:.0f}s ({self.sample_count} samples)'
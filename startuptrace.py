@@ -0,0 +1,202 @@
+# ULTRA MARIO 3D BROS - Startup Tracer
+# Times each phase of a port script's startup (interpreter start, ursina
+# import, window open, level build, scene preparation, first frames), every
+# module import inside them and optionally the script's own function calls,
+# and writes the timeline in Chrome trace format - open it in chrome://tracing,
+# ui.perfetto.dev or speedscope.app to see it as a flame chart.
+#
+#   python startuptrace.py "cat'ssm64.py"            # warm start
+#   python startuptrace.py "cat'ssm64.py" --cold     # no bytecode, model or layout caches
+#   python startuptrace.py "cat'ssm64.py" --calls    # also trace the script's functions
+from time import perf_counter, time
+_TRACER_START = perf_counter()  # Before anything else is imported
+
+import argparse
+import builtins
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FRAMES = 3
+
+
+def _process_start():
+    """Seconds since the epoch when this process started, or None where /proc isn't available"""
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat') as f:
+            boot = next(float(line.split()[1]) for line in f if line.startswith('btime'))
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+    return boot + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+
+class Timeline:
+    def __init__(self):
+        self.events = []
+        self.phases = {}
+
+    def add(self, name, start, end, category, args=None):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': 1,
+                 'ts': start * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+        if category == 'phase':
+            self.phases[name] = (end - start) * 1000
+
+    @contextmanager
+    def span(self, name, category='phase'):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, perf_counter(), category)
+
+    def chrome_trace(self, metadata):
+        origin = min(event['ts'] for event in self.events)
+        events = sorted(({**event, 'ts': event['ts'] - origin} for event in self.events),
+                        key=lambda event: (event['ts'], -event['dur']))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata}
+
+
+def trace_imports(timeline):
+    """Record a span for every module actually loaded (not already in sys.modules)"""
+    original_import = builtins.__import__
+
+    def traced_import(name, globals=None, locals=None, fromlist=(), level=0):
+        module = name
+        if level:
+            try:
+                module = importlib.util.resolve_name('.' * level + name, (globals or {}).get('__package__'))
+            except (ImportError, ValueError):
+                pass
+        if module in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        start = perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            timeline.add(f'import {module}', start, perf_counter(), 'import')
+
+    builtins.__import__ = traced_import
+    return lambda: setattr(builtins, '__import__', original_import)
+
+
+def trace_calls(timeline, directory=REPO_DIR):
+    """Record a span for every Python function call in files under directory"""
+    skip = {os.path.abspath(__file__), os.path.join(directory, 'gamerunner.py')}
+    stack = []
+
+    def profile(frame, event, arg):
+        if event not in ('call', 'return'):
+            return
+        filename = frame.f_code.co_filename
+        if not filename.startswith(directory) or filename in skip:
+            return
+        if event == 'call':
+            stack.append((frame, perf_counter()))
+        elif stack and stack[-1][0] is frame:
+            _, start = stack.pop()
+            code = frame.f_code
+            timeline.add(code.co_name, start, perf_counter(), 'call',
+                         {'file': os.path.basename(code.co_filename), 'line': code.co_firstlineno})
+
+    sys.setprofile(profile)
+    return lambda: sys.setprofile(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trace the startup of a port script')
+    parser.add_argument('script')
+    parser.add_argument('--cold', action='store_true',
+                        help='start without bytecode, Panda3D model or level layout caches')
+    parser.add_argument('--calls', action='store_true',
+                        help="also trace the script's own function calls (slows the build down)")
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='frames to render after the first')
+    parser.add_argument('--offscreen', action='store_true', help='render offscreen, for machines without a display')
+    parser.add_argument('--output', help='trace file (default: startup_<script>_<cold|warm>.json)')
+    args = parser.parse_args()
+
+    timeline = Timeline()
+    process_start = _process_start()
+    if process_start is not None:
+        # Map the process start onto the perf_counter clock
+        timeline.add('interpreter start', process_start - time() + perf_counter(), _TRACER_START, 'phase')
+
+    if args.cold:
+        # A fresh pycache prefix means nothing has bytecode yet, this tree or the installed packages
+        cache_dir = tempfile.mkdtemp(prefix='startuptrace_')
+        sys.pycache_prefix = os.path.join(cache_dir, 'pycache')
+        from panda3d.core import loadPrcFileData
+        loadPrcFileData('startuptrace', f'model-cache-dir {os.path.join(cache_dir, "models")}')
+        os.environ['LAYOUT_CACHE_DIR'] = os.path.join(cache_dir, 'layouts')
+
+    stop_imports = trace_imports(timeline)
+    with timeline.span('import ursina'):
+        import ursina
+    from gamerunner import run_game
+
+    marks = {}
+    stop_calls = None
+
+    def before_app():
+        marks['window'] = perf_counter()
+
+    def after_app(app):
+        nonlocal stop_calls
+        now = perf_counter()
+        timeline.add('open window', marks['window'], now, 'phase')
+        marks['build'] = now
+        if args.calls:
+            stop_calls = trace_calls(timeline)
+
+    def traced_run(app, game):
+        timeline.add('level build', marks['build'], perf_counter(), 'phase')
+        if stop_calls:
+            stop_calls()
+        with timeline.span('prepare scene (shaders, textures)'):
+            gsg = app.win.get_gsg()
+            app.render.prepare_scene(gsg)
+            app.render2d.prepare_scene(gsg)
+        with timeline.span('first frame'):
+            app.taskMgr.step()
+        for frame in range(args.frames):
+            with timeline.span(f'frame {frame + 2}', 'frame'):
+                app.taskMgr.step()
+
+    run_game(args.script, traced_run, offscreen=args.offscreen,
+             before_app=before_app, after_app=after_app)
+    stop_imports()
+
+    start = 'interpreter start' if process_start is not None else 'import ursina'
+    phase_events = {event['name']: event for event in timeline.events if event['cat'] == 'phase'}
+    first_frame = phase_events['first frame']
+    time_to_first_frame = (first_frame['ts'] + first_frame['dur'] - phase_events[start]['ts']) / 1000
+    metadata = {
+        'script': args.script,
+        'start': 'cold' if args.cold else 'warm',
+        'time_to_first_frame_ms': time_to_first_frame,
+        'measured_from': start,
+        'phases_ms': timeline.phases,
+    }
+
+    script_name = os.path.splitext(os.path.basename(args.script))[0]
+    output = args.output or os.path.join(REPO_DIR, f'startup_{script_name}_{metadata["start"]}.json')
+    with open(output, 'w') as f:
+        json.dump(timeline.chrome_trace(metadata), f)
+
+    for name, duration in timeline.phases.items():
+        print(f'{name:<36}{duration:10.1f} ms')
+    print(f'{"time to first frame (" + metadata["start"] + ")":<36}{time_to_first_frame:10.1f} ms')
+    print(f'Trace written to {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# ULTRA MARIO 3D BROS - Stress Test
+# Fills a port's level with N platforms, N coins and N decorative props and
+# measures how the frame (game update and render separately) and collision
+# queries (raycasts and intersects(), what the ports use for ground checks and
+# pickups) slow down as N doubles. Coins come from the port's own
+# create_coins() where it takes its count from total_coins, and are added to
+# its coins list so its pickup loop sees them; platforms copy the port's own.
+# Runs offscreen, so no GPU is needed, and stops doubling once a frame gets
+# too slow. The curves are written as JSON so later changes can be compared.
+#
+#   python stresstest.py "HackerSM64PYV09.21.251.0.py"
+#   python stresstest.py "cat'ssm64.py" --max 8192 --compare stress_old.json
+import argparse
+import json
+import os
+import random
+import sys
+from time import perf_counter
+from gamerunner import REPO_DIR, run_game
+from benchmark import START, FIXED_DT, scripted_input, draw_calls, percentile
+
+DEFAULT_START = 16
+DEFAULT_MAX = 4096
+MEASURE_FRAMES = 60
+WARMUP_FRAMES = 10
+QUERIES = 200  # Collision queries timed at each step
+FRAME_LIMIT_MS = 250  # Stop doubling once the mean frame takes longer than this
+AREA = 25  # Stress entities are scattered over +-AREA around the origin
+SEED = 0
+
+# Timing marks around Ursina's update task (sort 0) and Panda3D's render task (sort 50)
+_UPDATE_SORT = 0
+_RENDER_SORT = 50
+
+
+class FrameSplit:
+    """Splits each frame into the game update and the render"""
+
+    def __init__(self, taskMgr):
+        self.marks = {}
+        self.update_ms = []
+        self.render_ms = []
+        for name, sort in (('update_begin', _UPDATE_SORT - 1), ('update_end', _UPDATE_SORT + 1),
+                           ('render_begin', _RENDER_SORT - 1), ('render_end', _RENDER_SORT + 1)):
+            taskMgr.add(self._mark, f'stress_{name}', sort=sort, extraArgs=[name], appendTask=True)
+
+    def _mark(self, name, task):
+        self.marks[name] = perf_counter()
+        if name == 'update_end':
+            self.update_ms.append((self.marks['update_end'] - self.marks.get('update_begin', 0)) * 1000)
+        elif name == 'render_end':
+            self.render_ms.append((self.marks['render_end'] - self.marks.get('render_begin', 0)) * 1000)
+        return task.cont
+
+    def reset(self):
+        self.update_ms.clear()
+        self.render_ms.clear()
+
+
+def _summary(values):
+    ordered = sorted(values)
+    return {'mean': sum(ordered) / len(ordered), 'p95': percentile(ordered, 95), 'max': ordered[-1]}
+
+
+class Filler:
+    """Adds stress entities to a running game, copying its own platforms and coins"""
+
+    def __init__(self, game):
+        from ursina import Entity, color
+        self.game = game
+        self.Entity = Entity
+        self.color = color
+        self.rng = random.Random(SEED)
+        platforms = game.__dict__.get('platforms')
+        self.platform_template = platforms[0] if isinstance(platforms, list) and platforms else None
+        create_coins = game.__dict__.get('create_coins')
+        # Only ports whose create_coins() sizes itself by total_coins can be asked for N coins
+        self.create_coins = create_coins if (callable(create_coins) and 'total_coins' in game.__dict__ and
+                                             'total_coins' in create_coins.__code__.co_names) else None
+        self.coins = game.__dict__.get('coins') if isinstance(game.__dict__.get('coins'), list) else None
+        self.counts = {'platforms': 0, 'coins': 0, 'props': 0}
+
+    def _position(self, low=0.5, high=12):
+        rng = self.rng
+        return (rng.uniform(-AREA, AREA), rng.uniform(low, high), rng.uniform(-AREA, AREA))
+
+    def add_platforms(self, count):
+        template = self.platform_template
+        for _ in range(count):
+            if template is not None:
+                self.Entity(model=template.model, scale=template.scale, color=template.color,
+                            texture=template.texture, collider='box', position=self._position())
+            else:
+                self.Entity(model='cube', scale=(4, 0.5, 4), color=self.color.gray,
+                            collider='box', position=self._position())
+        self.counts['platforms'] += count
+
+    def add_coins(self, count):
+        if self.create_coins:
+            game = self.game.__dict__
+            total_coins = game['total_coins']
+            game['total_coins'] = count
+            try:
+                coins = self.create_coins()
+            finally:
+                game['total_coins'] = total_coins
+        else:
+            coins = [self.Entity(model='sphere', scale=0.5, color=self.color.yellow,
+                                 collider='sphere', position=self._position(2, 10)) for _ in range(count)]
+        if self.coins is not None:
+            self.coins.extend(coins)
+        self.counts['coins'] += len(coins)
+
+    def add_props(self, count):
+        """Decorative entities: rendered, but without colliders"""
+        for _ in range(count):
+            height = self.rng.uniform(1, 4)
+            self.Entity(model='cube', scale=(0.5, height, 0.5), color=self.color.green,
+                        position=self._position(height / 2, height / 2))
+        self.counts['props'] += count
+
+    def fill_to(self, n):
+        self.add_platforms(n - self.counts['platforms'])
+        self.add_coins(n - self.counts['coins'])
+        self.add_props(n - self.counts['props'])
+
+
+def time_collision_queries(rng, queries=QUERIES):
+    """Mean microseconds per downward raycast and per intersects() of a box at random points"""
+    from ursina import Entity, Vec3, raycast, destroy
+    points = [Vec3(rng.uniform(-AREA, AREA), rng.uniform(1, 14), rng.uniform(-AREA, AREA)) for _ in range(queries)]
+    probe = Entity(model='cube', collider='box', visible=False)
+
+    began = perf_counter()
+    for point in points:
+        raycast(point, Vec3(0, -1, 0), distance=2, ignore=(probe,))
+    raycast_us = (perf_counter() - began) / queries * 1e6
+
+    began = perf_counter()
+    for point in points:
+        probe.position = point
+        probe.intersects()
+    intersects_us = (perf_counter() - began) / queries * 1e6
+    destroy(probe)
+    return raycast_us, intersects_us
+
+
+def run_stress(script, start_n, max_n, frames, warmup, frame_limit):
+    """Run one script in this process, doubling N until max_n or frame_limit"""
+    curve = []
+
+    def stress_run(app, game):
+        from ursina import scene
+        from inputreplay import InputPlayer
+        if START.get(script):
+            exec(START[script], game.__dict__)
+        filler = Filler(game)
+        split = FrameSplit(app.taskMgr)
+        rng = random.Random(SEED)
+
+        n = start_n
+        while n <= max_n:
+            began = perf_counter()
+            filler.fill_to(n)
+            build_ms = (perf_counter() - began) * 1000
+
+            player = InputPlayer(scripted_input(warmup + frames), dt_mode='fixed', fixed_dt=FIXED_DT)
+            player.play()
+            frame_ms = []
+            for frame in range(warmup + frames):
+                if frame == warmup:
+                    split.reset()
+                began = perf_counter()
+                app.taskMgr.step()
+                frame_ms.append((perf_counter() - began) * 1000)
+            player.stop()
+
+            raycast_us, intersects_us = time_collision_queries(rng)
+            point = {
+                'n': n,
+                'entities': len(scene.entities),
+                'coins': filler.counts['coins'],
+                'build_ms': build_ms,
+                'frame_ms': _summary(frame_ms[warmup:]),
+                'update_ms': _summary(split.update_ms),
+                'render_ms': _summary(split.render_ms),
+                'raycast_us': raycast_us,
+                'intersects_us': intersects_us,
+                'draw_calls': draw_calls(),
+            }
+            curve.append(point)
+            print(f'N={n:<6} frame {point["frame_ms"]["mean"]:8.2f} ms  update {point["update_ms"]["mean"]:8.2f} ms  '
+                  f'render {point["render_ms"]["mean"]:8.2f} ms  raycast {raycast_us:8.1f} us  '
+                  f'intersects {intersects_us:8.1f} us', file=sys.stderr)
+            if point['frame_ms']['mean'] > frame_limit:
+                break
+            n *= 2
+
+    import ursina  # Imported before the script, like benchmark.py does
+    # Frame pacing would hide exactly the slowdown being measured
+    run_game(script, stress_run, offscreen=True, argv=('--no-pacing',))
+    return curve
+
+
+def _print_table(curve, baseline=None):
+    columns = (('frame', lambda p: p['frame_ms']['mean']), ('update', lambda p: p['update_ms']['mean']),
+               ('render', lambda p: p['render_ms']['mean']), ('raycast', lambda p: p['raycast_us']),
+               ('intersects', lambda p: p['intersects_us']))
+    old = {point['n']: point for point in baseline or ()}
+    print(f'{"N":>6}{"entities":>10}' + ''.join(f'{name:>18}' for name, _ in columns))
+    for point in curve:
+        cells = []
+        for name, value in columns:
+            cell = f'{value(point):.2f}'
+            if point['n'] in old:
+                cell += f' ({value(old[point["n"]]):.2f})'
+            cells.append(f'{cell:>18}')
+        print(f'{point["n"]:>6}{point["entities"]:>10}' + ''.join(cells))
+    print('frame/update/render in ms (mean), raycast/intersects in us per query' +
+          (', baseline in brackets' if baseline else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how a port scales with N platforms, coins and props')
+    parser.add_argument('script')
+    parser.add_argument('--start', type=int, default=DEFAULT_START, help='first N')
+    parser.add_argument('--max', type=int, default=DEFAULT_MAX, help='largest N')
+    parser.add_argument('--frames', type=int, default=MEASURE_FRAMES, help='frames measured at each N')
+    parser.add_argument('--warmup', type=int, default=WARMUP_FRAMES)
+    parser.add_argument('--frame-limit', type=float, default=FRAME_LIMIT_MS,
+                        help='stop once the mean frame takes longer than this many ms')
+    parser.add_argument('--output', help='curve file (default: stress_<script>.json)')
+    parser.add_argument('--compare', help='an earlier curve file to show alongside')
+    args = parser.parse_args()
+
+    curve = run_stress(args.script, args.start, args.max, args.frames, args.warmup, args.frame_limit)
+    report = {'script': args.script, 'frames': args.frames, 'fixed_dt': FIXED_DT, 'curve': curve}
+
+    script_name = os.path.splitext(os.path.basename(args.script))[0]
+    output = args.output or os.path.join(REPO_DIR, f'stress_{script_name}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['curve']
+    _print_table(curve, baseline)
+    print(f'Curve written to {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+# ULTRA MARIO 3D BROS - Tool-Assisted Route Search
+# Searches for the fastest inputs that collect every coin and then reach the
+# crown in the HackerSM64 edition (HackerSM64PYV09.21.251.0.py). The castle is
+# built once offscreen to read its colliders, coins and crown; after that the
+# search runs on the batched movement model in mariosim.py set to that port's
+# Player rules, so no game is running while it branches.
+#
+# Every branch is a row of arrays: the movement state (position, vertical
+# speed, jump flags...) and a bitmask of the coins taken so far; its frame
+# follows from its depth. SnapshotStore keeps them append-only, with a parent
+# index and the input that led there, at under 100 bytes a branch, so millions fit
+# in memory and any of them can be restored into the simulation to branch
+# again. Counters follow from the mask (score is 100 a coin). The port's only
+# timer, the invoke() that resets the message text, doesn't affect play; a
+# cooldown like test.py's portal_cooldown would be one more column holding
+# the seconds left.
+#
+#   python tas.py                       # coin layout of random seed 0
+#   python tas.py --seed 3 --beam 8000 --verify
+#
+# Each depth, every kept branch tries every input (eight directions, with and
+# without jump) for a few frames. Branches are ranked by a lower bound on the
+# time left: the distance to the nearest remaining target plus a minimum
+# spanning tree over the remaining coins and the crown, at walking speed.
+# Falling off the map drops Mario back in with his falling speed, usually
+# straight through the castle, so branches that fall off are dropped.
+# --verify plays the route back in the real game and checks the result.
+import argparse
+import json
+import os
+import random
+import sys
+from time import perf_counter
+import numpy as np
+from gamerunner import REPO_DIR, in_new_process, run_game
+from botfarm import ACTIONS, ACTION_MASKS, place_keys
+import mariosim
+
+SCRIPT = 'HackerSM64PYV09.21.251.0.py'
+DT = 1 / 60
+SEGMENT_FRAMES = 8
+MAX_SEGMENTS = 450  # 60 seconds of play
+BEAM = 4000
+MAX_COINS = 20  # Coin masks are packed next to the place into one int64
+
+# Player's defaults in the HackerSM64 edition
+PLAYER_RULES = dict(speed=5, jump_height=8, gravity=20, wall_slide_speed=2, wall_jump_push=1.5, triple_jump=False)
+PLAYER_HALF_SIZE = (0.5, 1, 0.5)  # Its box collider: a cube scaled (1, 2, 1)
+
+
+def collect_castle(seed):
+    """Build the castle with the coin layout of a random seed and return what the search needs"""
+
+    def read_castle(app, game):
+        solids = [entity for entity in game.scene.entities if entity is not game.player]
+        crown = game.crown
+        return {
+            'seed': seed,
+            'spawn': tuple(game.player.position),
+            'fall_limit': -20 if game.HACKER_SM64_CONFIG['extended_bounds'] else -10,
+            'improved_collision': game.HACKER_SM64_CONFIG['improved_collision'],
+            'coins': [tuple(coin.world_position) for coin in game.coins],
+            # A sphere collider's radius is half the entity's scale
+            'coin_radius': game.coins[0].world_scale_x / 2 if game.coins else 0,
+            'crown': (tuple(crown.world_position), tuple(crown.world_scale)),
+            'colliders': mariosim.Colliders.from_entities(solids).to_lists(),
+        }
+
+    # The port places its coins with the random module as it starts
+    return run_game(SCRIPT, read_castle, offscreen=True, before_app=lambda: random.seed(seed),
+                    argv=('--no-pacing',))
+
+
+def touching_coins(position, coins, radius):
+    """For every player and coin, whether the player's box touches the coin's sphere, like intersects()"""
+    gaps = np.maximum(np.abs(position[:, None, :] - coins) - np.array(PLAYER_HALF_SIZE), 0)
+    return np.linalg.norm(gaps, axis=2) < radius
+
+
+class SnapshotStore:
+    """Append-only store of branches as columns of arrays, with a parent and an input per branch"""
+
+    def __init__(self):
+        self.batches = []  # One dict of arrays per add()
+        self.starts = []  # Index of each batch's first branch
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for batch in self.batches for values in batch.values())
+
+    def add(self, state, parents, actions):
+        """Store a batch of branches (state: dict of arrays, one row each); returns their indices"""
+        batch = dict(state)
+        batch['parent'] = np.asarray(parents, dtype=np.int64)
+        batch['action'] = np.asarray(actions, dtype=np.uint8)
+        self.batches.append(batch)
+        self.starts.append(self.count)
+        self.count += len(batch['parent'])
+        return np.arange(self.count - len(batch['parent']), self.count)
+
+    def gather(self, indices, names=None):
+        """The state of some branches, as one dict of arrays ready for MarioSim.restore()"""
+        indices = np.asarray(indices, dtype=np.int64)
+        batch_of = np.searchsorted(self.starts, indices, side='right') - 1
+        names = names or [name for name in self.batches[0] if name not in ('parent', 'action')]
+        gathered = {}
+        for name in names:
+            values = None
+            for batch_index in np.unique(batch_of):
+                rows = batch_of == batch_index
+                column = self.batches[batch_index][name]
+                if values is None:
+                    values = np.empty((len(indices),) + column.shape[1:], dtype=column.dtype)
+                values[rows] = column[indices[rows] - self.starts[batch_index]]
+            gathered[name] = values
+        return gathered
+
+    def path(self, index):
+        """Actions from the root to a branch, oldest first"""
+        actions = []
+        while index > 0:
+            batch_index = np.searchsorted(self.starts, index, side='right') - 1
+            batch = self.batches[batch_index]
+            row = index - self.starts[batch_index]
+            actions.append(int(batch['action'][row]))
+            index = int(batch['parent'][row])
+        return actions[::-1]
+
+
+def _tree_lengths(points):
+    """Minimum spanning tree length over every subset of points, indexed by bitmask"""
+    count = len(points)
+    lengths = np.zeros(1 << count)
+    pairwise = np.linalg.norm(points[:, None] - points[None], axis=2)
+    for mask in range(1, 1 << count):
+        members = [i for i in range(count) if mask >> i & 1]
+        # Prim's algorithm over the members
+        best = pairwise[members[0], members].copy()
+        done = np.zeros(len(members), dtype=bool)
+        done[0] = True
+        total = 0.0
+        for _ in range(len(members) - 1):
+            nearest = np.argmin(np.where(done, np.inf, best))
+            total += best[nearest]
+            done[nearest] = True
+            best = np.minimum(best, pairwise[members[nearest], members])
+        lengths[mask] = total
+    return lengths
+
+
+def search(castle, max_segments=MAX_SEGMENTS, beam=BEAM, segment_frames=SEGMENT_FRAMES, log=None):
+    """Beam search for the fastest route; returns the best branch found as a dict"""
+    coin_count = len(castle['coins'])
+    if coin_count > MAX_COINS:
+        raise ValueError(f'{coin_count} coins is more than the {MAX_COINS} the search can track')
+    colliders = mariosim.Colliders(castle['colliders']['centers'], castle['colliders']['sizes'])
+    sim = mariosim.MarioSim(colliders, count=1, start=castle['spawn'],
+                            improved_collision=castle['improved_collision'], **PLAYER_RULES)
+
+    coins = np.array(castle['coins'], dtype=np.float64).reshape(-1, 3)
+    half = np.array(PLAYER_HALF_SIZE)
+    crown_center, crown_scale = (np.array(value) for value in castle['crown'])
+    crown_reach = np.abs(crown_scale) / 2 + half
+    all_coins = (1 << coin_count) - 1
+    # Targets are the coins then the crown; the crown is always still to reach
+    targets = np.vstack([coins, crown_center])
+    tree = _tree_lengths(targets)
+    target_bits = (1 << np.arange(coin_count + 1)).astype(np.int64)
+
+    def frames_left(position, taken):
+        remaining = (all_coins & ~taken) | (1 << coin_count)
+        distances = np.linalg.norm(position[:, None, :] - targets, axis=2)
+        distances[(remaining[:, None] & target_bits) == 0] = np.inf
+        return (distances.min(axis=1) + tree[remaining]) / PLAYER_RULES['speed'] / DT
+
+    store = SnapshotStore()
+    frontier = store.add(dict(sim.state(), coins=np.zeros(1, dtype=np.int64)), [-1], [0])
+    visited = set()
+    best = {'index': 0, 'frames': 0, 'coins': 0, 'victory': False, 'left': np.inf}
+
+    for depth in range(max_segments):
+        if not len(frontier):
+            break
+        state = store.gather(frontier)
+        parents = np.repeat(frontier, len(ACTIONS))
+        actions = np.tile(np.arange(len(ACTIONS)), len(frontier))
+        rows = np.repeat(np.arange(len(frontier)), len(ACTIONS))
+        sim.restore(state, rows)
+        taken = state['coins'][rows]
+        keys = ACTION_MASKS[actions]
+        won_at = np.full(len(rows), -1)
+
+        for frame in range(segment_frames):
+            grounded = sim.step(keys, DT)
+            position = sim.position.astype(np.float64)
+            taken |= (touching_coins(position, coins, castle['coin_radius']) * target_bits[:coin_count]).sum(axis=1)
+            # The crown only counts once every coin is taken
+            on_crown = np.all(np.abs(position - crown_center) < crown_reach, axis=1) & (taken == all_coins)
+            won_at[(won_at < 0) & on_crown] = frame + 1
+
+        if (won_at > 0).any():
+            # Every branch in a depth started on the same frame, so the earliest win is the fastest
+            row = np.flatnonzero(won_at > 0)[np.argmin(won_at[won_at > 0])]
+            index = store.add({name: values[[row]] for name, values in sim.state().items()} |
+                              {'coins': taken[[row]]}, parents[[row]], actions[[row]])[0]
+            frames = depth * segment_frames + int(won_at[row])
+            return _route(store, index, frames, coin_count, True, segment_frames, won_at[row])
+
+        alive = sim.position[:, 1] > castle['fall_limit']
+        place = place_keys(sim, grounded) * (1 << coin_count) + taken
+        _, first = np.unique(place, return_index=True)
+        fresh = np.array([row for row in np.sort(first) if alive[row] and place[row] not in visited], dtype=np.int64)
+        visited.update(place[fresh].tolist())
+        if len(fresh) > beam:
+            order = np.argsort(frames_left(sim.position[fresh].astype(np.float64), taken[fresh]), kind='stable')
+            fresh = fresh[np.sort(order[:beam])]
+
+        kept = {name: values[fresh] for name, values in sim.state().items()}
+        frontier = store.add(dict(kept, coins=taken[fresh]), parents[fresh], actions[fresh])
+
+        if len(fresh):
+            left = frames_left(kept['position'].astype(np.float64), taken[fresh])
+            counts = np.array([bin(mask).count('1') for mask in taken[fresh].tolist()])
+            leader = np.lexsort((left, -counts))[0]
+            if (counts[leader], -left[leader]) > (best['coins'], -best['left']):
+                best = {'index': int(frontier[leader]), 'frames': (depth + 1) * segment_frames,
+                        'coins': int(counts[leader]), 'victory': False, 'left': float(left[leader])}
+        if log and depth % 25 == 0:
+            log(f'depth {depth}: {len(frontier)} branches, {len(store)} stored '
+                f'({store.nbytes / 1e6:.0f} MB), best {best["coins"]}/{coin_count} coins')
+    return _route(store, best['index'], best['frames'], coin_count, False, segment_frames)
+
+
+def _route(store, index, frames, coin_count, victory, segment_frames, last_frames=None):
+    actions = store.path(index)
+    inputs = [[list(ACTIONS[action]), segment_frames] for action in actions]
+    if last_frames is not None and inputs:
+        inputs[-1][1] = int(last_frames)
+    taken = int(store.gather([index], ['coins'])['coins'][0])
+    return {'victory': victory, 'frames': frames, 'seconds': round(frames * DT, 3),
+            'coins': bin(taken).count('1'), 'total_coins': coin_count, 'branches': len(store),
+            'snapshot_mb': round(store.nbytes / 1e6, 1), 'inputs': inputs}
+
+
+def recording_from_inputs(inputs, seed=0):
+    """An input Recording that holds each (keys, frames) entry of a route"""
+    from inputreplay import Recording
+    recording = Recording(seed=seed, script='tas')
+    held = ()
+    for keys, frames in inputs:
+        keys = tuple(keys)
+        for i in range(frames):
+            events = ()
+            if i == 0:
+                events = tuple(f'{key} up' for key in held if key not in keys) + \
+                         tuple(key for key in keys if key not in held)
+                held = keys
+            recording.frames.append((DT, (0.0, 0.0), (0.0, 0.0), events))
+    return recording
+
+
+def verify_route(seed, inputs):
+    """Play a route back in the real game; returns what it got to"""
+
+    def play(app, game):
+        from inputreplay import InputPlayer
+        game.start_game()
+        recording = recording_from_inputs(inputs, seed)
+        player = InputPlayer(recording, dt_mode='fixed', fixed_dt=DT)
+        player.play()
+        for _ in range(len(recording) + 1):
+            app.taskMgr.step()
+        player.stop()
+        return {'state': game.state, 'coins': game.coins_collected, 'position': list(game.player.position)}
+
+    return run_game(SCRIPT, play, offscreen=True, before_app=lambda: random.seed(seed), argv=('--no-pacing',))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search for the fastest all-coins-then-crown route')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the coin layout')
+    parser.add_argument('--depth', type=int, default=MAX_SEGMENTS, help=f'input segments of {SEGMENT_FRAMES} frames')
+    parser.add_argument('--beam', type=int, default=BEAM, help='branches kept per depth')
+    parser.add_argument('--verify', action='store_true', help='play the route back in the game')
+    parser.add_argument('--output', help='route file (default: tas_<seed>.json)')
+    args = parser.parse_args()
+
+    castle = in_new_process(collect_castle, args.seed)
+    began = perf_counter()
+    route = search(castle, args.depth, args.beam, log=lambda line: print(line, file=sys.stderr))
+    route['search_seconds'] = round(perf_counter() - began, 2)
+    route['seed'] = args.seed
+    if args.verify:
+        route['verified'] = in_new_process(verify_route, args.seed, route['inputs'])
+
+    output = args.output or os.path.join(REPO_DIR, f'tas_{args.seed}.json')
+    with open(output, 'w') as f:
+        json.dump(route, f, indent=2)
+
+    outcome = 'VICTORY' if route['victory'] else 'no complete route'
+    print(f'{outcome}: {route["coins"]}/{route["total_coins"]} coins in {route["seconds"]} s, '
+          f'{len(route["inputs"])} inputs; searched {route["branches"]} branches '
+          f'({route["snapshot_mb"]} MB) in {route["search_seconds"]} s')
+    if args.verify:
+        verified = route['verified']
+        print(f'In the game: {verified["state"]}, {verified["coins"]} coins')
+    print(f'Route written to {output}')
+    return 0 if route['victory'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())